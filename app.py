@@ -7,6 +7,7 @@ import streamlit as st
 from pathlib import Path
 import json
 import sys
+import time
 
 # 確保 project root 在 sys.path
 PROJECT_ROOT = Path(__file__).parent
@@ -14,6 +15,22 @@ if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
 
+# ─── 冷啟動預熱：背景先建立連線與 context cache（每個 process 一次） ─── #
+from services import startup
+
+
+@st.cache_resource(show_spinner=False)
+def get_prewarm():
+    return startup.prewarm()
+
+
+# ─── 發布 worker：process 內的 daemon thread，另外執行 publish_worker.py 時自動讓出 ─── #
+@st.cache_resource(show_spinner=False)
+def get_publish_worker():
+    from publish_worker import start_in_app_worker
+    return start_in_app_worker()
+
+
 # ─── Page Config ─── #
 st.set_page_config(
     page_title="社群貼文寫手",
@@ -21,13 +38,15 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="collapsed",
 )
+get_prewarm()
+get_publish_worker()
 
 # Debug: Print Session State
 # st.write("Current Session State:", st.session_state)
 
 
 # ─── Custom CSS ─── #
-st.markdown("""
+PAGE_CSS = """
 <style>
     /* 主容器 */
     .main .block-container {
@@ -104,7 +123,18 @@ st.markdown("""
     #MainMenu {visibility: hidden;}
     footer {visibility: hidden;}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+@st.cache_resource(show_spinner=False)
+def minified_css() -> str:
+    """去掉註解與多餘空白後快取；每次 rerun 仍須重新送出（Streamlit 只保留本次 run 產生的元素）"""
+    import re
+    css = re.sub(r"/\*.*?\*/", "", PAGE_CSS, flags=re.DOTALL)
+    return re.sub(r"\s*([{};:,>])\s*", r"\1", re.sub(r"\s+", " ", css)).strip()
+
+
+st.markdown(minified_css(), unsafe_allow_html=True)
 
 
 # ─── Session State 初始化 ─── #
@@ -115,19 +145,227 @@ DEFAULTS = {
     "edited_article": "",
     "article_confirmed": False,
     "image_prompts": [],
+    "regenerate_prompts": False,
+    "prompts_prefetch": None,
 
 
     "selected_prompt_idx": None,
-    "generated_image_path": None,
-    "post_result": None,
+    "generated_image_id": None,
+    "regenerate_image": False,
+    "render_all_styles": False,
+    "generated_images": {},
+    "image_errors": {},
+    "publish_job_ids": [],
+    "article_job": None,
+    "prompts_job": None,
+    "image_job": None,
+    "draft_id": None,
+    "duplicate_matches": None,
 }
 
 
 
+STEP_LABELS = ["素材輸入", "文章生成", "圖片Prompt", "圖片生成", "發布FB"]
+
+# 每一步寫入草稿庫的 session 欄位（步驟 4 另外記錄圖片在資產庫中的雜湊）
+CHECKPOINT_KEYS = {
+    1: ("raw_material",),
+    2: ("generated_article", "edited_article", "article_confirmed"),
+    3: ("image_prompts",),
+    4: ("selected_prompt_idx", "render_all_styles"),
+    5: ("publish_job_ids",),
+}
+
 for key, val in DEFAULTS.items():
     if key not in st.session_state:
         st.session_state[key] = val
 
+# 生成的圖片只放在本 session 的記憶體中（以 ID 存取），session 結束即回收
+if "image_store" not in st.session_state:
+    from services.image_store import ImageStore
+    st.session_state.image_store = ImageStore()
+
+
+def get_image(artifact_id):
+    """依 ID 取出本 session 的圖片；已被淘汰時回傳 None"""
+    return st.session_state.image_store.get(artifact_id)
+
+
+# ─── 背景工作：Gemini 呼叫在 job thread 執行，頁面只輪詢狀態 ─── #
+from services.jobs import DONE, JobCancelled, submit, submit_call
+
+JOB_POLL_SECONDS = 0.5
+
+
+def wait_for_job(job, label: str, render=None):
+    """
+    工作還在跑：顯示進度與取消鈕並結束本次 script run；已結束則直接返回。
+    等待期間只有這個區塊（render(job) 畫的部分結果 + 進度條）每 JOB_POLL_SECONDS 重畫，
+    側欄與頁面其他部分不重跑；工作結束時整頁重跑一次，由呼叫端處理結果。
+    """
+    if job.done():
+        return
+
+    @st.fragment(run_every=JOB_POLL_SECONDS)
+    def progress():
+        if job.done():
+            st.rerun(scope="app")
+        if render is not None:
+            render(job)
+        st.progress(job.progress, text=f"{label} {job.message}（{job.elapsed:.0f} 秒）")
+        if st.button("⏹️ 取消", key=f"cancel_{job.id}"):
+            job.cancel()
+            st.rerun(scope="app")
+
+    progress()
+    st.stop()
+
+
+def render_article_partial(job):
+    """串流中的文章預覽"""
+    if job.partial:
+        st.markdown(f"<div class='article-preview'>{job.partial}</div>", unsafe_allow_html=True)
+
+
+def stream_article_task(job, raw_material: str, brand: str, no_cache: bool = False) -> str:
+    """串流生成文章，部分結果放在 job.partial 供頁面即時顯示"""
+    from services.gemini_service import generate_article_stream
+
+    article = ""
+    for chunk in generate_article_stream(raw_material, brand=brand, no_cache=no_cache):
+        if job.cancelled:
+            raise JobCancelled()
+        article += chunk
+        job.report(partial=article, message=f"已生成 {len(article)} 字")
+    return article
+
+
+def render_styles_task(job, prompt_texts: dict) -> dict:
+    """多種風格同時生成，完成一張就放進 job.partial：{idx: artifact 或 Exception}"""
+    from services.gemini_service import generate_images_parallel
+
+    results = {}
+    for i, artifact, err in generate_images_parallel(prompt_texts):
+        results[i] = err if err is not None else artifact
+        job.report(progress=len(results) / len(prompt_texts), partial=dict(results),
+                   message=f"{len(results)}/{len(prompt_texts)} 完成")
+        if job.cancelled:
+            raise JobCancelled()
+    return results
+
+
+def render_style_card(i: int, p: dict):
+    """顯示一組圖片風格（標題 + 可展開的完整描述）"""
+    with st.container():
+        st.markdown(f"""
+<div class='style-card'>
+<h4>🎨 風格 {i+1}：{p.get('style_name_zh', '')} / {p.get('style_name_en', '')}</h4>
+</div>
+""", unsafe_allow_html=True)
+
+        with st.expander(f"查看完整描述 - 風格 {i+1}"):
+            st.markdown(f"**中文長描述：**\n{p.get('long_desc_zh', '')}")
+            st.markdown(f"**English Long Description：**\n{p.get('long_desc_en', '')}")
+            st.divider()
+            st.markdown(f"**簡短提示語（中）：** {p.get('short_prompt_zh', '')}")
+            st.markdown(f"**Short Prompt (EN)：** {p.get('short_prompt_en', '')}")
+
+
+def save_checkpoint(step: int):
+    """把這一步的結果寫入草稿庫；重新整理、重新部署或切換品牌後可從側欄「📂 草稿」接續"""
+    from services.draft_store import get_draft_store
+    store = get_draft_store()
+    if st.session_state.draft_id is None:
+        st.session_state.draft_id = store.create(st.session_state.brand, st.session_state.raw_material)
+    state = {key: st.session_state[key] for key in CHECKPOINT_KEYS[step]}
+    if step == 4:
+        # 圖片本身在資產庫，只記內容雜湊
+        image = get_image(st.session_state.generated_image_id)
+        state["image_asset"] = image.asset_id if image is not None else None
+        state["image_assets"] = {
+            i: get_image(aid).asset_id for i, aid in st.session_state.generated_images.items()
+            if get_image(aid) is not None
+        }
+    store.checkpoint(st.session_state.draft_id, step, state)
+    if step in (1, 5):
+        # 素材與發布的文章加入主題索引，之後輸入相近素材時提醒
+        from services.topic_index import ARTICLE, MATERIAL, get_topic_index
+        kind, text = (MATERIAL, st.session_state.raw_material) if step == 1 else (ARTICLE, st.session_state.edited_article)
+        get_topic_index().add(st.session_state.draft_id, kind, text, brand=st.session_state.brand)
+
+
+def restore_image(asset_id: str, prompt: str = ""):
+    """從資產庫取回圖片放進 session 暫存；已被淘汰時回傳 None（步驟 4 會重新生成）"""
+    from services.asset_store import get_asset_store
+    from services.image_store import ImageArtifact
+    asset = get_asset_store().get(asset_id) if asset_id else None
+    if asset is None:
+        return None
+    artifact = ImageArtifact(asset.data, asset.mime, prompt, thumbnail=asset.thumbnail, asset_id=asset.sha256)
+    return st.session_state.image_store.put(artifact)
+
+
+def discard_prompts_prefetch():
+    """丟棄尚未被步驟 3 接手的圖片 Prompt 預先生成，執行中的 Gemini 呼叫一併取消"""
+    prefetch = st.session_state.prompts_prefetch
+    st.session_state.prompts_prefetch = None
+    if prefetch is not None:
+        prefetch.discard()
+
+
+def reset_flow():
+    """重置流程狀態（不含品牌）"""
+    discard_prompts_prefetch()
+    for key, val in DEFAULTS.items():
+        st.session_state[key] = val
+    st.session_state.image_store.clear()
+
+
+def on_article_ready(article: str):
+    st.session_state.generated_article = article
+    st.session_state.edited_article = article
+    save_checkpoint(1)
+    save_checkpoint(2)
+    # 使用者審稿的同時，先在背景生成圖片 Prompt；重新生成出同一篇時沿用原本的工作
+    from services.prefetch import prefetch_image_prompts
+    previous = st.session_state.prompts_prefetch
+    if previous is not None and previous.matches(article):
+        return
+    discard_prompts_prefetch()
+    st.session_state.prompts_prefetch = prefetch_image_prompts(article)
+
+
+def resume_draft(draft_id: str, step: int):
+    """從草稿庫回到某一步：套用該步（含）之前的 checkpoint，不再呼叫 Gemini 重新生成"""
+    from services.draft_store import get_draft_store
+    from services.prefetch import prefetch_image_prompts, prefetched_image_prompts
+    checkpoints = get_draft_store().checkpoints(draft_id)
+    reset_flow()
+    st.session_state.draft_id = draft_id
+
+    for s in range(1, step + 1):
+        state = dict(checkpoints.get(s, {}))
+        image_asset = state.pop("image_asset", None)
+        image_assets = state.pop("image_assets", {})
+        for key, val in state.items():
+            st.session_state[key] = val
+        if s == 4:
+            prompts = st.session_state.image_prompts
+            # JSON 的 key 是字串，轉回風格索引
+            restored = {int(i): restore_image(aid, prompts[int(i)].get("short_prompt_en", ""))
+                        for i, aid in image_assets.items()}
+            st.session_state.generated_images = {i: aid for i, aid in restored.items() if aid is not None}
+            st.session_state.generated_image_id = restore_image(image_asset)
+
+    if step == 2:
+        # 回到審稿：已有的圖片 Prompt 在文章未修改時沿用，否則在背景重新生成
+        article = st.session_state.edited_article
+        prompts = checkpoints.get(3, {}).get("image_prompts")
+        st.session_state.prompts_prefetch = (
+            prefetched_image_prompts(article, prompts) if prompts else prefetch_image_prompts(article)
+        )
+    st.session_state.current_step = step
+
 
 # ─── Sidebar: 設定 & 工具 ─── #
 with st.sidebar:
@@ -135,19 +373,16 @@ with st.sidebar:
 
     # 品牌選擇
     st.markdown("#### 🏥 選擇品牌/粉專")
-    brand_map = {
-        "default": "永芯居家長照",
-        "houjiazai": "厚家載藥師",
-    }
+    from services.brands import get_brand, list_brands
+    brand_map = {b.key: b.name for b in list_brands()}
     
-    # 確保 session_state 有 brand
-    if "brand" not in st.session_state:
+    # 確保 session_state 有 brand（品牌設定檔改過時退回 default）
+    if st.session_state.get("brand") not in brand_map:
         st.session_state.brand = "default"
 
     def on_brand_change():
-        """當品牌改變時，重置流程狀態"""
-        for key, val in DEFAULTS.items():
-            st.session_state[key] = val
+        """當品牌改變時，重置流程狀態（已完成的步驟都在草稿庫，切回原品牌可從「📂 草稿」接續）"""
+        reset_flow()
 
     st.radio(
         "目前身分：",
@@ -170,14 +405,7 @@ with st.sidebar:
 
     
     # 檢查當前選擇品牌的 FB 設定
-    if st.session_state.brand == "houjiazai":
-        fb_token = st.secrets.get("FB_PAGE_ACCESS_TOKEN_HOUJIAZAI")
-        fb_page = st.secrets.get("FB_PAGE_ID_HOUJIAZAI")
-    else:
-        fb_token = st.secrets.get("FB_PAGE_ACCESS_TOKEN")
-        fb_page = st.secrets.get("FB_PAGE_ID")
-
-    fb_ok = bool(fb_token) and bool(fb_page)
+    fb_ok = get_brand(st.session_state.brand).configured
 
     st.markdown(f"- Gemini API: {'✅ 已設定' if gemini_ok else '❌ 未設定'}")
     st.markdown(f"- Facebook API ({brand_map[st.session_state.brand]}): {'✅ 已設定' if fb_ok else '❌ 未設定'}")
@@ -187,23 +415,113 @@ with st.sidebar:
 
     st.divider()
 
-    # FB Token 驗證
+    # FB Token 健康狀態（背景定期檢查，不需點擊）
     if fb_ok:
-        if st.button("🔍 驗證 Facebook Token"):
-            try:
-                from services.facebook_service import verify_token
-                info = verify_token(st.session_state.brand) # Use .brand directly
-                st.success(f"✅ Token 有效！粉專：{info.get('name', 'N/A')}")
-            except Exception as e:
-                st.error(f"Token 無效：{e}")
+        import datetime as dt
+        from services.token_health import OK, UNKNOWN, get_token_monitor
+        monitor = get_token_monitor()
+        token_status = monitor.get(st.session_state.brand)
+        if token_status is None:
+            st.caption("⏳ Token 檢查中…")
+        elif token_status.invalid:
+            st.error(f"Token 無效：{'已過期' if token_status.expired else token_status.error}")
+        elif token_status.state == UNKNOWN:
+            st.warning(f"暫時無法確認 Token 狀態：{token_status.error}")
+        elif token_status.state == OK:
+            expiry = (
+                dt.datetime.fromtimestamp(token_status.expires_at).strftime("%Y-%m-%d")
+                if token_status.expires_at else "不會過期"
+            )
+            st.success(f"✅ Token 有效！粉專：{token_status.page_name or 'N/A'}（到期：{expiry}）")
+            if token_status.expiring_soon:
+                st.warning("⚠️ Token 即將到期，請盡快更新")
+            if token_status.missing_scopes:
+                st.warning(f"⚠️ Token 缺少權限：{', '.join(sorted(token_status.missing_scopes))}")
+
+        if st.button("🔍 重新驗證 Facebook Token"):
+            monitor.check(st.session_state.brand, force=True)
+            st.rerun()
+
+    st.divider()
+
+    # 草稿庫：UI 中做到一半的草稿，以及 batch_cli.py --batch-api 生成的草稿（目前品牌）
+    # 用開關而不是 expander：收合的 expander 內容每次 rerun 仍會執行，關閉時就不查草稿庫
+    if st.toggle("📂 草稿", key="show_drafts"):
+        import datetime as dt
+        from services.draft_store import OPENABLE, get_draft_store, resumable_steps
+        store = get_draft_store()
+        drafts = store.list_drafts(OPENABLE, brand=st.session_state.brand, limit=50)
+        if drafts:
+            picked = st.selectbox(
+                "選擇草稿",
+                options=range(len(drafts)),
+                format_func=lambda i: (
+                    f"{dt.datetime.fromtimestamp(drafts[i]['updated_at']):%m/%d %H:%M} · "
+                    f"{'📥 ' if drafts[i]['source'] == 'batch' else ''}{drafts[i]['raw_material'][:20]}"
+                ),
+            )
+            draft = drafts[picked]
+            steps = resumable_steps(store.checkpoints(draft["id"]))
+            step = st.selectbox(
+                "回到步驟",
+                options=steps,
+                index=len(steps) - 1,
+                format_func=lambda s: f"{s}. {STEP_LABELS[s - 1]}",
+            )
+            if st.button("↩️ 繼續這篇草稿", use_container_width=True):
+                resume_draft(draft["id"], step)
+                st.rerun()
+        else:
+            st.caption("尚無草稿")
+
+    st.divider()
+
+    # 最近的服務呼叫耗時（本 process 所有 session 合計）；打開時才匯入 / 查詢各服務
+    if st.toggle("📊 效能統計", key="show_stats"):
+        from services.metrics import summary
+        rows = summary()
+        if rows:
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+        else:
+            st.caption("尚無呼叫紀錄")
+
+        # 冷啟動：預熱各階段耗時，以及各呼叫第一次完成時距 process 啟動的秒數
+        cold = startup.report()
+        if cold["timings"] or cold["first_requests"]:
+            st.markdown("**🚀 冷啟動**")
+            st.dataframe(
+                [{"項目": k, "秒": v} for k, v in cold["timings"].items()]
+                + [{"項目": f"首次 {k}", "秒": v["since_start"]} for k, v in cold["first_requests"].items()],
+                hide_index=True,
+                use_container_width=True,
+            )
+
+        # 圖片資產庫：同一個 prompt 不重複生成
+        from services.asset_store import get_asset_store
+        assets = get_asset_store().stats()
+        if assets["images"]:
+            st.caption(f"🖼️ 圖片資產庫：{assets['images']} 張 / {assets['prompts']} 個 prompt，"
+                       f"{assets['bytes'] / 1024 / 1024:.1f} / {assets['max_bytes'] / 1024 / 1024:.0f} MB")
+
+        # 模型路由：各任務備援鏈上每個模型最近的狀態
+        from services.gemini_service import get_model_router
+        routes = [r for r in get_model_router().summary() if r["calls"]]
+        if routes:
+            st.markdown("**🧭 模型路由**")
+            st.dataframe(
+                [{"任務": r["task"], "模型": r["model"], "呼叫": r["calls"], "錯誤率": round(r["error_rate"], 2),
+                  "429": round(r["throttle_rate"], 2), "p50 秒": r["p50_s"], "降級": "⚠️" if r["degraded"] else ""}
+                 for r in routes],
+                hide_index=True,
+                use_container_width=True,
+            )
 
     st.divider()
 
     # 重置流程
     if st.button("🗑️ 重置整個流程", use_container_width=True):
         # 僅重置流程狀態，不重置品牌
-        for key, val in DEFAULTS.items():
-            st.session_state[key] = val
+        reset_flow()
         st.rerun()
 
     st.divider()
@@ -213,9 +531,8 @@ with st.sidebar:
 
 # ─── 步驟指示器 ─── #
 def render_step_indicator():
-    steps = ["素材輸入", "文章生成", "圖片Prompt", "圖片生成", "發布FB"]
-    cols = st.columns(len(steps))
-    for i, (col, label) in enumerate(zip(cols, steps), 1):
+    cols = st.columns(len(STEP_LABELS))
+    for i, (col, label) in enumerate(zip(cols, STEP_LABELS), 1):
         with col:
             if i < st.session_state.current_step:
                 st.markdown(f"<div style='text-align:center'><span class='step-badge step-done'>✓</span><br><small>{label}</small></div>", unsafe_allow_html=True)
@@ -256,30 +573,56 @@ if st.session_state.current_step == 1:
         if not raw.strip():
             st.warning("請先輸入素材！")
         else:
+            # 先比對過去的素材與已發布文章，幾乎相同時讓使用者選擇沿用
+            from services.topic_index import get_topic_index
+            matches = get_topic_index().search(raw.strip(), exclude=st.session_state.draft_id)
+            if matches:
+                st.session_state.duplicate_matches = {"raw_material": raw.strip(), "matches": matches}
+            else:
+                st.session_state.article_job = submit(stream_article_task, raw.strip(), st.session_state.brand)
+            st.rerun()
 
-            with st.spinner("✨ AI 正在撰寫衛教貼文..."):
-                try:
-                    # Debug Info
-                    st.write(f"Debug: 正在為品牌 '{st.session_state.brand}' 生成文章...")
-                    
-                    from services.gemini_service import generate_article
-                    # Pass the selected brand to generate_article
-                    article = generate_article(raw.strip(), brand=st.session_state.brand)
-                    
-
-
-                    st.write("Debug: 文章生成成功！長度:", len(article))
-                    # st.write("Debug Preview:", article[:100] + "...")
-                    
-                    st.session_state.generated_article = article
-                    st.session_state.edited_article = article
-                    st.session_state.current_step = 2
-                    st.rerun()
-
+    duplicates = st.session_state.duplicate_matches
+    if duplicates is not None and duplicates["raw_material"] != raw.strip():
+        # 素材改過了，重新按生成時再比對
+        st.session_state.duplicate_matches = duplicates = None
+    if duplicates is not None and st.session_state.article_job is None:
+        from services.draft_store import get_draft_store
+        store = get_draft_store()
+        st.warning("⚠️ 這份素材與過去的內容幾乎相同，可以直接沿用舊草稿，不必重新生成。")
+        for match in duplicates["matches"]:
+            draft = store.get(match["draft_id"])
+            kind = "已發布文章" if match["kind"] == "article" else "素材"
+            when = time.strftime("%Y-%m-%d", time.localtime(match["created_at"]))
+            c1, c2 = st.columns([4, 1])
+            with c1:
+                st.markdown(f"**{match['score']:.0%}** 相似 · {kind} · {brand_map.get(match['brand'], match['brand'])} · {when}  \n{match['preview']}…")
+            with c2:
+                if draft is not None and draft["brand"] == st.session_state.brand and draft["article"]:
+                    if st.button("↩️ 沿用", key=f"reuse_{match['draft_id']}", use_container_width=True):
+                        resume_draft(match["draft_id"], 2)
+                        st.rerun()
+                elif draft is not None and draft["brand"] != st.session_state.brand:
+                    st.caption("其他品牌")
+        if st.button("仍要生成新文章"):
+            st.session_state.duplicate_matches = None
+            st.session_state.article_job = submit(stream_article_task, raw.strip(), st.session_state.brand)
+            st.rerun()
 
-                except Exception as e:
-                    st.error(f"生成失敗詳情：{str(e)}")
-                    st.exception(e) # This prints the stack trace
+    job = st.session_state.article_job
+    if job is not None:
+        # 串流生成：邊生成邊顯示
+        wait_for_job(job, "✨ AI 正在撰寫衛教貼文...", render=render_article_partial)
+
+        st.session_state.article_job = None
+        if job.error() is not None:
+            st.error(f"生成失敗詳情：{str(job.error())}")
+            st.exception(job.error()) # This prints the stack trace
+        elif job.status == DONE:
+            article = job.result()
+            on_article_ready(article)
+            st.session_state.current_step = 2
+            st.rerun()
 
 
 
@@ -300,28 +643,41 @@ elif st.session_state.current_step == 2:
     st.session_state.edited_article = edited
 
 
+    # 重新生成時的串流預覽位置
+    regen_preview = st.empty()
+
     col1, col2, col3 = st.columns([1, 1, 2])
     with col1:
         if st.button("⬅️ 返回修改素材", use_container_width=True):
             st.session_state.current_step = 1
             st.rerun()
     with col2:
-        if st.button("🔄 重新生成", use_container_width=True):
-            with st.spinner("✨ 重新生成中..."):
-                try:
-                    from services.gemini_service import generate_article
-                    article = generate_article(st.session_state.raw_material.strip(), brand=st.session_state.brand)
-                    st.session_state.generated_article = article
-                    st.session_state.edited_article = article
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"生成失敗：{e}")
+        if st.button("🔄 重新生成", use_container_width=True, disabled=st.session_state.article_job is not None):
+            # 重新生成要拿到新版本，略過快取
+            st.session_state.article_job = submit(
+                stream_article_task, st.session_state.raw_material.strip(), st.session_state.brand, no_cache=True
+            )
+            st.rerun()
     with col3:
         if st.button("✅ 確認文章", type="primary", use_container_width=True):
             st.session_state.article_confirmed = True
+            save_checkpoint(2)
             st.session_state.current_step = 3
             st.rerun()
 
+    # 重新生成中：串流顯示在按鈕上方，完成後取代編輯中的文章
+    job = st.session_state.article_job
+    if job is not None:
+        with regen_preview.container():
+            wait_for_job(job, "✨ 重新生成中...", render=render_article_partial)
+
+        st.session_state.article_job = None
+        if job.error() is not None:
+            st.error(f"生成失敗：{job.error()}")
+        elif job.status == DONE:
+            on_article_ready(job.result())
+            st.rerun()
+
     st.divider()
 
     # 預覽
@@ -338,35 +694,55 @@ elif st.session_state.current_step == 3:
 
     # 如果還沒生成圖片 prompts，先生成
     if not st.session_state.image_prompts:
-        with st.spinner("🎨 AI 正在創作 3 種風格的影像描述..."):
-            try:
-                from services.gemini_service import generate_image_prompts
-                prompts = generate_image_prompts(st.session_state.edited_article)
-                st.session_state.image_prompts = prompts
-                st.rerun()
-            except Exception as e:
-                st.error(f"生成圖片 Prompt 失敗：{e}")
-                if st.button("🔄 重試"):
-                    st.rerun()
-                st.stop()
+        from services.prefetch import image_prompts_task
+        job = st.session_state.prompts_job
+        if job is None:
+            prefetch = st.session_state.prompts_prefetch
+            st.session_state.prompts_prefetch = None
+            if prefetch is not None:
+                # 文章未修改才接手背景結果；已修改就丟棄
+                if prefetch.matches(st.session_state.edited_article) and not st.session_state.regenerate_prompts:
+                    job = prefetch.job
+                else:
+                    prefetch.discard()
+            if job is None:
+                job = submit(
+                    image_prompts_task,
+                    st.session_state.edited_article,
+                    no_cache=st.session_state.regenerate_prompts,
+                )
+            st.session_state.prompts_job = job
+
+        def render_prompt_cards(job):
+            # 已完成的風格先顯示，其餘的還在生成
+            for i, p in enumerate(job.partial or []):
+                render_style_card(i, p)
+
+        wait_for_job(job, "🎨 AI 正在創作 3 種風格的影像描述...", render=render_prompt_cards)
+
+        if job.status == DONE:
+            st.session_state.prompts_job = None
+            st.session_state.image_prompts = job.result()
+            st.session_state.regenerate_prompts = False
+            save_checkpoint(3)
+            st.rerun()
+        if job.tag == "prefetch":
+            # 背景預先生成失敗（或被取消）時，改為重新送出一次
+            st.session_state.prompts_job = None
+            st.rerun()
+        # 失敗 / 取消的工作留在 session，按重試才重新送出
+        if job.error() is not None:
+            st.error(f"生成圖片 Prompt 失敗：{job.error()}")
+        if st.button("🔄 重試"):
+            st.session_state.prompts_job = None
+            st.rerun()
+        st.stop()
 
     # 顯示 3 種風格供選擇
     prompts = st.session_state.image_prompts
 
     for i, p in enumerate(prompts):
-        with st.container():
-            st.markdown(f"""
-<div class='style-card'>
-<h4>🎨 風格 {i+1}：{p.get('style_name_zh', '')} / {p.get('style_name_en', '')}</h4>
-</div>
-""", unsafe_allow_html=True)
-
-            with st.expander(f"查看完整描述 - 風格 {i+1}"):
-                st.markdown(f"**中文長描述：**\n{p.get('long_desc_zh', '')}")
-                st.markdown(f"**English Long Description：**\n{p.get('long_desc_en', '')}")
-                st.divider()
-                st.markdown(f"**簡短提示語（中）：** {p.get('short_prompt_zh', '')}")
-                st.markdown(f"**Short Prompt (EN)：** {p.get('short_prompt_en', '')}")
+        render_style_card(i, p)
 
     # 選擇風格
     selected = st.radio(
@@ -386,11 +762,24 @@ elif st.session_state.current_step == 3:
     with col2:
         if st.button("🔄 重新生成 Prompt", use_container_width=True):
             st.session_state.image_prompts = []
+            st.session_state.regenerate_prompts = True
             st.rerun()
 
-    if st.button("🖼️ 使用這個風格生成圖片", type="primary", use_container_width=True):
-        st.session_state.current_step = 4
-        st.rerun()
+    col_one, col_all = st.columns([1, 1])
+    with col_one:
+        if st.button("🖼️ 使用這個風格生成圖片", type="primary", use_container_width=True):
+            st.session_state.render_all_styles = False
+            save_checkpoint(4)
+            st.session_state.current_step = 4
+            st.rerun()
+    with col_all:
+        if st.button("🖼️ 三種風格一次生成", use_container_width=True):
+            st.session_state.render_all_styles = True
+            st.session_state.generated_images = {}
+            st.session_state.image_errors = {}
+            save_checkpoint(4)
+            st.session_state.current_step = 4
+            st.rerun()
 
 
 # ═══════════════════════════════════════════ #
@@ -399,44 +788,149 @@ elif st.session_state.current_step == 3:
 elif st.session_state.current_step == 4:
     st.markdown("### 4️⃣ AI 圖片生成")
 
+    # 三種風格同時生成：每張圖完成就先顯示，選定後再進入單張檢視
+    if st.session_state.render_all_styles and st.session_state.generated_image_id is None:
+        prompts = st.session_state.image_prompts
+        st.info("🎨 三種風格同時生成，完成一張就會先顯示（約需 10-30 秒），選一張繼續")
+
+        def style_grid():
+            """每種風格一欄：標題 + 圖片位置"""
+            cols = st.columns(len(prompts))
+            slots = []
+            for i, (col, p) in enumerate(zip(cols, prompts)):
+                with col:
+                    st.markdown(f"**風格 {i+1}：{p.get('style_name_zh', '')}**")
+                    slots.append(st.empty())
+            return cols, slots
+
+        # 只保留還在暫存中的圖片，被淘汰的當作尚未生成
+        images = {i: aid for i, aid in st.session_state.generated_images.items() if get_image(aid) is not None}
+        pending = [i for i in range(len(prompts)) if i not in images]
+
+        job = st.session_state.image_job
+        if job is None and pending and not st.session_state.image_errors:
+            # 使用英文 short prompt 作為生成的 prompt（效果最好）
+            prompt_texts = {
+                i: prompts[i].get("short_prompt_en", prompts[i].get("long_desc_en", ""))
+                for i in pending
+            }
+            job = st.session_state.image_job = submit(render_styles_task, prompt_texts)
+
+        if job is not None:
+            def render_style_images(job):
+                _, slots = style_grid()
+                partial = job.partial or {}
+                for i in range(len(prompts)):
+                    if i in images:
+                        slots[i].image(get_image(images[i]).preview, use_container_width=True)
+                    elif isinstance(partial.get(i), Exception):
+                        slots[i].error(f"圖片生成失敗：{partial[i]}")
+                    elif i in partial:
+                        slots[i].image(partial[i].preview, use_container_width=True)
+                    else:
+                        slots[i].info("⏳ 生成中...")
+
+            wait_for_job(job, "🎨 三種風格生成中...", render=render_style_images)
+
+            st.session_state.image_job = None
+            results = job.result() if job.status == DONE else (job.partial or {})
+            errors = {}
+            for i, r in results.items():
+                if isinstance(r, Exception):
+                    errors[i] = str(r)
+                else:
+                    images[i] = st.session_state.image_store.put(r)
+            # 沒有結果的風格（工作失敗或被取消）標記為失敗，可再按重試
+            for i in pending:
+                if i not in results:
+                    errors[i] = str(job.error()) if job.error() is not None else "已取消"
+            st.session_state.generated_images = images
+            st.session_state.image_errors = errors
+            save_checkpoint(4)
+            st.rerun()
+
+        cols, slots = style_grid()
+        for i, col in enumerate(cols):
+            with col:
+                if i in images:
+                    slots[i].image(get_image(images[i]).preview, use_container_width=True)
+                    if st.button("✅ 使用這張", key=f"pick_image_{i}", use_container_width=True):
+                        st.session_state.selected_prompt_idx = i
+                        st.session_state.generated_image_id = images[i]
+                        st.session_state.render_all_styles = False
+                        save_checkpoint(4)
+                        st.rerun()
+                else:
+                    slots[i].error(f"圖片生成失敗：{st.session_state.image_errors.get(i, '')}")
+
+        col1, col2, col3 = st.columns([1, 1, 4])
+        with col1:
+            if st.button("⬅️ 換風格", use_container_width=True):
+                st.session_state.current_step = 3
+                st.session_state.generated_images = {}
+                st.session_state.image_errors = {}
+                st.rerun()
+        with col2:
+            if st.session_state.image_errors and st.button("🔄 重試失敗的風格", use_container_width=True):
+                st.session_state.image_errors = {}
+                st.rerun()
+        st.stop()
+
     idx = st.session_state.selected_prompt_idx
     selected_prompt = st.session_state.image_prompts[idx]
 
     st.info(f"🎨 正在使用風格：**{selected_prompt.get('style_name_zh', '')}**")
 
-    if st.session_state.generated_image_path is None:
-        with st.spinner("🖼️ Gemini Imagen 正在生成圖片...（約需 10-30 秒）"):
-            try:
-                from services.gemini_service import generate_image
-                # 使用英文 short prompt 作為生成的 prompt（效果最好）
-                prompt_text = selected_prompt.get("short_prompt_en", selected_prompt.get("long_desc_en", ""))
-                image_path = generate_image(prompt_text, filename=f"post_image_{idx}.png")
-                st.session_state.generated_image_path = str(image_path)
+    if get_image(st.session_state.generated_image_id) is None:
+        from services.gemini_service import generate_image_artifact
+        job = st.session_state.image_job
+        if job is None:
+            # 使用英文 short prompt 作為生成的 prompt（效果最好）
+            prompt_text = selected_prompt.get("short_prompt_en", selected_prompt.get("long_desc_en", ""))
+            # 同一個 prompt 生成過就直接取用資產庫的圖片；按「重新生成圖」時才略過
+            job = st.session_state.image_job = submit_call(
+                generate_image_artifact, prompt_text, no_cache=st.session_state.regenerate_image
+            )
+
+        wait_for_job(job, "🖼️ Gemini Imagen 正在生成圖片...（約需 10-30 秒）")
+
+        if job.status == DONE:
+            st.session_state.image_job = None
+            st.session_state.regenerate_image = False
+            st.session_state.generated_image_id = st.session_state.image_store.put(job.result())
+            save_checkpoint(4)
+            st.rerun()
+
+        # 失敗 / 取消的工作留在 session，按重試才重新送出
+        if job.error() is not None:
+            st.error(f"圖片生成失敗：{job.error()}")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("🔄 重試"):
+                st.session_state.image_job = None
                 st.rerun()
-            except Exception as e:
-                st.error(f"圖片生成失敗：{e}")
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("🔄 重試"):
-                        st.rerun()
-                with col2:
-                    if st.button("⬅️ 換一個風格"):
-                        st.session_state.current_step = 3
-                        st.rerun()
-                st.stop()
+        with col2:
+            if st.button("⬅️ 換一個風格"):
+                st.session_state.image_job = None
+                st.session_state.current_step = 3
+                st.rerun()
+        st.stop()
 
     # 顯示生成的圖片
-    st.image(st.session_state.generated_image_path, caption="生成的圖片", use_container_width=True)
+    st.image(get_image(st.session_state.generated_image_id).preview, caption="生成的圖片", use_container_width=True)
 
     col1, col2, col3 = st.columns([1, 1, 4])
     with col1:
         if st.button("⬅️ 換風格", use_container_width=True):
             st.session_state.current_step = 3
-            st.session_state.generated_image_path = None
+            st.session_state.generated_image_id = None
+            st.session_state.generated_images = {}
             st.rerun()
     with col2:
         if st.button("🔄 重新生成圖", use_container_width=True):
-            st.session_state.generated_image_path = None
+            st.session_state.image_store.discard(st.session_state.generated_image_id)
+            st.session_state.generated_image_id = None
+            st.session_state.regenerate_image = True
             st.rerun()
 
     if st.button("📤 前往發布至 Facebook", type="primary", use_container_width=True):
@@ -458,27 +952,57 @@ elif st.session_state.current_step == 5:
     with col_img:
         st.markdown("**🖼️ 配圖：**")
         use_image = False
-        if st.session_state.generated_image_path:
-            st.image(st.session_state.generated_image_path, use_container_width=True)
+        image = get_image(st.session_state.generated_image_id)
+        if image is not None:
+            st.image(image.preview, use_container_width=True)
             use_image = st.checkbox("✅ 一併上傳圖片", value=True)
         else:
             st.warning("沒有圖片（將發布純文字貼文）")
 
     st.divider()
 
-    # 發布按鈕
-    if st.session_state.post_result is None:
+    # 發布：加入佇列，由 app 內建的 worker thread（或另外執行的 publish_worker.py）上傳
+    import services.publish_queue as pq
+    queue = pq.get_publish_queue()
+
+    if not st.session_state.publish_job_ids:
         
-        # Debug: Check Credentials before posting
+        # 發布前確認各目標品牌的設定
         current_brand = st.session_state.brand
-        import os
-        from services.facebook_service import _get_config
-        try:
-            d_token, d_page_id = _get_config(current_brand)
-            st.info(f"🔍 準備發布身分：**{current_brand}**")
-            st.caption(f"Debug Info: Page ID={d_page_id}, Token={d_token[:5]}...{d_token[-5:] if d_token else ''}")
-        except Exception as e:
-            st.error(f"無法讀取設定：{e}")
+        other_brands = [b for b in brand_map if b != current_brand]
+        targets = [current_brand]
+        if other_brands:
+            targets += st.multiselect(
+                "📣 同時發布到其他粉專",
+                options=other_brands,
+                format_func=lambda x: brand_map[x],
+            )
+        from services.token_health import get_token_monitor
+        for target in targets:
+            try:
+                get_brand(target).credentials()
+                st.info(f"🔍 準備發布身分：**{brand_map[target]}**")
+            except Exception as e:
+                st.error(f"無法讀取設定：{e}")
+                continue
+            token_status = get_token_monitor().get(target)
+            if token_status is not None and token_status.invalid:
+                st.error(f"{brand_map[target]} 的 Token 無法使用，發布將會失敗：{token_status.error or '已過期'}")
+
+        # 排程時間（不勾選則立即發布）
+        publish_at = None
+        if st.checkbox("⏰ 排程發布"):
+            import datetime as dt
+            now = dt.datetime.now()
+            col_d, col_t = st.columns(2)
+            with col_d:
+                day = st.date_input("日期", value=now.date(), min_value=now.date())
+            with col_t:
+                at = st.time_input("時間", value=(now + dt.timedelta(hours=1)).time().replace(second=0, microsecond=0))
+            publish_at = dt.datetime.combine(day, at).timestamp()
+            # 內建 worker 只在 app 運作時上傳；Streamlit Cloud 閒置休眠後排程會延到下次有人開啟
+            if not queue.live_workers(kind=pq.EXTERNAL):
+                st.caption("⚠️ 沒有偵測到獨立的 publish_worker.py：排程時間到時 app 必須仍在運作才會發布。")
 
         col1, col2, col3 = st.columns([1, 1, 4])
 
@@ -488,43 +1012,99 @@ elif st.session_state.current_step == 5:
                 st.rerun()
 
 
-        if st.button("🚀 確認發布至 Facebook", type="primary", use_container_width=True):
-            with st.spinner("📤 正在發布至 Facebook..."):
-                try:
-                    from services.facebook_service import post_with_image, post_text_only
-
-                    if st.session_state.generated_image_path and use_image:
-                        result = post_with_image(
-                            st.session_state.edited_article,
-                            st.session_state.generated_image_path,
-                            brand=st.session_state.brand
-                        )
-                    else:
-                        result = post_text_only(st.session_state.edited_article, brand=st.session_state.brand)
-
-                    st.session_state.post_result = result
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"發布失敗：{e}")
-                    st.info("💡 請確認 secrets.toml 中的 FB_PAGE_ACCESS_TOKEN 和 FB_PAGE_ID 是否正確。")
+        if st.button("⏰ 加入排程" if publish_at else "🚀 立即發布", type="primary", use_container_width=True):
+            try:
+                with_image = image is not None and use_image
+                # 每個粉專一筆工作，worker 會同時上傳到不同粉專
+                st.session_state.publish_job_ids = [
+                    queue.enqueue(
+                        target,
+                        st.session_state.edited_article,
+                        image=image.data if with_image else None,
+                        image_mime=image.mime if with_image else None,
+                        publish_at=publish_at,
+                    )
+                    for target in targets
+                ]
+                get_publish_worker().wake()
+                save_checkpoint(5)
+                st.rerun()
+            except Exception as e:
+                st.error(f"加入佇列失敗：{e}")
 
     else:
-        # 發布成功
-        result = st.session_state.post_result
-        st.markdown(f"""
+        jobs = [queue.get(job_id) for job_id in st.session_state.publish_job_ids]
+        if all(job is not None and job["status"] == pq.DONE for job in jobs):
+            posts = "<br>".join(
+                f"{brand_map.get(job['brand'], job['brand'])}：{job['post_id'] or 'N/A'}（上傳耗時 {job['latency'] or 0:.1f} 秒）"
+                for job in jobs
+            )
+            st.markdown(f"""
 <div class='success-box'>
     <h2>🎉 發布成功！</h2>
     <p>貼文已成功發布至 Facebook 粉絲專頁。</p>
-    <p><small>Post ID: {result.get('id', result.get('post_id', 'N/A'))}</small></p>
+    <p><small>{posts}</small></p>
 </div>
 """, unsafe_allow_html=True)
+            st.balloons()
+        else:
+            import datetime as dt
+            for job_id, job in zip(st.session_state.publish_job_ids, jobs):
+                if job is None:
+                    st.warning(f"發布工作 #{job_id} 已被取消。")
+                    continue
+                name = brand_map.get(job["brand"], job["brand"])
+                if job["status"] == pq.DONE:
+                    st.success(f"✅ {name}：已發布（Post ID: {job['post_id'] or 'N/A'}）")
+                elif job["status"] in (pq.PENDING, pq.RUNNING):
+                    when = dt.datetime.fromtimestamp(job["publish_at"]).strftime("%Y-%m-%d %H:%M")
+                    state = "上傳中" if job["status"] == pq.RUNNING else f"排程於 {when}"
+                    st.info(f"📤 {name}：已加入發布佇列（#{job['id']}，{state}，已嘗試 {job['attempts']} 次）")
+                    if job["error"]:
+                        st.caption(f"上次錯誤：{job['error']}")
+                    if job["status"] == pq.PENDING and st.button("🗑️ 取消發布", key=f"cancel_{job['id']}"):
+                        queue.cancel(job["id"])
+                        st.rerun()
+                elif job["status"] == pq.UNKNOWN:
+                    # 可能已經發布：不自動重送，worker 會到粉專動態確認，也可以自己看過後決定
+                    st.warning(f"❓ {name}：已送出但沒有收到結果，貼文可能已經發布（#{job['id']}）。\n\n{job['error']}")
+                    c1, c2 = st.columns(2)
+                    with c1:
+                        if st.button("✅ 粉專上已看到這篇", key=f"confirm_{job['id']}", use_container_width=True):
+                            queue.mark_done(job["id"], None, job["latency"])
+                            st.rerun()
+                    with c2:
+                        if st.button("🔄 確認沒有發布，重新排入", key=f"retry_{job['id']}", use_container_width=True):
+                            queue.retry(job["id"])
+                            st.rerun()
+                else:
+                    st.error(f"{name} 發布失敗：{job['error']}")
+                    if st.button("🔄 重新排入佇列", key=f"retry_{job['id']}"):
+                        queue.retry(job["id"])
+                        st.rerun()
+
+            if any(job is not None and job["status"] in (pq.PENDING, pq.RUNNING, pq.UNKNOWN) for job in jobs):
+                if st.button("🔄 重新整理"):
+                    st.rerun()
 
-        st.balloons()
+            # 已到期（立即發布）的工作由 worker 上傳中，完成時自動更新畫面
+            uploading = [job["id"] for job in jobs
+                         if job is not None and job["status"] in (pq.PENDING, pq.RUNNING) and job["publish_at"] <= time.time()]
+            if uploading:
+                @st.fragment(run_every=JOB_POLL_SECONDS)
+                def watch_publish():
+                    for job_id in uploading:
+                        job = queue.get(job_id)
+                        if job is None or job["status"] not in (pq.PENDING, pq.RUNNING):
+                            st.rerun(scope="app")
+
+                watch_publish()
+            if any(job is not None and job["status"] not in (pq.PENDING, pq.RUNNING, pq.DONE, pq.UNKNOWN) for job in jobs):
+                st.info("💡 請確認 secrets.toml 中對應品牌的 Token 和 Page ID 是否正確。")
 
         if st.button("📝 建立新貼文", type="primary", use_container_width=True):
             # Reset all state
-            for key, val in DEFAULTS.items():
-                st.session_state[key] = val
+            reset_flow()
             st.rerun()
 
 
@@ -0,0 +1,403 @@
+"""
+批次產文 CLI — 不經過 Streamlit，一次處理多筆素材
+
+用法：
+    python batch_cli.py posts.jsonl
+    python batch_cli.py posts.csv --text-concurrency 4 --image-concurrency 2 --fb-concurrency 1
+    python batch_cli.py posts.jsonl --fanout houjiazai --rewrite   # 同時發到其他粉專（依品牌改寫）
+    python batch_cli.py posts.jsonl --fanout tag:長照              # 發到所有標籤為「長照」的粉專
+    python batch_cli.py posts.jsonl --batch-api --wait              # Gemini 批次模式，只產生草稿
+
+輸入檔每列欄位：
+    brand         品牌 key（見 services/brands.py / brands.json，例如 default / houjiazai）
+    raw_material  原始素材
+    publish       是否直接發布到 Facebook (true / false)
+    id            (選填) 自訂列 ID，未提供時以內容雜湊產生
+
+每列完成後立即寫入 checkpoint (預設為 <輸入檔>.results.jsonl)，
+中斷後重新執行同一指令會跳過已成功的列。--fanout 的列逐個粉專記錄，
+加 --retry-failed 重跑時沿用上次已生成的文章與圖片，只重跑失敗的階段、補發還沒成功的粉專；
+上次發布結果不明的列先查粉專動態，找到同一篇就不再重發。
+
+--batch-api 改用 Gemini 批次模式（不需即時結果的大量排程內容，例如一個月的衛教主題）：
+只生成文章與圖片 Prompt，結果存入草稿庫 data/drafts.sqlite3，之後在 UI 側欄「📥 批次草稿」
+開啟到步驟 2 審稿；publish 欄位與圖片生成不適用。批次狀態都在草稿庫中，
+不加 --wait 時送出 / 查詢一輪就結束，之後重新執行同一指令（或交給 cron）會接著查詢。
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+# 確保 project root 在 sys.path
+PROJECT_ROOT = Path(__file__).parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.gemini_service import generate_article, generate_image_prompts, generate_image
+from services.facebook_service import find_published_post, post_with_image, post_text_only
+from services.brands import get_registry, resolve_brands
+from services.fanout import fanout_publish
+
+
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def load_rows(path: Path) -> list[dict]:
+    """讀取 JSONL 或 CSV 輸入檔；品牌不在註冊表中時列出行號並拒絕整個檔案"""
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            raw_rows = [(reader.line_num, raw) for raw in reader]
+    else:
+        with open(path, encoding="utf-8") as f:
+            raw_rows = [(n, json.loads(line)) for n, line in enumerate(f, 1) if line.strip()]
+
+    registry = get_registry()
+    rows = []
+    unknown = []
+    for line_num, raw in raw_rows:
+        brand = (raw.get("brand") or "default").strip()
+        material = (raw.get("raw_material") or "").strip()
+        if not material:
+            continue
+        # BrandRegistry.get 找不到會退回 default，打錯的品牌會默默發到預設粉專
+        if brand not in registry:
+            unknown.append(f"第 {line_num} 行：{brand}")
+            continue
+        row_id = raw.get("id") or hashlib.sha256(f"{brand}\n{material}".encode("utf-8")).hexdigest()[:12]
+        rows.append({
+            "id": str(row_id),
+            "brand": brand,
+            "raw_material": material,
+            "publish": _parse_bool(raw.get("publish")),
+        })
+    if unknown:
+        raise ValueError(f"未知的品牌（{path.name}）：" + "；".join(unknown))
+    return rows
+
+
+def load_checkpoint(path: Path) -> dict:
+    """讀取先前的結果，回傳 {row_id: result}（後寫入者優先）"""
+    done = {}
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    done[result["id"]] = result
+    return done
+
+
+class BatchRunner:
+    """以三個獨立的併發上限（文字 / 圖片 / FB 上傳）跑完整流程"""
+
+    def __init__(self, checkpoint: Path, text_concurrency: int, image_concurrency: int,
+                 fb_concurrency: int, style_idx: int = 0, with_image: bool = True,
+                 fanout: list[str] = None, rewrite: bool = False):
+        self.checkpoint = checkpoint
+        self.text_slots = threading.BoundedSemaphore(text_concurrency)
+        self.image_slots = threading.BoundedSemaphore(image_concurrency)
+        self.fb_slots = threading.BoundedSemaphore(fb_concurrency)
+        self.style_idx = style_idx
+        self.with_image = with_image
+        self.fanout = fanout or []
+        self.rewrite = rewrite
+        self._write_lock = threading.Lock()
+
+    def _record(self, result: dict):
+        with self._write_lock:
+            with open(self.checkpoint, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                f.flush()
+
+    def _rewrite_fanout(self, row: dict, article: str, brands: list[str]) -> dict:
+        """--rewrite 時依各品牌 prompt 改寫；是 Gemini 呼叫，佔文字併發而不是 FB 上傳的名額"""
+        messages = {}
+        if self.rewrite:
+            for brand in brands:
+                if brand != row["brand"]:
+                    with self.text_slots:
+                        messages[brand] = generate_article(article, brand=brand)
+        return messages
+
+    def _publish_fanout(self, row: dict, article: str, result: dict, previous_posts: list = None):
+        """
+        發到本列品牌 + --fanout 的各粉專；任一粉專失敗即視為本列失敗。
+        每個粉專完成時就寫入 checkpoint，--retry-failed 只重發上次沒有成功的粉專；
+        上次結果不明（請求已送出）的粉專先查粉專動態，找到同一篇就不再重發。
+        """
+        brands = [row["brand"]] + [b for b in self.fanout if b != row["brand"]]
+        # 查詢失敗時仍保留上次的粉專結果，下次重跑才知道哪些需要先查
+        result["posts"] = previous_posts or None
+        posts = {}
+        for post in previous_posts or []:
+            if not post["ok"] and post.get("uncertain") and post.get("message"):
+                post_id = find_published_post(post["message"], brand=post["brand"])
+                if post_id:
+                    post = {**post, "ok": True, "post_id": post_id, "error": None, "uncertain": False}
+            if post["ok"]:
+                posts[post["brand"]] = post
+        todo = [b for b in brands if b not in posts]
+
+        stage_timings = result["timings"]
+        if todo:
+            t0 = time.perf_counter()
+            messages = self._rewrite_fanout(row, article, todo)
+            if messages:
+                stage_timings["rewrite"] = round(time.perf_counter() - t0, 3)
+
+            lock = threading.Lock()
+
+            def on_result(post: dict):
+                with lock:
+                    posts[post["brand"]] = post
+                    self._record({**result, "status": "publishing",
+                                  "posts": [posts[b] for b in brands if b in posts]})
+
+            with self.fb_slots:
+                t0 = time.perf_counter()
+                fanout_publish(article, todo, image=result["image_path"], messages=messages,
+                               on_result=on_result)
+                stage_timings["publish"] = round(time.perf_counter() - t0, 3)
+
+        result["posts"] = [posts[b] for b in brands]
+        result["post_id"] = posts[row["brand"]]["post_id"]
+        failed = [r for r in result["posts"] if not r["ok"]]
+        if failed:
+            raise RuntimeError("; ".join(f"{r['brand']}: {r['error']}" for r in failed))
+
+    def _publish_single(self, row: dict, article: str, result: dict, previous: dict):
+        """
+        只發到本列品牌；上次結果不明（請求已送出）時先查粉專動態，找到同一篇就不再重發。
+        發布失敗時把 uncertain 寫進結果，--retry-failed 才知道要先查。
+        """
+        if previous.get("uncertain"):
+            result["uncertain"] = True
+            post_id = find_published_post(article, brand=row["brand"])
+            if post_id:
+                result["post_id"] = post_id
+                result["uncertain"] = False
+                return
+
+        with self.fb_slots:
+            t0 = time.perf_counter()
+            try:
+                if result["image_path"]:
+                    post = post_with_image(article, result["image_path"], brand=row["brand"])
+                else:
+                    post = post_text_only(article, brand=row["brand"])
+            except Exception as e:
+                result["uncertain"] = getattr(e, "uncertain", False)
+                raise
+            result["timings"]["publish"] = round(time.perf_counter() - t0, 3)
+        result["post_id"] = post.get("post_id", post.get("id"))
+        result["uncertain"] = False
+
+    def run_row(self, row: dict, previous: dict = None) -> dict:
+        result = {
+            "id": row["id"],
+            "brand": row["brand"],
+            "status": "ok",
+            "article": None,
+            "image_path": None,
+            "post_id": None,
+            "posts": None,
+            "error": None,
+            # 發布請求已送出卻沒有明確結果（見 FacebookAPIError.uncertain）
+            "uncertain": False,
+            "timings": {},
+        }
+        # --retry-failed 時沿用上次已完成的階段：已有文章 / 圖片就不再生成，
+        # fanout 已有粉專發布成功時也才能和已發布的內容一致
+        previous = previous or {}
+        previous_posts = previous.get("posts") or []
+        resume = self.fanout and any(p["ok"] or p.get("uncertain") for p in previous_posts)
+        previous_image = previous.get("image_path")
+        if previous_image and not Path(previous_image).exists():
+            previous_image = None
+        stage = "article"
+        try:
+            if previous.get("article"):
+                article = previous["article"]
+            else:
+                with self.text_slots:
+                    t0 = time.perf_counter()
+                    article = generate_article(row["raw_material"], brand=row["brand"])
+                    result["timings"]["article"] = round(time.perf_counter() - t0, 3)
+            result["article"] = article
+
+            if previous_image and (self.with_image or resume):
+                result["image_path"] = previous_image
+            elif self.with_image:
+                stage = "image_prompts"
+                with self.text_slots:
+                    t0 = time.perf_counter()
+                    prompts = generate_image_prompts(article)
+                    result["timings"]["image_prompts"] = round(time.perf_counter() - t0, 3)
+
+                stage = "image"
+                selected = prompts[min(self.style_idx, len(prompts) - 1)]
+                prompt_text = selected.get("short_prompt_en", selected.get("long_desc_en", ""))
+                with self.image_slots:
+                    t0 = time.perf_counter()
+                    image_path = generate_image(prompt_text)
+                    result["timings"]["image"] = round(time.perf_counter() - t0, 3)
+                result["image_path"] = str(image_path)
+
+            if row["publish"]:
+                stage = "publish"
+                if self.fanout:
+                    self._publish_fanout(row, article, result, previous_posts if resume else None)
+                else:
+                    self._publish_single(row, article, result, previous)
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = f"[{stage}] {e}"
+
+        self._record(result)
+        return result
+
+
+def summarize(results: list[dict], skipped: int, elapsed: float) -> str:
+    ok = [r for r in results if r["status"] == "ok"]
+    failed = [r for r in results if r["status"] != "ok"]
+    lines = [
+        "─── 批次結果 ───",
+        f"處理：{len(results)} 列（成功 {len(ok)}、失敗 {len(failed)}、略過已完成 {skipped}）",
+        f"總耗時：{elapsed:.1f} 秒",
+    ]
+    if elapsed > 0 and results:
+        lines.append(f"吞吐量：{len(results) / elapsed * 60:.1f} 列/分鐘")
+
+    for stage in ("article", "image_prompts", "image", "rewrite", "publish"):
+        times = [r["timings"][stage] for r in results if stage in r["timings"]]
+        if times:
+            lines.append(f"  {stage:<14} 平均 {sum(times) / len(times):.2f}s / 最長 {max(times):.2f}s（{len(times)} 次）")
+
+    for r in failed:
+        lines.append(f"❌ {r['id']} ({r['brand']}): {r['error']}")
+    return "\n".join(lines)
+
+
+def run_batch_api(rows: list[dict], with_image_prompts: bool, retry_failed: bool, wait: bool,
+                  poll_interval: float) -> int:
+    """以 Gemini 批次模式把每列生成為草稿；全部完成（或不等待）後回傳 exit code"""
+    from services.batch_jobs import BatchPipeline
+    from services.draft_store import FAILED
+    from services.topic_index import MATERIAL, get_topic_index
+
+    pipeline = BatchPipeline(with_image_prompts=with_image_prompts, poll_base=poll_interval)
+    index = get_topic_index()
+    added = 0
+    for row in rows:
+        if not pipeline.store.add(row["id"], row["brand"], row["raw_material"]):
+            continue
+        added += 1
+        # 只提醒、不阻擋：排程好的主題可能刻意重複
+        for match in index.search(row["raw_material"], k=1, exclude=row["id"]):
+            print(f"⚠️ {row['id']} 與草稿 {match['draft_id']}（{match['brand']}）相似度 {match['score']:.0%}：{match['preview']}")
+        index.add(row["id"], MATERIAL, row["raw_material"], brand=row["brand"])
+    retried = pipeline.store.retry_failed() if retry_failed else 0
+    print(f"共 {len(rows)} 列，新增草稿 {added} 篇，重試失敗 {retried} 篇，草稿庫：{pipeline.store.path}")
+
+    while True:
+        for event in pipeline.step():
+            print(event)
+        if not wait or not pipeline.pending():
+            break
+        next_poll = pipeline.next_poll_at()
+        time.sleep(max(1.0, next_poll - time.time()) if next_poll else poll_interval)
+
+    drafts = [pipeline.store.get(row["id"]) for row in rows]
+    counts = {}
+    for draft in drafts:
+        counts[draft["status"]] = counts.get(draft["status"], 0) + 1
+    print("─── 草稿狀態 ───")
+    print("、".join(f"{status} {n}" for status, n in sorted(counts.items())))
+    for draft in drafts:
+        if draft["status"] == FAILED:
+            print(f"❌ {draft['id']} ({draft['brand']}): {draft['error']}")
+    return 1 if counts.get(FAILED) else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="批次生成衛教貼文")
+    parser.add_argument("input", type=Path, help="JSONL 或 CSV 輸入檔")
+    parser.add_argument("--checkpoint", type=Path, help="結果 / checkpoint 檔（預設 <輸入檔>.results.jsonl）")
+    parser.add_argument("--workers", type=int, default=8, help="同時處理的列數")
+    parser.add_argument("--text-concurrency", type=int, default=4, help="文字生成併發上限")
+    parser.add_argument("--image-concurrency", type=int, default=2, help="圖片生成併發上限")
+    parser.add_argument("--fb-concurrency", type=int, default=1, help="Facebook 上傳併發上限")
+    parser.add_argument("--style", type=int, default=0, help="使用第幾個圖片風格 (0-2)")
+    parser.add_argument("--no-image", action="store_true", help="只生成文章，不生成圖片")
+    parser.add_argument("--retry-failed", action="store_true", help="重新執行先前失敗的列")
+    parser.add_argument("--fanout", default="", help="同時發布到的其他品牌（逗號分隔，tag:<標籤> 代表該標籤的所有品牌）")
+    parser.add_argument("--rewrite", action="store_true", help="--fanout 的品牌先依各自的 prompt 改寫文章")
+    parser.add_argument("--batch-api", action="store_true", help="改用 Gemini 批次模式生成草稿（不發布、不生成圖片）")
+    parser.add_argument("--wait", action="store_true", help="（--batch-api）持續查詢直到所有草稿完成")
+    parser.add_argument("--poll-interval", type=float, default=60, help="（--batch-api）第一次查詢批次狀態前的秒數，之後遞增")
+    args = parser.parse_args(argv)
+
+    try:
+        rows = load_rows(args.input)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.batch_api:
+        # --no-image 時只生成文章，不送圖片 Prompt 批次
+        return run_batch_api(rows, with_image_prompts=not args.no_image, retry_failed=args.retry_failed,
+                             wait=args.wait, poll_interval=args.poll_interval)
+
+    checkpoint = args.checkpoint or args.input.with_name(args.input.name + ".results.jsonl")
+    previous = load_checkpoint(checkpoint)
+
+    def _should_run(row):
+        prev = previous.get(row["id"])
+        if prev is None:
+            return True
+        return prev["status"] != "ok" and args.retry_failed
+
+    todo = [row for row in rows if _should_run(row)]
+    skipped = len(rows) - len(todo)
+    print(f"共 {len(rows)} 列，待處理 {len(todo)} 列，checkpoint：{checkpoint}")
+
+    runner = BatchRunner(
+        checkpoint,
+        text_concurrency=args.text_concurrency,
+        image_concurrency=args.image_concurrency,
+        fb_concurrency=args.fb_concurrency,
+        style_idx=args.style,
+        with_image=not args.no_image,
+        fanout=resolve_brands([b.strip() for b in args.fanout.split(",") if b.strip()]),
+        rewrite=args.rewrite,
+    )
+
+    started = time.perf_counter()
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [pool.submit(runner.run_row, row, previous.get(row["id"])) for row in todo]
+        for future in as_completed(futures):
+            result = future.result()
+            mark = "✅" if result["status"] == "ok" else "❌"
+            print(f"{mark} {result['id']} ({result['brand']})")
+            results.append(result)
+    elapsed = time.perf_counter() - started
+
+    print(summarize(results, skipped, elapsed))
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""離線效能基準：本機替身伺服器 + 驅動 services 的 harness"""
@@ -0,0 +1,122 @@
+"""
+冷啟動基準 — 每次都在全新的 Python process 中量「按下生成 → 文章完成」的時間
+
+用法：
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start --trials 5 --think-time 3 --connect-latency 0.3
+
+比較兩種模式（各跑 trials 次、取中位數）：
+    lazy     ：與預熱前相同，按下生成時才匯入 services、建立連線與 context cache
+    prewarm  ：process 一啟動就呼叫 services.startup.prewarm()，使用者輸入素材的 think-time 內完成預熱
+
+替身伺服器以 --connect-latency 模擬每條新連線的 TLS 握手。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 確保 project root 在 sys.path
+PROJECT_ROOT = Path(__file__).parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from benchmarks.mock_servers import MockConfig, _serve_forever
+from benchmarks.run import _configure_env, _free_port, _wait_for_port
+
+
+MODES = ("lazy", "prewarm")
+
+
+def child(mode: str, think_time: float) -> dict:
+    """在子 process 中執行：模擬 app 啟動 → 使用者輸入 → 按下生成"""
+    t_start = time.perf_counter()
+    if mode == "prewarm":
+        from services import startup
+        startup.prewarm()
+
+    # 使用者輸入素材的時間
+    time.sleep(think_time)
+
+    t_click = time.perf_counter()
+    from services import rate_limiter, response_cache
+    from services.gemini_service import generate_article_stream
+    t_imported = time.perf_counter()
+
+    workdir = Path(os.environ["COLD_START_WORKDIR"])
+    response_cache._cache = response_cache.ResponseCache(workdir / f"responses_{os.getpid()}.sqlite3")
+    rate_limiter._manager = rate_limiter.QuotaManager(workdir / f"quota_{os.getpid()}.sqlite3", limits={})
+
+    first_chunk = None
+    for _ in generate_article_stream(f"冷啟動測試 {time.time_ns()}", no_cache=True):
+        if first_chunk is None:
+            first_chunk = time.perf_counter()
+    t_done = time.perf_counter()
+
+    return {
+        "mode": mode,
+        "import_on_click_s": round(t_imported - t_click, 3),
+        "click_to_first_chunk_s": round(first_chunk - t_click, 3),
+        "click_to_article_s": round(t_done - t_click, 3),
+        "process_to_article_s": round(t_done - t_start, 3),
+    }
+
+
+def _run_child(mode: str, think_time: float, env: dict) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start", "--child", mode, "--think-time", str(think_time)],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="量測冷啟動到第一篇文章的時間")
+    parser.add_argument("--trials", type=int, default=3, help="每種模式跑幾次")
+    parser.add_argument("--think-time", type=float, default=2.0, help="process 啟動到按下生成之間的秒數")
+    parser.add_argument("--latency", type=float, default=0.3, help="替身伺服器請求延遲（秒）")
+    parser.add_argument("--connect-latency", type=float, default=0.3, help="每條新連線的延遲（模擬 TLS 握手）")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child, args.think_time)))
+        return 0
+
+    config = MockConfig(latency=args.latency, connect_latency=args.connect_latency)
+    port = _free_port()
+    server = multiprocessing.Process(target=_serve_forever, args=(config.to_dict(), port), daemon=True)
+    server.start()
+    try:
+        _wait_for_port(port)
+        _configure_env(port)
+        env = dict(os.environ, COLD_START_WORKDIR=tempfile.mkdtemp(prefix="cold_start_"))
+
+        results = {mode: [] for mode in MODES}
+        for _ in range(args.trials):
+            for mode in MODES:
+                results[mode].append(_run_child(mode, args.think_time, env))
+    finally:
+        server.terminate()
+        server.join()
+
+    medians = {}
+    for mode, runs in results.items():
+        medians[mode] = {k: statistics.median(r[k] for r in runs) for k in runs[0] if k != "mode"}
+        row = "  ".join(f"{k} {v:.3f}s" for k, v in medians[mode].items())
+        print(f"{mode:<8} {row}")
+
+    lazy, warm = medians["lazy"]["click_to_article_s"], medians["prewarm"]["click_to_article_s"]
+    print(f"按下生成 → 文章完成：{lazy:.3f}s → {warm:.3f}s（{warm / lazy:.0%}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
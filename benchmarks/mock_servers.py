@@ -0,0 +1,426 @@
+"""
+本機替身伺服器 — 模擬 Gemini generateContent / streamGenerateContent / cachedContents、
+批次模式（Files 上傳 / batchGenerateContent / 結果下載）與 Facebook Graph API 的 /feed、/photos、/debug_token，
+不花任何配額
+
+單獨啟動：
+    python -m benchmarks.mock_servers --port 8900 --latency 0.5 --error-rate 0.01 --rate-429 0.02
+
+同一個埠同時服務兩種 API：
+    Gemini：  http://127.0.0.1:<port>/v1beta（上傳 /upload/v1beta、下載 /download/v1beta）
+    Graph：   http://127.0.0.1:<port>/graph
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from PIL import Image
+
+
+class MockConfig:
+    """替身伺服器的行為設定"""
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.1, image_latency: float = None,
+                 error_rate: float = 0.0, rate_429: float = 0.0, image_size: int = 1024,
+                 stream_chunks: int = 8, article_chars: int = 400, connect_latency: float = 0.0,
+                 slow_rate: float = 0.0, slow_factor: float = 10.0, fail_models: list = None,
+                 batch_latency: float = 2.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.image_latency = latency * 5 if image_latency is None else image_latency
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.image_size = image_size
+        self.stream_chunks = stream_chunks
+        self.article_chars = article_chars
+        # 每條新連線的額外延遲，模擬 DNS + TLS 握手（keep-alive 重用的連線不受影響）
+        self.connect_latency = connect_latency
+        # 長尾：文字請求有 slow_rate 的機率延遲 slow_factor 倍才開始回應
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        # 這些模型一律回 503，模擬單一模型故障
+        self.fail_models = list(fail_models or [])
+        # 批次工作建立後多久完成（前半段為 PENDING，後半段為 RUNNING）
+        self.batch_latency = batch_latency
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def _make_image_b64(size: int) -> str:
+    """隨機雜訊 PNG（幾乎無法壓縮），大小接近真實生成圖"""
+    img = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+MODELS = [
+    {"name": f"models/{name}", "displayName": name, "inputTokenLimit": limit, "outputTokenLimit": 65536,
+     "supportedGenerationMethods": ["generateContent", "countTokens", "createCachedContent", "batchGenerateContent"]}
+    for name, limit in (("gemini-2.5-flash", 1048576), ("gemini-2.5-flash-lite", 1048576),
+                        ("gemini-3-pro-image-preview", 65536), ("gemini-2.5-flash-image", 32768))
+]
+
+IMAGE_PROMPTS = [
+    {
+        "style_name_zh": f"風格{i}",
+        "style_name_en": f"Style {i}",
+        "long_desc_zh": "溫暖的居家場景，長輩在明亮的客廳中微笑。" * 3,
+        "long_desc_en": "A warm home scene with an elderly person smiling in a bright living room. " * 3,
+        "short_prompt_zh": "溫暖居家長照插畫",
+        "short_prompt_en": f"warm home care illustration, style {i}",
+    }
+    for i in range(3)
+]
+
+
+def make_handler(config: MockConfig):
+    image_b64 = _make_image_b64(config.image_size)
+    article = ("今天想跟大家聊聊居家照顧的小撇步。" * 50)[:config.article_chars]
+    counter = {"posts": 0, "caches": 0, "files": 0, "batches": 0}
+    files = {}
+    batches = {}
+    feeds = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            if config.connect_latency:
+                time.sleep(config.connect_latency)
+
+        def _read_body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _send_json(self, status: int, obj, headers: dict = None):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_bytes(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _sleep(self, base: float):
+            time.sleep(max(0.0, base + random.uniform(-config.jitter, config.jitter) * base))
+
+        def _inject_failure(self, graph: bool) -> bool:
+            """依設定機率回 429 或 500；回傳 True 表示已回應"""
+            roll = random.random()
+            if roll < config.rate_429:
+                err = {"error": {"code": 4 if graph else 429, "message": "rate limited (mock)"}}
+                self._send_json(429, err, {"Retry-After": "0"})
+                return True
+            if roll < config.rate_429 + config.error_rate:
+                self._send_json(500, {"error": {"code": 2 if graph else 500, "message": "internal error (mock)"}})
+                return True
+            return False
+
+        def _usage(self, request: dict, output_chars: int) -> dict:
+            prompt_chars = len(json.dumps(request, ensure_ascii=False))
+            return {
+                "promptTokenCount": prompt_chars // 2,
+                "candidatesTokenCount": output_chars // 2,
+                "totalTokenCount": (prompt_chars + output_chars) // 2,
+            }
+
+        # ─── Gemini ─── #
+
+        def _gemini(self, path: str, request: dict):
+            if path.endswith("/cachedContents"):
+                self._sleep(config.latency)
+                with lock:
+                    counter["caches"] += 1
+                    name = f"cachedContents/mock{counter['caches']}"
+                return self._send_json(200, {"name": name, "model": request.get("model")})
+
+            model = path.split("/models/", 1)[-1].split(":", 1)[0]
+            if path.endswith(":batchGenerateContent"):
+                return self._batch_create(model, request)
+
+            if self._inject_failure(graph=False):
+                return
+
+            if model in config.fail_models:
+                self._sleep(config.latency)
+                return self._send_json(503, {"error": {"code": 503, "message": f"{model} is overloaded (mock)"}})
+            is_image = "image" in model
+            is_json = request.get("generationConfig", {}).get("responseMimeType") == "application/json"
+
+            if not is_image and random.random() < config.slow_rate:
+                time.sleep(config.latency * (config.slow_factor - 1))
+
+            if path.endswith(":streamGenerateContent"):
+                return self._stream(request, json.dumps(IMAGE_PROMPTS, ensure_ascii=False) if is_json else article)
+
+            self._sleep(config.image_latency if is_image else config.latency)
+            if is_image:
+                parts = [{"inlineData": {"mimeType": "image/png", "data": image_b64}}]
+                usage = self._usage(request, 1290 * 2)
+            else:
+                text = json.dumps(IMAGE_PROMPTS, ensure_ascii=False) if is_json else article
+                parts = [{"text": text}]
+                usage = self._usage(request, len(text))
+            self._send_json(200, {
+                "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}],
+                "usageMetadata": usage,
+            })
+
+        def _stream(self, request: dict, text: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            n = max(1, config.stream_chunks)
+            size = -(-len(text) // n)
+            for i in range(n):
+                self._sleep(config.latency / n)
+                chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text[i * size:(i + 1) * size]}]}}]}
+                if i == n - 1:
+                    chunk["candidates"][0]["finishReason"] = "STOP"
+                    chunk["usageMetadata"] = self._usage(request, len(text))
+                data = f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        # ─── Gemini 批次模式 ─── #
+
+        def _upload(self, query: dict, body: bytes):
+            """resumable 上傳：start 回傳上傳網址，upload, finalize 存下檔案內容"""
+            if "upload_id" not in query:
+                with lock:
+                    counter["files"] += 1
+                    upload_id = counter["files"]
+                url = f"http://{self.headers['Host']}/upload/v1beta/files?upload_id={upload_id}"
+                return self._send_json(200, {}, {"X-Goog-Upload-URL": url, "X-Goog-Upload-Status": "active"})
+            name = f"files/mock-in{query['upload_id']}"
+            files[name] = body
+            self._send_json(200, {"file": {"name": name, "mimeType": "application/jsonl", "sizeBytes": str(len(body))}})
+
+        def _batch_create(self, model: str, request: dict):
+            batch = request.get("batch", {})
+            input_config = batch.get("input_config") or batch.get("inputConfig") or {}
+            file_name = input_config.get("file_name") or input_config.get("fileName")
+            if file_name not in files:
+                return self._send_json(400, {"error": {"code": 400, "message": f"unknown file {file_name} (mock)"}})
+            with lock:
+                counter["batches"] += 1
+                name = f"batches/mock{counter['batches']}"
+            batches[name] = {"model": model, "input": file_name, "created": time.time(),
+                             "display_name": batch.get("display_name"), "output": None}
+            self._send_json(200, self._batch_status(name))
+
+        def _batch_output(self, name: str) -> str:
+            """依輸入檔逐行產生結果（依 error_rate 讓個別請求失敗）"""
+            batch = batches[name]
+            lines = []
+            for line in files[batch["input"]].decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                request = item["request"]
+                if random.random() < config.error_rate:
+                    lines.append({"key": item["key"], "error": {"code": 500, "message": "internal error (mock)"}})
+                    continue
+                is_json = request.get("generationConfig", {}).get("responseMimeType") == "application/json"
+                text = json.dumps(IMAGE_PROMPTS, ensure_ascii=False) if is_json else article
+                lines.append({"key": item["key"], "response": {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                    "usageMetadata": self._usage(request, len(text)),
+                }})
+            output = f"files/mock-out{name.rsplit('mock', 1)[-1]}"
+            files[output] = "".join(json.dumps(l, ensure_ascii=False) + "\n" for l in lines).encode("utf-8")
+            return output
+
+        def _batch_status(self, name: str) -> dict:
+            batch = batches[name]
+            elapsed = time.time() - batch["created"]
+            if batch["model"] in config.fail_models:
+                state = "BATCH_STATE_FAILED"
+            elif elapsed < config.batch_latency / 2:
+                state = "BATCH_STATE_PENDING"
+            elif elapsed < config.batch_latency:
+                state = "BATCH_STATE_RUNNING"
+            else:
+                state = "BATCH_STATE_SUCCEEDED"
+            status = {"name": name, "metadata": {
+                "@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch",
+                "model": f"models/{batch['model']}", "displayName": batch["display_name"], "state": state,
+            }}
+            if state == "BATCH_STATE_SUCCEEDED":
+                with lock:
+                    if batch["output"] is None:
+                        batch["output"] = self._batch_output(name)
+                status["done"] = True
+                status["response"] = {
+                    "@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatchOutput",
+                    "responsesFile": batch["output"],
+                }
+            elif state == "BATCH_STATE_FAILED":
+                status["done"] = True
+                status["error"] = {"code": 503, "message": f"{batch['model']} is overloaded (mock)"}
+            return status
+
+        # ─── Graph API ─── #
+
+        def _graph(self, method: str, path: str, params: dict):
+            # access_token 以 bad 開頭時模擬失效的 Token
+            if params.get("access_token", "").startswith("bad"):
+                err = {"error": {"code": 190, "type": "OAuthException", "message": "Invalid OAuth access token (mock)"}}
+                return self._send_json(400, err)
+
+            if method == "GET" and path.endswith("/debug_token"):
+                self._sleep(config.latency / 4)
+                return self._send_json(200, {"data": {
+                    "app_id": "mock", "type": "PAGE", "is_valid": True, "expires_at": 0,
+                    "scopes": ["pages_manage_posts", "pages_read_engagement"],
+                }})
+
+            if method == "GET" and path.endswith("/posts"):
+                page_id = path.split("/")[-2]
+                self._sleep(config.latency / 4)
+                since = float(params.get("since", 0))
+                with lock:
+                    posts = [p for p in feeds.get(page_id, []) if p["created_time"] >= since]
+                return self._send_json(200, {"data": posts[::-1][:int(params.get("limit", 25))]})
+
+            if method == "GET":
+                page_id = path.rstrip("/").rsplit("/", 1)[-1]
+                self._sleep(config.latency / 4)
+                return self._send_json(200, {"name": "Mock Page", "id": page_id})
+
+            if self._inject_failure(graph=True):
+                return
+            is_photo = path.endswith("/photos")
+            self._sleep(config.latency * (3 if is_photo else 1))
+            page_id = path.split("/")[-2]
+            with lock:
+                counter["posts"] += 1
+                n = counter["posts"]
+                feeds.setdefault(page_id, []).append(
+                    {"id": f"{page_id}_{n}", "message": params.get("message", ""), "created_time": time.time()}
+                )
+            if is_photo:
+                return self._send_json(200, {"id": f"photo{n}", "post_id": f"{page_id}_{n}"})
+            self._send_json(200, {"id": f"{page_id}_{n}"})
+
+        def _form_fields(self, body: bytes) -> dict:
+            """urlencoded 或 multipart 表單中的文字欄位（access_token 與 message）"""
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("application/x-www-form-urlencoded"):
+                return dict(parse_qsl(body.decode("utf-8")))
+            fields = {}
+            for name in ("access_token", "message"):
+                match = re.search(rb'name="' + name.encode() + rb'"\r\n\r\n(.*?)\r\n--', body, re.S)
+                if match:
+                    fields[name] = match.group(1).decode("utf-8")
+            return fields
+
+        # ─── Routing ─── #
+
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            if path.startswith("/graph/"):
+                return self._graph("GET", path, dict(parse_qsl(query)))
+            if path == "/v1beta/models":
+                return self._send_json(200, {"models": MODELS})
+            if path.startswith("/v1beta/batches/"):
+                name = path[len("/v1beta/"):]
+                if name not in batches:
+                    return self._send_json(404, {"error": {"code": 404, "message": f"{name} not found (mock)"}})
+                return self._send_json(200, self._batch_status(name))
+            if path.startswith("/download/v1beta/") and path.endswith(":download"):
+                name = path[len("/download/v1beta/"):-len(":download")]
+                if name not in files:
+                    return self._send_json(404, {"error": {"code": 404, "message": f"{name} not found (mock)"}})
+                return self._send_bytes(200, files[name], "application/jsonl")
+            self._send_json(404, {"error": {"message": f"unknown path {path}"}})
+
+        def do_POST(self):
+            path, _, query = self.path.partition("?")
+            body = self._read_body()
+            if path == "/upload/v1beta/files":
+                return self._upload(dict(parse_qsl(query)), body)
+            if path.startswith("/v1beta/"):
+                return self._gemini(path, json.loads(body or b"{}"))
+            if path.startswith("/graph/"):
+                return self._graph("POST", path, self._form_fields(body))
+            self._send_json(404, {"error": {"message": f"unknown path {path}"}})
+
+        def do_PATCH(self):
+            self._read_body()
+            self._send_json(200, {})
+
+    return Handler
+
+
+class _QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # 用戶端結束時直接斷開 keep-alive 連線是正常情況，不印 traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def serve(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    server = _QuietServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+def _serve_forever(config_dict: dict, port: int):
+    serve(MockConfig(**config_dict), port=port).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini / Graph API 本機替身伺服器")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.2, help="文字請求的基本延遲（秒）")
+    parser.add_argument("--image-latency", type=float, help="圖片請求延遲（預設為文字的 5 倍）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回 500 的機率")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="回 429 的機率")
+    parser.add_argument("--image-size", type=int, default=1024, help="回傳圖片邊長（px）")
+    parser.add_argument("--connect-latency", type=float, default=0.0, help="每條新連線的延遲（模擬 TLS 握手）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="文字請求變慢（長尾）的機率")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="變慢時延遲為平常的幾倍")
+    parser.add_argument("--fail-models", default="", help="一律回 503 的模型（逗號分隔）")
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="批次工作建立後幾秒完成")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, image_latency=args.image_latency, error_rate=args.error_rate,
+                        rate_429=args.rate_429, image_size=args.image_size, connect_latency=args.connect_latency,
+                        slow_rate=args.slow_rate, slow_factor=args.slow_factor,
+                        fail_models=[m for m in args.fail_models.split(",") if m], batch_latency=args.batch_latency)
+    server = serve(config, port=args.port)
+    print(f"Mock servers on http://127.0.0.1:{server.server_port}  (Gemini: /v1beta, Graph: /graph)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+離線 benchmark — 以本機替身伺服器驅動真正的 services 函式，不花 Gemini / Facebook 配額
+
+用法：
+    python -m benchmarks.run
+    python -m benchmarks.run --sessions 1,10,50 --flows 3 --latency 0.3 --rate-429 0.02
+    python -m benchmarks.run --json bench_output.json
+    python -m benchmarks.run --rate-429 0.05 --with-quota   # 套用配額限制，觀察 429 後的降速
+
+每個併發等級（模擬 N 個同時操作的 session）各跑 flows 次完整流程：
+    1. 串流生成文章 → 3. 圖片 Prompt → 4. 生成圖片 → 5. 發布含圖片貼文
+報告吞吐量、各步驟延遲百分位數、錯誤數與 peak RSS。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 確保 project root 在 sys.path
+PROJECT_ROOT = Path(__file__).parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from benchmarks.mock_servers import MockConfig, _serve_forever
+
+
+STEPS = ("article", "first_card", "image_prompts", "image", "publish")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"mock server 未在 {timeout} 秒內啟動")
+
+
+def _configure_env(port: int):
+    """services 在匯入時讀取設定，必須在 import 前指向替身伺服器"""
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{port}/v1beta"
+    os.environ["FB_GRAPH_URL"] = f"http://127.0.0.1:{port}/graph"
+    os.environ["GEMINI_API_KEY"] = "bench-key"
+    for suffix in ("", "_HOUJIAZAI"):
+        os.environ[f"FB_PAGE_ACCESS_TOKEN{suffix}"] = "bench-token"
+        os.environ[f"FB_PAGE_ID{suffix}"] = f"bench-page{suffix.lower()}"
+
+
+def _current_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class RssSampler:
+    """背景每 50 ms 取樣一次 RSS，記錄區間內的最高值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, _current_rss_kb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_kb = _current_rss_kb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_kb = max(self.peak_kb, _current_rss_kb())
+
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def run_flow(session_idx: int, flow_idx: int) -> dict:
+    """一個 session 的完整流程（步驟 1→5），與 app.py 呼叫相同的 services 函式"""
+    from services.facebook_service import post_with_image
+    from services.gemini_service import generate_article_stream, generate_image_artifact, generate_image_prompts_stream
+
+    timings = {}
+    material = f"session {session_idx} flow {flow_idx}: 冬天長輩容易跌倒，居家環境可以怎麼預防？{time.time_ns()}"
+    brand = "houjiazai" if session_idx % 2 else "default"
+    stage = "article"
+    t_flow = time.perf_counter()
+    try:
+        t0 = time.perf_counter()
+        article = "".join(generate_article_stream(material, brand=brand, no_cache=True))
+        timings["article"] = time.perf_counter() - t0
+
+        stage = "image_prompts"
+        t0 = time.perf_counter()
+        prompts = []
+        for prompt in generate_image_prompts_stream(article, no_cache=True):
+            if not prompts:
+                # 第一張風格卡片可以顯示的時間
+                timings["first_card"] = time.perf_counter() - t0
+            prompts.append(prompt)
+        timings["image_prompts"] = time.perf_counter() - t0
+
+        stage = "image"
+        t0 = time.perf_counter()
+        artifact = generate_image_artifact(prompts[0]["short_prompt_en"], no_cache=True)
+        timings["image"] = time.perf_counter() - t0
+
+        stage = "publish"
+        t0 = time.perf_counter()
+        post_with_image(article, artifact, brand=brand)
+        timings["publish"] = time.perf_counter() - t0
+        error = None
+    except Exception as e:
+        error = f"[{stage}] {type(e).__name__}: {e}"
+    timings["flow"] = time.perf_counter() - t_flow
+    return {"timings": timings, "error": error}
+
+
+def run_level(sessions: int, flows: int) -> dict:
+    """sessions 個 session 同時各跑 flows 次流程"""
+    from services import metrics
+
+    aggregator = metrics.Aggregator()
+    metrics.add_hook(aggregator)
+
+    def _session(idx):
+        return [run_flow(idx, f) for f in range(flows)]
+
+    started = time.perf_counter()
+    with RssSampler() as rss:
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            results = [r for rs in pool.map(_session, range(sessions)) for r in rs]
+    elapsed = time.perf_counter() - started
+    metrics.remove_hook(aggregator)
+
+    ok = [r for r in results if r["error"] is None]
+    report = {
+        "sessions": sessions,
+        "flows": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_flows_per_s": round(len(ok) / elapsed, 3) if elapsed else None,
+        "peak_rss_mb": round(rss.peak_kb / 1024, 1),
+        "latency_s": {},
+        "calls": aggregator.summary(),
+        "sample_errors": sorted({r["error"] for r in results if r["error"]})[:5],
+    }
+    for step in STEPS + ("flow",):
+        values = [r["timings"][step] for r in ok if step in r["timings"]]
+        report["latency_s"][step] = {
+            f"p{p}": round(v, 3) if (v := percentile(values, p)) is not None else None
+            for p in (50, 95, 99)
+        }
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"─── {report['sessions']} sessions ───",
+        f"流程：{report['flows']}（成功 {report['ok']}、失敗 {report['errors']}），耗時 {report['elapsed_s']:.2f}s",
+        f"吞吐量：{report['throughput_flows_per_s']} 流程/秒   peak RSS：{report['peak_rss_mb']} MB",
+    ]
+    for step, pcts in report["latency_s"].items():
+        if pcts["p50"] is not None:
+            lines.append(f"  {step:<14} p50 {pcts['p50']:.3f}s  p95 {pcts['p95']:.3f}s  p99 {pcts['p99']:.3f}s")
+    for row in report["calls"]:
+        lines.append(
+            f"  · {row['service']}/{row['operation']:<22} {row['calls']:>4} 次  錯誤 {row['errors']:>3}  "
+            f"重試 {row['retries']:>3}  p50 {row['p50_s']}s  p95 {row['p95_s']}s"
+        )
+    if report.get("hedging"):
+        lines.append(f"  對沖：{report['hedging']['hedges']} / {report['hedging']['calls']} 次呼叫")
+    for err in report["sample_errors"]:
+        lines.append(f"  ❌ {err}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="以本機替身伺服器跑效能基準")
+    parser.add_argument("--sessions", default="1,10,50", help="併發 session 數（逗號分隔）")
+    parser.add_argument("--flows", type=int, default=3, help="每個 session 跑幾次完整流程")
+    parser.add_argument("--latency", type=float, default=0.2, help="替身伺服器文字請求延遲（秒）")
+    parser.add_argument("--image-latency", type=float, help="圖片請求延遲（預設為文字的 5 倍）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回 500 的機率")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="回 429 的機率")
+    parser.add_argument("--image-size", type=int, default=1024, help="回傳圖片邊長（px）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="文字請求變慢（長尾）的機率")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="變慢時延遲為平常的幾倍")
+    parser.add_argument("--no-hedge", action="store_true", help="停用請求對沖（比較用）")
+    parser.add_argument("--fail-models", default="", help="替身伺服器一律回 503 的模型（逗號分隔），測試備援")
+    parser.add_argument("--with-quota", action="store_true", help="套用 quotas.json / 預設的 RPM/TPM 限制（預設不限）")
+    parser.add_argument("--json", type=Path, help="另存完整結果為 JSON")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, image_latency=args.image_latency, error_rate=args.error_rate,
+                        rate_429=args.rate_429, image_size=args.image_size,
+                        slow_rate=args.slow_rate, slow_factor=args.slow_factor,
+                        fail_models=[m for m in args.fail_models.split(",") if m])
+
+    # 替身伺服器跑在另一個 process，RSS / CPU 只計入受測端
+    port = _free_port()
+    server = multiprocessing.Process(target=_serve_forever, args=(config.to_dict(), port), daemon=True)
+    server.start()
+    workdir = Path(tempfile.mkdtemp(prefix="bench_"))
+    reports = []
+    try:
+        _wait_for_port(port)
+        _configure_env(port)
+
+        # 回應快取指到暫存目錄，避免污染本機快取
+        from services import response_cache
+        response_cache._cache = response_cache.ResponseCache(workdir / "responses.sqlite3")
+
+        # 圖片資產庫同樣放暫存目錄
+        from services import asset_store
+        asset_store._store = asset_store.AssetStore(workdir / "assets")
+
+        # 配額 bucket 同樣用暫存檔，不與正式環境的 process 共用額度
+        from services import rate_limiter
+        rate_limiter._manager = rate_limiter.QuotaManager(
+            workdir / "quota.sqlite3", limits=None if args.with_quota else {})
+
+        # 模型目錄同樣放暫存目錄，從替身伺服器取得
+        from services import gemini_service, model_catalog
+        gemini_service._model_catalog = model_catalog.ModelCatalog(
+            gemini_service.BASE_URL, gemini_service.API_KEY, path=workdir / "models.json")
+
+        from services import hedging
+        if args.no_hedge:
+            hedging._budget.rate = 0
+
+        for sessions in (int(s) for s in args.sessions.split(",") if s.strip()):
+            report = run_level(sessions, args.flows)
+            report["hedging"] = hedging.stats()
+            print(format_report(report))
+            reports.append(report)
+
+        if args.json:
+            args.json.write_text(json.dumps({"config": config.to_dict(), "levels": reports},
+                                            ensure_ascii=False, indent=2), encoding="utf-8")
+    finally:
+        server.terminate()
+        server.join()
+    return 0 if all(r["errors"] == 0 for r in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
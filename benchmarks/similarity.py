@@ -0,0 +1,121 @@
+"""
+主題相似度基準 — 量測索引在數萬篇貼文規模下的查詢延遲與近似重複的召回率
+
+用法：
+    python -m benchmarks.similarity
+    python -m benchmarks.similarity --posts 40000 --queries 200
+
+以固定亂數種子產生合成素材（共用的衛教用語 + 各篇獨有的句子）寫入暫存索引，再以兩種查詢量測：
+    near-duplicate ：抽一篇既有素材，刪掉一句、改寫一句後查詢（應找回原文）
+    unrelated      ：全新組合的素材（不應有任何結果）
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 確保 project root 在 sys.path
+PROJECT_ROOT = Path(__file__).parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.topic_index import MATERIAL, TopicIndex
+
+
+TOPICS = [
+    "長輩跌倒", "流感疫苗", "高血壓", "糖尿病足", "口腔保健", "失智症", "骨質疏鬆", "睡眠品質", "腸病毒",
+    "中風徵兆", "護眼", "心肺復甦", "減鹽飲食", "運動傷害", "孕期營養", "過敏性鼻炎", "帶狀皰疹", "腎臟保健",
+]
+PHRASES = [
+    "浴室加裝扶手", "走道保持明亮", "每天量血壓並記錄", "少吃加工食品", "飯後半小時散步", "定期回診追蹤",
+    "注意手部清潔", "睡前避免滑手機", "多補充鈣質與維生素D", "出現症狀立即就醫", "每年接種疫苗",
+    "控制體重", "戒菸戒酒", "多喝水少喝含糖飲料", "保持規律作息", "使用含氟牙膏", "每半年洗牙一次",
+    "家中備妥急救用品", "外出配戴口罩", "選擇合腳的鞋子", "每天檢查雙腳", "適度曬太陽", "避免久坐",
+    "用餐細嚼慢嚥", "注意氣溫變化", "天冷時注意保暖", "遵照醫囑服藥", "不要自行停藥", "多吃蔬菜水果",
+]
+
+
+# 常用漢字範圍，組出彼此不相關的句子
+CHARS = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+
+def random_sentence(rng: random.Random) -> str:
+    return "".join(rng.choices(CHARS, k=rng.randint(8, 16)))
+
+
+def make_material(rng: random.Random) -> str:
+    """主題 + 幾句常見衛教用語 + 幾句各篇獨有的內容"""
+    topic = rng.choice(TOPICS)
+    sentences = [f"{topic}的預防重點"] + rng.sample(PHRASES, 3)
+    sentences += [random_sentence(rng) for _ in range(rng.randint(5, 8))]
+    rng.shuffle(sentences)
+    return "，".join(sentences) + "。"
+
+
+def perturb(text: str, rng: random.Random) -> str:
+    """刪掉一句、換掉一句，模擬稍微改寫過的同一份素材"""
+    sentences = text.rstrip("。").split("，")
+    sentences.pop(rng.randrange(len(sentences)))
+    sentences[rng.randrange(len(sentences))] = random_sentence(rng)
+    return "，".join(sentences) + "。"
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="量測主題相似度索引的查詢延遲與召回率")
+    parser.add_argument("--posts", type=int, default=40000, help="索引中的貼文數")
+    parser.add_argument("--queries", type=int, default=200, help="每種查詢跑幾次")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    materials = [make_material(rng) for _ in range(args.posts)]
+
+    with tempfile.TemporaryDirectory(prefix="topic_index_") as tmp:
+        index = TopicIndex(Path(tmp) / "topic_index")
+        start = time.perf_counter()
+        for i, text in enumerate(materials):
+            index.add(f"d{i}", MATERIAL, text, brand="bench")
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reloaded = TopicIndex(Path(tmp) / "topic_index")
+        load = time.perf_counter() - start
+        assert len(reloaded) == len(index)
+
+        results = {}
+        for mode in ("near-duplicate", "unrelated"):
+            latencies, hits = [], 0
+            for _ in range(args.queries):
+                if mode == "near-duplicate":
+                    target = rng.randrange(args.posts)
+                    query = perturb(materials[target], rng)
+                else:
+                    target, query = None, make_material(rng)
+                t0 = time.perf_counter()
+                matches = index.search(query)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if mode == "near-duplicate":
+                    hits += bool(matches) and matches[0]["draft_id"] == f"d{target}"
+                else:
+                    hits += not matches
+            results[mode] = (latencies, hits)
+
+    print(f"貼文 {args.posts}：逐筆加入 {build:.1f} 秒（每筆 {build / args.posts * 1000:.2f} ms），重新載入 {load:.2f} 秒")
+    print(f"{'查詢':<16}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'正確':>10}")
+    for mode, (latencies, hits) in results.items():
+        print(f"{mode:<16}{statistics.median(latencies):>10.2f}{percentile(latencies, 0.99):>10.2f}"
+              f"{max(latencies):>10.2f}{hits:>6}/{args.queries}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,53 @@
+"""
+列出 Gemini 模型目錄與目前的路由
 
-import os
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}"
-
-response = requests.get(url)
-if response.status_code == 200:
-    models = response.json().get("models", [])
-    for m in models:
-        print(f"Name: {m['name']}")
-        print(f"Display Name: {m.get('displayName')}")
-        print(f"Supported Generation Methods: {m.get('supportedGenerationMethods')}")
+用法：
+    python list_models.py              # 使用 data/models.json（過期時重新取得）
+    python list_models.py --refresh    # 強制重新取得
+    python list_models.py --method generateContent
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+# 確保 project root 在 sys.path
+PROJECT_ROOT = Path(__file__).parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.gemini_service import get_model_catalog, get_model_router
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="列出 Gemini 模型目錄與各任務的備援鏈")
+    parser.add_argument("--refresh", action="store_true", help="忽略 TTL，重新向 API 取得目錄")
+    parser.add_argument("--method", help="只列出支援此方法的模型（例如 generateContent）")
+    args = parser.parse_args(argv)
+
+    catalog = get_model_catalog()
+    try:
+        models = catalog.refresh() if args.refresh or catalog.stale else catalog.models()
+    except Exception as e:
+        print(f"Error: {e}")
+        return 1
+
+    for info in sorted(models.values(), key=lambda m: m.name):
+        if args.method and not info.supports(args.method):
+            continue
+        print(f"Name: {info.name}")
+        print(f"Display Name: {info.display_name}")
+        print(f"Supported Generation Methods: {info.methods}")
+        print(f"Token Limits: input {info.input_token_limit} / output {info.output_token_limit}")
         print("-" * 20)
-else:
-    print(f"Error: {response.status_code} - {response.text}")
+
+    router = get_model_router()
+    print("\n備援鏈（✓ = 目錄中可用）：")
+    for task, chain in router.routes.items():
+        marks = [f"{m} {'✓' if catalog.available(m) else '✗'}" for m in chain]
+        print(f"  {task:<14} {' → '.join(marks)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,28 @@
 """圖片 Prompt 生成 System Prompt"""
 
+# 每種風格的欄位；順序即輸出順序（風格名稱最先出現，卡片可以先顯示標題）
+IMAGE_PROMPT_FIELDS = [
+    "style_name_zh",
+    "style_name_en",
+    "long_desc_zh",
+    "long_desc_en",
+    "short_prompt_zh",
+    "short_prompt_en",
+]
+
+# Gemini responseSchema：強制輸出 3 個含上述欄位的物件，不必再從 ```json 區塊撈
+IMAGE_PROMPT_SCHEMA = {
+    "type": "ARRAY",
+    "minItems": 3,
+    "maxItems": 3,
+    "items": {
+        "type": "OBJECT",
+        "properties": {field: {"type": "STRING"} for field in IMAGE_PROMPT_FIELDS},
+        "required": IMAGE_PROMPT_FIELDS,
+        "propertyOrdering": IMAGE_PROMPT_FIELDS,
+    },
+}
+
 IMAGE_PROMPT_SYSTEM_PROMPT = """角色
 你是一位享譽國際的 AI 視覺藝術家與資深提示詞工程師，專精於 Midjourney、Stable Diffusion 與 DALL-E 3 的提示詞建構。你具備深厚的攝影學、美術史、電影構圖及數位渲染知識。
 
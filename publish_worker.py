@@ -0,0 +1,183 @@
+"""
+發布 worker — 獨立於 Streamlit 的背景程式，依排程把佇列中的貼文發布到 Facebook
+
+用法：
+    python publish_worker.py
+    python publish_worker.py --per-page-concurrency 2 --poll-interval 5
+    python publish_worker.py --once     # 只處理目前到期的工作後結束（適合 cron）
+
+UI（app.py 步驟 5）把完成的貼文寫入 data/publish_queue.sqlite3，
+worker 每隔 poll-interval 秒取出到期的工作上傳，並寫回 post ID、耗時與錯誤。
+Streamlit 本身也會以 daemon thread 跑一個 worker（start_in_app_worker），沒有另外啟動本程式時
+（例如 Streamlit Cloud）立即發布照常運作；本程式在跑時內建的 worker 自動讓出。
+確定沒有送到 Facebook 的失敗（連線建立失敗、限流）會以指數退避自動重試；
+已送出卻沒有明確結果的（讀取逾時、5xx、worker 中斷）標記為 unknown，不會自動重送：
+worker 稍後到粉專動態找同內容的貼文，找到就標記完成，找不到則留給使用者在 UI 確認。
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 確保 project root 在 sys.path
+PROJECT_ROOT = Path(__file__).parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.facebook_service import find_published_post, post_with_image, post_text_only
+from services.image_store import ImageArtifact
+from services.publish_queue import EXTERNAL, HEARTBEAT_TIMEOUT, IN_APP, VERIFY_DELAY_SECONDS, get_publish_queue
+from services.rate_limiter import QuotaExceeded
+
+
+class PublishWorker:
+    """從佇列取出到期工作上傳；每個粉專（品牌）各自有併發上限"""
+
+    def __init__(self, per_page_concurrency: int = 1, max_workers: int = 8, kind: str = EXTERNAL):
+        self.queue = get_publish_queue()
+        self.kind = kind
+        self.worker_id = f"{kind}:{socket.gethostname()}:{os.getpid()}"
+        self.max_workers = max_workers
+        self.per_page_concurrency = per_page_concurrency
+        # 各粉專上傳中的數量；只取出還有空位的粉專的工作，滿的粉專不會佔住 thread
+        self._page_running = Counter()
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="publish")
+        self._wake = threading.Event()
+
+    def _publish(self, job: dict):
+        t0 = time.perf_counter()
+        try:
+            if job["image"]:
+                image = ImageArtifact(job["image"], job["image_mime"] or "image/png")
+                post = post_with_image(job["message"], image, brand=job["brand"])
+            else:
+                post = post_text_only(job["message"], brand=job["brand"])
+            latency = round(time.perf_counter() - t0, 3)
+            self.queue.mark_done(job["id"], post.get("post_id", post.get("id")), latency)
+            print(f"✅ #{job['id']} ({job['brand']}) {latency:.1f}s")
+        except Exception as e:
+            latency = round(time.perf_counter() - t0, 3)
+            if getattr(e, "uncertain", False):
+                self.queue.mark_unknown(job["id"], str(e), latency)
+                print(f"❓ #{job['id']} ({job['brand']}) 結果不明，稍後到粉專動態確認：{e}")
+            else:
+                # 額度等待逾時發生在送出之前，可以安全重送
+                retryable = isinstance(e, QuotaExceeded) or getattr(e, "retryable", False)
+                self.queue.mark_failed(job["id"], str(e), job["attempts"], retryable, latency)
+                print(f"❌ #{job['id']} ({job['brand']}) 第 {job['attempts']} 次：{e}")
+        finally:
+            with self._lock:
+                self._page_running[job["brand"]] -= 1
+            self._in_flight.release()
+
+    def poll(self) -> int:
+        """取出目前到期的工作送進 thread pool，回傳這次送出的數量"""
+        submitted = 0
+        while self._in_flight.acquire(blocking=False):
+            with self._lock:
+                full = [brand for brand, n in self._page_running.items() if n >= self.per_page_concurrency]
+            jobs = self.queue.claim_due(limit=1, exclude_brands=full)
+            if not jobs:
+                self._in_flight.release()
+                break
+            with self._lock:
+                self._page_running[jobs[0]["brand"]] += 1
+            self._pool.submit(self._publish, jobs[0])
+            submitted += 1
+        return submitted
+
+    def verify_unknown(self) -> int:
+        """到粉專動態確認結果不明的工作：找到同內容的貼文就標記完成，找不到就留給使用者判斷"""
+        resolved = 0
+        for job in self.queue.due_for_verification():
+            try:
+                # 貼文不會早於排程時間建立；多留一分鐘給時鐘誤差
+                post_id = find_published_post(job["message"], brand=job["brand"], since=job["publish_at"] - 60)
+            except Exception as e:
+                self.queue.defer_verification(job["id"], delay=VERIFY_DELAY_SECONDS)
+                print(f"⚠️ #{job['id']} ({job['brand']}) 無法確認是否已發布：{e}")
+                continue
+            if post_id:
+                self.queue.mark_done(job["id"], post_id, job["latency"])
+                resolved += 1
+                print(f"✅ #{job['id']} ({job['brand']}) 已在粉專動態找到：{post_id}")
+            else:
+                self.queue.defer_verification(
+                    job["id"], f"{job['error']}（粉專動態中找不到這篇貼文，確認沒有發布後請重新排入）"
+                )
+                print(f"❓ #{job['id']} ({job['brand']}) 粉專動態中找不到，等待使用者確認")
+        return resolved
+
+    def step(self) -> bool:
+        """一輪：回報 heartbeat 後確認結果不明的工作並取出到期工作；內建 worker 在外部 worker 運作時讓出"""
+        self.queue.heartbeat(self.worker_id, self.kind)
+        if self.kind == IN_APP and self.queue.live_workers(kind=EXTERNAL):
+            return False
+        self.verify_unknown()
+        self.poll()
+        return True
+
+    def wake(self):
+        """同一個 process 剛加入工作時呼叫，立即處理而不等下一輪"""
+        self._wake.set()
+
+    def run(self, poll_interval: float = 5, once: bool = False):
+        # 其他 worker 還在跑時，running 的工作可能正由它上傳，不是中斷留下的
+        if not self.queue.live_workers(exclude=self.worker_id):
+            interrupted = self.queue.mark_interrupted()
+            if interrupted:
+                print(f"上次中斷時正在上傳的 {interrupted} 筆工作標記為結果不明，稍後到粉專動態確認")
+        try:
+            while True:
+                try:
+                    self.step()
+                except Exception as e:
+                    if once:
+                        raise
+                    # 佇列暫時無法存取（例如 SQLite 被鎖住）時下一輪再試，worker 不結束
+                    print(f"⚠️ 處理佇列失敗：{e}")
+                if once:
+                    break
+                # 間隔再長也要在 heartbeat 逾時前回報一次
+                self._wake.wait(min(poll_interval, HEARTBEAT_TIMEOUT / 2))
+                self._wake.clear()
+        except KeyboardInterrupt:
+            print("停止中，等待上傳中的工作完成...")
+        finally:
+            self._pool.shutdown(wait=True)
+
+
+def start_in_app_worker(poll_interval: float = 5) -> PublishWorker:
+    """在目前的 process（Streamlit）以 daemon thread 執行 worker；由 app.py 以 st.cache_resource 只啟動一次"""
+    worker = PublishWorker(kind=IN_APP)
+    threading.Thread(target=worker.run, kwargs={"poll_interval": poll_interval}, daemon=True,
+                     name="publish-worker").start()
+    return worker
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Facebook 排程發布 worker")
+    parser.add_argument("--per-page-concurrency", type=int, default=1, help="每個粉專同時上傳數")
+    parser.add_argument("--max-workers", type=int, default=8, help="全部粉專合計的同時上傳數")
+    parser.add_argument("--poll-interval", type=float, default=5, help="檢查佇列的間隔（秒）")
+    parser.add_argument("--once", action="store_true", help="只處理目前到期的工作後結束")
+    args = parser.parse_args(argv)
+
+    worker = PublishWorker(
+        per_page_concurrency=max(1, args.per_page_concurrency),
+        max_workers=max(1, args.max_workers),
+    )
+    worker.run(poll_interval=args.poll_interval, once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
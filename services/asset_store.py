@@ -0,0 +1,199 @@
+"""圖片資產庫 — 以內容雜湊存放生成的圖片與預覽縮圖，並記錄 prompt → 圖片的索引
+
+    output/assets/objects/ab/abcdef….png    原圖（檔名為 SHA-256，相同內容只存一份）
+    output/assets/thumbs/ab/abcdef….jpg     預覽縮圖（存入時產生，畫面只顯示這個）
+    output/assets/index.sqlite3             assets（雜湊 / 大小 / 最後使用時間）與 prompts（prompt → 雜湊）
+
+同一個 prompt 再次生成時直接回傳既有圖片；總容量超過上限時淘汰最久沒用到的圖片（LRU）。
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from services.image_encoding import MIME_EXTENSIONS, encode_for_facebook
+
+
+ASSETS_DIR = Path(__file__).parent.parent / "output" / "assets"
+
+# 預設總容量 1 GB（原圖 + 縮圖）
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# 預覽縮圖：長邊與 JPEG 品質
+THUMB_EDGE = 512
+THUMB_QUALITY = 80
+
+_COLUMNS = ("sha256", "mime", "size", "thumb_size", "model", "created_at", "last_used_at")
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()
+
+
+class Asset:
+    """資產庫中的一張圖片；內容與縮圖用到時才從磁碟讀取"""
+
+    def __init__(self, root: Path, sha256: str, mime: str, size: int, thumb_size: int, model: str = None,
+                 created_at: float = None, last_used_at: float = None):
+        self.sha256 = sha256
+        self.mime = mime
+        self.size = size
+        self.thumb_size = thumb_size
+        self.model = model
+        self.created_at = created_at
+        self.last_used_at = last_used_at
+        self.path = root / "objects" / sha256[:2] / f"{sha256}{MIME_EXTENSIONS.get(mime, '.png')}"
+        self.thumb_path = root / "thumbs" / sha256[:2] / f"{sha256}.jpg"
+
+    @property
+    def data(self) -> bytes:
+        return self.path.read_bytes()
+
+    @property
+    def thumbnail(self) -> bytes:
+        return self.thumb_path.read_bytes()
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+
+class AssetStore:
+    """
+    以 SQLite 為索引、檔案系統存內容的圖片資產庫。每次操作各自開連線，可跨 thread / process 使用。
+    """
+
+    def __init__(self, root: Path = ASSETS_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS assets (
+                    sha256 TEXT PRIMARY KEY,
+                    mime TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    thumb_size INTEGER NOT NULL,
+                    model TEXT,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS prompts (
+                    prompt_key TEXT PRIMARY KEY,
+                    prompt TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_lru ON assets(last_used_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_prompts_sha ON prompts(sha256)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.root / "index.sqlite3"), timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _asset(self, row) -> Asset:
+        return Asset(self.root, **dict(zip(_COLUMNS, row)))
+
+    def _touch(self, conn: sqlite3.Connection, sha256: str):
+        conn.execute("UPDATE assets SET last_used_at = ? WHERE sha256 = ?", (time.time(), sha256))
+
+    def get(self, sha256: str):
+        """依內容雜湊取得圖片；不存在（或檔案已遺失）回傳 None"""
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM assets WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return None
+            asset = self._asset(row)
+            if not asset.path.exists():
+                self._delete(conn, asset)
+                return None
+            self._touch(conn, sha256)
+        return asset
+
+    def lookup(self, prompt: str):
+        """這個 prompt 生成過的圖片；沒有則回傳 None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT sha256 FROM prompts WHERE prompt_key = ?", (prompt_key(prompt),)).fetchone()
+        return self.get(row[0]) if row else None
+
+    def put(self, data: bytes, mime: str, prompt: str = None, model: str = None) -> Asset:
+        """存入圖片（相同內容只存一份）並產生縮圖；有 prompt 時同時更新 prompt → 圖片索引"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        asset = self.get(sha256)
+        if asset is None:
+            thumbnail, _, _ = encode_for_facebook(data, max_edge=THUMB_EDGE, quality=THUMB_QUALITY)
+            asset = Asset(self.root, sha256, mime, len(data), len(thumbnail), model, now, now)
+            _write_atomic(asset.path, data)
+            _write_atomic(asset.thumb_path, thumbnail)
+            with self._connect() as conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO assets ({', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (sha256, mime, asset.size, asset.thumb_size, model, now, now),
+                )
+        if prompt:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO prompts (prompt_key, prompt, sha256, created_at) VALUES (?, ?, ?, ?)",
+                    (prompt_key(prompt), prompt, sha256, now),
+                )
+        self._evict(keep=sha256)
+        return asset
+
+    def _delete(self, conn: sqlite3.Connection, asset: Asset):
+        conn.execute("DELETE FROM assets WHERE sha256 = ?", (asset.sha256,))
+        conn.execute("DELETE FROM prompts WHERE sha256 = ?", (asset.sha256,))
+        asset.path.unlink(missing_ok=True)
+        asset.thumb_path.unlink(missing_ok=True)
+
+    def _evict(self, keep: str = None):
+        """總容量超過上限時，從最久沒用到的開始刪除（剛存入的那張除外）"""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size + thumb_size), 0) FROM assets").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM assets ORDER BY last_used_at").fetchall()
+            for row in rows:
+                if total <= self.max_bytes:
+                    break
+                asset = self._asset(row)
+                if asset.sha256 == keep:
+                    continue
+                self._delete(conn, asset)
+                total -= asset.size + asset.thumb_size
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size + thumb_size), 0) FROM assets").fetchone()
+            prompts = conn.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+        return {"images": count, "prompts": prompts, "bytes": total, "max_bytes": self.max_bytes}
+
+
+_store = None
+
+
+def get_asset_store() -> AssetStore:
+    """取得 process 共用的資產庫實例"""
+    global _store
+    if _store is None:
+        _store = AssetStore()
+    return _store
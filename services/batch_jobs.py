@@ -0,0 +1,287 @@
+"""Gemini 批次模式 — 事先規劃好的大量草稿改用 batchGenerateContent 離線生成（不佔線上配額，費用較低）
+
+每次 BatchPipeline.step() 推進一輪（batch_cli.py --batch-api 反覆呼叫，也可交給 cron）：
+    1. queued 的草稿組成 JSONL（key = 草稿 ID）→ Files API 上傳 → 建立文章批次
+    2. 依退避間隔查詢批次狀態；完成後下載結果檔，依 key 寫回草稿（drafted）
+    3. drafted 的草稿同樣送出圖片 Prompt 批次，完成後為 ready
+結果同時寫入回應快取，UI 從步驟 2 開啟草稿後不必再呼叫 Gemini。
+"""
+
+import json
+import time
+
+from prompts.article_prompt import get_article_prompt
+from prompts.image_prompt import IMAGE_PROMPT_SCHEMA, IMAGE_PROMPT_SYSTEM_PROMPT, get_image_prompt_request
+from services.brands import get_brand
+from services.draft_store import ARTICLE_RUNNING, DRAFTED, PROMPTS_RUNNING, QUEUED, get_draft_store
+from services.gemini_service import (API_KEY, BASE_URL, _build_text_payload, _extract_text, _parse_image_prompts,
+                                     get_model_catalog, get_model_router)
+from services.http_client import get_session
+from services.metrics import observe_response, track
+from services.response_cache import get_cache, make_key
+
+
+# 批次種類（同時也是 ModelRouter 的任務名稱）
+ARTICLE = "article"
+IMAGE_PROMPTS = "image_prompts"
+
+# 送出時草稿的狀態
+RUNNING_STATUS = {ARTICLE: ARTICLE_RUNNING, IMAGE_PROMPTS: PROMPTS_RUNNING}
+
+# 批次狀態（API 回傳 BATCH_STATE_*，存入時去掉前綴）；INGESTED 表示結果已寫回草稿
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+INGESTED = "INGESTED"
+ACTIVE_STATES = (PENDING, RUNNING, SUCCEEDED)
+
+# 查詢間隔：第一次 POLL_BASE_SECONDS 秒後，之後每次乘上 POLL_FACTOR，最長 POLL_MAX_SECONDS
+POLL_BASE_SECONDS = 60
+POLL_FACTOR = 1.5
+POLL_MAX_SECONDS = 30 * 60
+
+# 單一批次最多幾筆請求，超過時拆成多個批次
+MAX_REQUESTS_PER_BATCH = 1000
+
+
+def _state(data: dict) -> str:
+    state = (data.get("metadata") or {}).get("state") or data.get("state") or PENDING
+    return state.rsplit("_STATE_", 1)[-1]
+
+
+def _responses_file(data: dict):
+    for holder in (data.get("response"), (data.get("metadata") or {}).get("output"), data.get("output")):
+        if holder and holder.get("responsesFile"):
+            return holder["responsesFile"]
+    return None
+
+
+def request_prompts(kind: str, draft: dict) -> dict:
+    """草稿對應的請求內容，與線上呼叫相同（快取 key 也因此一致）"""
+    if kind == ARTICLE:
+        return {
+            "system_instruction": get_brand(draft["brand"]).system_prompt,
+            "user_prompt": get_article_prompt(draft["raw_material"]),
+        }
+    return {
+        "system_instruction": IMAGE_PROMPT_SYSTEM_PROMPT,
+        "user_prompt": get_image_prompt_request(draft["article"]),
+        "response_mime_type": "application/json",
+        "response_schema": IMAGE_PROMPT_SCHEMA,
+    }
+
+
+def build_jsonl(kind: str, drafts: list[dict]) -> bytes:
+    """批次輸入檔：每行 {"key": 草稿 ID, "request": generateContent 的 request body}"""
+    lines = [
+        json.dumps({"key": d["id"], "request": _build_text_payload(**request_prompts(kind, d))}, ensure_ascii=False)
+        for d in drafts
+    ]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class BatchClient:
+    """Files API 上傳 / 下載與 batches REST 呼叫"""
+
+    def __init__(self, base_url: str = BASE_URL, api_key: str = API_KEY):
+        if not api_key:
+            raise ValueError("缺少 GEMINI_API_KEY！請檢查 secrets.toml 或 .env")
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        # 上傳 / 下載在同一個 host 的 /upload、/download 前綴下
+        root, _, version = self.base_url.rpartition("/")
+        self.upload_url = f"{root}/upload/{version}/files"
+        self.download_url = f"{root}/download/{version}"
+
+    def upload(self, data: bytes, display_name: str) -> str:
+        """以 resumable 協定上傳 JSONL，回傳 files/... 名稱"""
+        session = get_session("gemini_batch")
+        with track("gemini", "batch_upload") as rec:
+            resp = session.post(
+                self.upload_url,
+                params={"key": self.api_key},
+                headers={
+                    "X-Goog-Upload-Protocol": "resumable",
+                    "X-Goog-Upload-Command": "start",
+                    "X-Goog-Upload-Header-Content-Length": str(len(data)),
+                    "X-Goog-Upload-Header-Content-Type": "application/jsonl",
+                },
+                json={"file": {"display_name": display_name}},
+                timeout=30,
+            )
+            observe_response(rec, resp)
+            resp.raise_for_status()
+            resp = session.post(
+                resp.headers["X-Goog-Upload-URL"],
+                headers={"X-Goog-Upload-Offset": "0", "X-Goog-Upload-Command": "upload, finalize"},
+                data=data,
+                timeout=300,
+            )
+            observe_response(rec, resp)
+            resp.raise_for_status()
+            return resp.json()["file"]["name"]
+
+    def create(self, model: str, file_name: str, display_name: str) -> dict:
+        with track("gemini", "batch_create", model=model) as rec:
+            resp = get_session("gemini_batch").post(
+                f"{self.base_url}/models/{model}:batchGenerateContent",
+                params={"key": self.api_key},
+                json={"batch": {"display_name": display_name, "input_config": {"file_name": file_name}}},
+                timeout=60,
+            )
+            observe_response(rec, resp)
+            resp.raise_for_status()
+            return resp.json()
+
+    def get(self, name: str) -> dict:
+        with track("gemini", "batch_get") as rec:
+            resp = get_session("gemini_batch").get(f"{self.base_url}/{name}", params={"key": self.api_key}, timeout=30)
+            observe_response(rec, resp)
+            resp.raise_for_status()
+            return resp.json()
+
+    def download(self, file_name: str) -> bytes:
+        with track("gemini", "batch_download") as rec:
+            resp = get_session("gemini_batch").get(
+                f"{self.download_url}/{file_name}:download",
+                params={"key": self.api_key, "alt": "media"},
+                timeout=300,
+            )
+            observe_response(rec, resp)
+            resp.raise_for_status()
+            return resp.content
+
+
+class BatchPipeline:
+    """
+    草稿庫（draft_store）與 Gemini 批次工作之間的狀態機。所有狀態都在 SQLite，
+    process 中斷後重新執行會接著查詢尚未完成的批次，不會重送。
+    """
+
+    def __init__(self, store=None, client: BatchClient = None, with_image_prompts: bool = True,
+                 poll_base: float = POLL_BASE_SECONDS, max_requests: int = MAX_REQUESTS_PER_BATCH):
+        self.store = store or get_draft_store()
+        self.client = client or BatchClient()
+        self.with_image_prompts = with_image_prompts
+        self.poll_base = poll_base
+        self.max_requests = max_requests
+
+    def _choose_model(self, kind: str) -> str:
+        """備援鏈中第一個支援批次模式的模型"""
+        catalog = get_model_catalog()
+        chain = get_model_router().candidates(kind)
+        for model in chain:
+            if catalog.available(model, method="batchGenerateContent"):
+                return model
+        return chain[0]
+
+    def _poll_delay(self, polls: int) -> float:
+        return min(POLL_MAX_SECONDS, self.poll_base * POLL_FACTOR ** polls)
+
+    # ─── 送出 ─── #
+
+    def _submit(self, kind: str, drafts: list[dict]) -> list[str]:
+        events = []
+        for start in range(0, len(drafts), self.max_requests):
+            chunk = drafts[start:start + self.max_requests]
+            model = self._choose_model(kind)
+            display_name = f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{start // self.max_requests}"
+            try:
+                file_name = self.client.upload(build_jsonl(kind, chunk), display_name)
+                data = self.client.create(model, file_name, display_name)
+            except Exception as e:
+                # 草稿維持原狀態，下一輪再送
+                events.append(f"❌ 送出 {kind} 批次失敗（{len(chunk)} 筆）：{e}")
+                continue
+            # 建立當下的狀態不一定準確（可能已經失敗），一律由之後的查詢決定
+            self.store.add_batch(data["name"], kind, model, PENDING, file_name, len(chunk),
+                                 time.time() + self.poll_base)
+            self.store.mark_running([d["id"] for d in chunk], RUNNING_STATUS[kind], data["name"])
+            events.append(f"📤 {data['name']}：{kind} {len(chunk)} 筆（{model}）")
+        return events
+
+    # ─── 查詢 / 取回結果 ─── #
+
+    def _ingest(self, batch: dict, output_file: str) -> tuple[int, int]:
+        """下載結果檔並依 key 寫回草稿；回傳 (成功, 失敗) 筆數"""
+        kind = batch["kind"]
+        raw = self.client.download(output_file)
+        pending = {d["id"]: d for d in self.store.list_drafts(RUNNING_STATUS[kind], batch_name=batch["name"])}
+        ok = failed = 0
+        for line in raw.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            draft = pending.pop(item.get("key"), None)
+            if draft is None:
+                continue
+            try:
+                if "response" not in item:
+                    raise RuntimeError(json.dumps(item.get("error") or item.get("status") or item, ensure_ascii=False))
+                text = _extract_text(item["response"])
+                if kind == ARTICLE:
+                    self.store.set_article(draft["id"], text)
+                else:
+                    self.store.set_image_prompts(draft["id"], _parse_image_prompts(text))
+                prompts = request_prompts(kind, draft)
+                get_cache().set(make_key(batch["model"], prompts["system_instruction"], prompts["user_prompt"],
+                                         prompts.get("response_mime_type"), prompts.get("response_schema")), text)
+                ok += 1
+            except Exception as e:
+                self.store.mark_failed(draft["id"], f"[{kind}] {e}")
+                failed += 1
+        # 結果檔中沒有出現的草稿
+        for draft_id in pending:
+            self.store.mark_failed(draft_id, f"[{kind}] 批次結果中沒有這筆")
+            failed += 1
+        return ok, failed
+
+    def _poll(self, batch: dict) -> str:
+        name = batch["name"]
+        polls = batch["polls"] + 1
+        try:
+            data = self.client.get(name)
+            state = _state(data)
+            if state in (PENDING, RUNNING):
+                self.store.update_batch(name, state=state, polls=polls, error=None,
+                                        next_poll_at=time.time() + self._poll_delay(polls))
+                return f"⏳ {name}：{state}（第 {polls} 次查詢）"
+            if state != SUCCEEDED:
+                error = json.dumps(data.get("error") or state, ensure_ascii=False)
+                for draft in self.store.list_drafts(RUNNING_STATUS[batch["kind"]], batch_name=name):
+                    self.store.mark_failed(draft["id"], f"[{batch['kind']}] 批次 {state}：{error}")
+                self.store.update_batch(name, state=state, polls=polls, error=error)
+                return f"❌ {name}：{state}"
+            output_file = _responses_file(data)
+            if output_file is None:
+                raise RuntimeError("批次已完成但沒有結果檔")
+            self.store.update_batch(name, state=SUCCEEDED, output_file=output_file, polls=polls)
+            ok, failed = self._ingest(batch, output_file)
+            self.store.update_batch(name, state=INGESTED, error=None)
+            return f"✅ {name}：{batch['kind']} 成功 {ok} 筆、失敗 {failed} 筆"
+        except Exception as e:
+            # 查詢 / 下載失敗：保留目前狀態，退避後再試
+            self.store.update_batch(name, polls=polls, error=str(e)[:500],
+                                    next_poll_at=time.time() + self._poll_delay(polls))
+            return f"⚠️ {name}：{e}"
+
+    # ─── 推進 ─── #
+
+    def step(self) -> list[str]:
+        """查詢到期的批次、送出等待中的草稿；回傳這一輪的事件訊息"""
+        now = time.time()
+        events = [self._poll(b) for b in self.store.list_batches(ACTIVE_STATES) if b["next_poll_at"] <= now]
+        events += self._submit(ARTICLE, self.store.list_drafts(QUEUED))
+        if self.with_image_prompts:
+            events += self._submit(IMAGE_PROMPTS, self.store.list_drafts(DRAFTED))
+        return events
+
+    def pending(self) -> bool:
+        """還有草稿在等待或生成中"""
+        statuses = [QUEUED, ARTICLE_RUNNING, PROMPTS_RUNNING] + ([DRAFTED] if self.with_image_prompts else [])
+        return bool(self.store.list_drafts(statuses, limit=1))
+
+    def next_poll_at(self):
+        """最近一個批次的下次查詢時間；沒有進行中的批次時為 None"""
+        batches = self.store.list_batches(ACTIVE_STATES)
+        return min(b["next_poll_at"] for b in batches) if batches else None
@@ -0,0 +1,189 @@
+"""品牌註冊表 — 每個品牌對應的 system prompt、粉專 ID、Token 與標籤，啟動時從設定檔讀取一次
+
+設定檔為專案根目錄的 brands.json（或 BRANDS_CONFIG 指定的路徑），沒有時使用 DEFAULT_BRANDS：
+    {
+      "default": {
+        "name": "永芯居家長照",
+        "prompt": "default",
+        "token_secret": "FB_PAGE_ACCESS_TOKEN",
+        "page_id_secret": "FB_PAGE_ID",
+        "tags": ["長照"]
+      },
+      "clinic": {
+        "name": "新品牌",
+        "prompt_file": "prompts/clinic.md",
+        "token_secret": "FB_PAGE_ACCESS_TOKEN_CLINIC",
+        "page_id": "1234567890",
+        "tags": ["醫療"]
+      }
+    }
+
+prompt 為 prompts/article_prompt.py 中 PROMPTS 的 key；prompt_file 為相對專案根目錄的檔案。
+Token 只放在 secrets.toml / 環境變數，設定檔中只寫 secret 名稱；粉專 ID 可直接寫 page_id。
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import streamlit as st
+
+from prompts.article_prompt import ARTICLE_SYSTEM_PROMPT, PROMPTS
+
+
+PROJECT_ROOT = Path(__file__).parent.parent
+BRANDS_CONFIG = Path(os.getenv("BRANDS_CONFIG", PROJECT_ROOT / "brands.json"))
+
+# secrets 中的 Token / 粉專 ID 快取多久後重讀（更新 secrets.toml 後不必重啟）
+SECRET_TTL_SECONDS = 300
+
+# 找不到品牌時使用的 key（與舊版「非 houjiazai 一律視為 default」相同）
+DEFAULT_BRAND = "default"
+
+DEFAULT_BRANDS = {
+    "default": {
+        "name": "永芯居家長照",
+        "prompt": "default",
+        "token_secret": "FB_PAGE_ACCESS_TOKEN",
+        "page_id_secret": "FB_PAGE_ID",
+        "tags": ["長照"],
+    },
+    "houjiazai": {
+        "name": "厚家載藥師",
+        "prompt": "houjiazai",
+        "token_secret": "FB_PAGE_ACCESS_TOKEN_HOUJIAZAI",
+        "page_id_secret": "FB_PAGE_ID_HOUJIAZAI",
+        "tags": ["藥師"],
+    },
+}
+
+
+def _secret(name: str):
+    """讀取 st.secrets，沒有 secrets.toml 時 fallback 到環境變數（CLI / 背景程式使用）"""
+    if not name:
+        return None
+    try:
+        return st.secrets.get(name) or os.getenv(name)
+    except FileNotFoundError:
+        return os.getenv(name)
+
+
+class Brand:
+    """一個品牌 / 粉專的設定"""
+
+    def __init__(self, key: str, name: str = None, prompt: str = None, prompt_file: str = None,
+                 token_secret: str = None, page_id_secret: str = None, page_id: str = None, tags: list = None):
+        self.key = key
+        self.name = name or key
+        self.prompt = prompt or key
+        self.prompt_file = prompt_file
+        self.token_secret = token_secret
+        self.page_id_secret = page_id_secret
+        self._page_id = page_id
+        self._secrets = {}
+        self.tags = list(tags or [])
+        self._system_prompt = None
+
+    @property
+    def system_prompt(self) -> str:
+        if self._system_prompt is None:
+            if self.prompt_file:
+                self._system_prompt = (PROJECT_ROOT / self.prompt_file).read_text(encoding="utf-8")
+            else:
+                self._system_prompt = PROMPTS.get(self.prompt, ARTICLE_SYSTEM_PROMPT)
+        return self._system_prompt
+
+    def _cached_secret(self, name: str):
+        """快取 SECRET_TTL_SECONDS 秒；尚未設定時每次重讀，補上 secrets 後立即生效"""
+        value, read_at = self._secrets.get(name, (None, 0.0))
+        if not value or time.monotonic() - read_at > SECRET_TTL_SECONDS:
+            value = _secret(name)
+            self._secrets[name] = (value, time.monotonic())
+        return value
+
+    def refresh(self):
+        """丟掉快取的 Token / 粉專 ID，下次使用時重讀（Token 被判定失效、重新驗證時呼叫）"""
+        self._secrets = {}
+
+    @property
+    def page_id(self):
+        return self._page_id or self._cached_secret(self.page_id_secret)
+
+    @property
+    def token(self):
+        return self._cached_secret(self.token_secret)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.token) and bool(self.page_id)
+
+    def credentials(self) -> tuple[str, str]:
+        """回傳 (token, page_id)；缺少設定時拋出 ValueError"""
+        token, page_id = self.token, self.page_id
+        if not token or not page_id:
+            raise ValueError(
+                f"缺少 {self.name} 的 Facebook 設定！請在 secrets.toml 設定對應的 Token 和 Page ID"
+            )
+        return token, page_id
+
+
+class BrandRegistry:
+    def __init__(self, config: dict):
+        self._brands = {key: Brand(key, **value) for key, value in config.items()}
+        if DEFAULT_BRAND not in self._brands:
+            raise ValueError(f"品牌設定缺少 '{DEFAULT_BRAND}'")
+
+    @classmethod
+    def load(cls, path: Path = BRANDS_CONFIG) -> "BrandRegistry":
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                return cls(json.load(f))
+        return cls(DEFAULT_BRANDS)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._brands
+
+    def get(self, key: str) -> Brand:
+        """找不到時回傳 default 品牌"""
+        return self._brands.get(key) or self._brands[DEFAULT_BRAND]
+
+    def list(self, tag: str = None) -> list[Brand]:
+        return [b for b in self._brands.values() if tag is None or tag in b.tags]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> BrandRegistry:
+    """取得 process 共用的品牌註冊表（第一次呼叫時讀取設定檔）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = BrandRegistry.load()
+    return _registry
+
+
+def get_brand(key: str) -> Brand:
+    return get_registry().get(key)
+
+
+def list_brands(tag: str = None) -> list[Brand]:
+    return get_registry().list(tag)
+
+
+def resolve_brands(specs: list[str]) -> list[str]:
+    """把 "tag:長照" 展開成有該標籤的所有品牌 key，其他項目原樣保留（保留順序並去除重複）"""
+    keys = []
+    for spec in specs:
+        if spec.startswith("tag:"):
+            tagged = [b.key for b in list_brands(spec[4:])]
+            if not tagged:
+                raise ValueError(f"沒有標籤為「{spec[4:]}」的品牌")
+            keys.extend(tagged)
+        else:
+            keys.append(spec)
+    return list(dict.fromkeys(keys))
@@ -0,0 +1,139 @@
+"""Gemini context caching — 把固定的 system prompt 存成 cachedContents，請求只帶 cache 名稱"""
+
+import hashlib
+import threading
+import time
+
+from services.http_client import get_session
+from services.metrics import observe_response, track
+
+
+# cachedContents 存活時間，以及剩多久到期時就先延長
+DEFAULT_TTL_SECONDS = 3600
+REFRESH_MARGIN_SECONDS = 300
+
+# 建立失敗（例如 prompt 未達最低 token 數）後，多久內不再嘗試
+FAILURE_COOLDOWN_SECONDS = 1800
+
+# 建立 / 延長 cache 的單次請求上限；在使用者的請求中進行時最多只花步驟剩餘時間的 REQUEST_SHARE，
+# 分到的時間不到 MIN_REQUEST_SECONDS 就不建立，直接走 inline systemInstruction
+REQUEST_TIMEOUT_SECONDS = 10
+REQUEST_SHARE = 0.2
+MIN_REQUEST_SECONDS = 1.0
+
+
+class _Entry:
+    def __init__(self, name: str = None, expires_at: float = 0.0, failed_at: float = None):
+        self.name = name
+        self.expires_at = expires_at
+        self.failed_at = failed_at
+
+
+class ContextCacheManager:
+    """
+    以 (model, system instruction) 為單位管理 cachedContents。
+    get() 回傳可放進 generateContent 的 cache 名稱；無法使用快取時回傳 None，
+    呼叫端改用 inline systemInstruction。
+
+    同一組 (model, system instruction) 同時只有一個 thread 建立 / 延長，其他請求不等它：
+    舊的 cache 還沒過期就照用，否則直接走 inline。鎖只保護 _entries，網路請求期間不持有。
+    """
+
+    def __init__(self, base_url: str, api_key: str, ttl: int = DEFAULT_TTL_SECONDS,
+                 refresh_margin: int = REFRESH_MARGIN_SECONDS, failure_cooldown: int = FAILURE_COOLDOWN_SECONDS):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.failure_cooldown = failure_cooldown
+        self._entries: dict[str, _Entry] = {}
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model: str, system_instruction: str) -> str:
+        return hashlib.sha256(f"{model}\n{system_instruction}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, system_instruction: str, deadline=None):
+        """
+        取得 cache 名稱；即將到期時先延長 TTL，延長失敗就重新建立。
+        deadline 為呼叫端步驟的期限（services.deadlines.Deadline），建立 / 延長最多只花其中一小部分。
+        """
+        if not self.api_key:
+            return None
+        key = self._key(model, system_instruction)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.failed_at is not None:
+                if now - entry.failed_at < self.failure_cooldown:
+                    return None
+                entry = None
+            if entry is not None and entry.expires_at - now > self.refresh_margin:
+                return entry.name
+            usable = entry.name if entry is not None and entry.expires_at > now else None
+            timeout = self._request_timeout(deadline)
+            if key in self._pending or timeout is None:
+                # 別的 thread 正在建立 / 延長，或這次請求沒有餘裕等
+                return usable
+            self._pending.add(key)
+
+        try:
+            if usable and self._extend(entry, timeout):
+                return usable
+            try:
+                created = self._create(model, system_instruction, key, timeout)
+            except Exception:
+                # 失敗已記在 metrics（create_context_cache / error），改用 inline prompt
+                with self._lock:
+                    self._entries[key] = _Entry(failed_at=now)
+                return None
+            with self._lock:
+                self._entries[key] = created
+            return created.name
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    @staticmethod
+    def _request_timeout(deadline):
+        """建立 / 延長請求可用的秒數；None 表示剩餘時間不夠，不要在這次請求中建立"""
+        if deadline is None:
+            return REQUEST_TIMEOUT_SECONDS
+        timeout = min(REQUEST_TIMEOUT_SECONDS, deadline.remaining() * REQUEST_SHARE)
+        return timeout if timeout >= MIN_REQUEST_SECONDS else None
+
+    def invalidate(self, name: str):
+        """伺服器回報 cache 不存在 / 已過期時呼叫，下次 get() 會重新建立"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.name == name:
+                    del self._entries[key]
+
+    def _create(self, model: str, system_instruction: str, key: str, timeout: float) -> _Entry:
+        url = f"{self.base_url}/cachedContents?key={self.api_key}"
+        payload = {
+            "model": f"models/{model}",
+            "displayName": f"system-{key[:16]}",
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "ttl": f"{self.ttl}s",
+        }
+        with track("gemini", "create_context_cache", model=model) as rec:
+            # 不重試：失敗時這次請求改走 inline prompt 即可
+            resp = get_session("gemini_cache").post(url, json=payload, timeout=timeout)
+            observe_response(rec, resp)
+            resp.raise_for_status()
+            return _Entry(resp.json()["name"], time.time() + self.ttl)
+
+    def _extend(self, entry: _Entry, timeout: float) -> bool:
+        url = f"{self.base_url}/{entry.name}?updateMask=ttl&key={self.api_key}"
+        try:
+            with track("gemini", "extend_context_cache") as rec:
+                resp = get_session("gemini_cache").patch(url, json={"ttl": f"{self.ttl}s"}, timeout=timeout)
+                observe_response(rec, resp)
+                resp.raise_for_status()
+        except Exception:
+            return False
+        with self._lock:
+            entry.expires_at = time.time() + self.ttl
+        return True
@@ -0,0 +1,136 @@
+"""時間預算 — 每個流程步驟（含重試、配額等待、串流讀取）最多可花的秒數
+
+預設值見 DEFAULT_BUDGETS，可用 deadlines.json（或 DEADLINES_CONFIG 指定的 JSON 檔）覆寫：
+    {"article": 45, "image": 90}
+
+    deadline = deadline_for("generate_image")
+    resp = session.post(url, json=payload, timeout=deadline.timeout())
+    deadline.check()        # 超過預算（或已 cancel()）時拋出 DeadlineExceeded
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+DEADLINES_CONFIG = Path(os.getenv("DEADLINES_CONFIG", Path(__file__).parent.parent / "deadlines.json"))
+
+# 各步驟的時間預算（秒）
+DEFAULT_BUDGETS = {
+    "article": 90,
+    "image_prompts": 60,
+    "image": 120,
+    "default": 60,
+}
+
+# metrics operation → 步驟
+OPERATION_STEPS = {
+    "generate_article": "article",
+    "generate_article_stream": "article",
+    "generate_image_prompts": "image_prompts",
+    "generate_image_prompts_stream": "image_prompts",
+    "generate_image": "image",
+}
+
+# 剩餘時間再少也至少給單次請求這麼多秒，避免 timeout=0 被 requests 視為不限時
+MIN_TIMEOUT = 0.5
+
+
+def load_budgets(path: Path = DEADLINES_CONFIG) -> dict:
+    budgets = dict(DEFAULT_BUDGETS)
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            budgets.update(json.load(f))
+    return budgets
+
+
+_budgets = None
+
+
+def get_budgets() -> dict:
+    global _budgets
+    if _budgets is None:
+        _budgets = load_budgets()
+    return _budgets
+
+
+class DeadlineExceeded(TimeoutError):
+    """步驟超過時間預算"""
+
+
+class Deadline:
+    """從建立時開始倒數的期限；cancel() 後視同到期（slice / child 出去的期限一併取消）"""
+
+    def __init__(self, seconds: float, step: str = "default"):
+        self.seconds = seconds
+        self.step = step
+        self.expires_at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+        self._children = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.cancelled:
+            raise DeadlineExceeded(f"{self.step} 已取消")
+        if self.expired:
+            raise DeadlineExceeded(f"{self.step} 超過時間預算 {self.seconds:g} 秒")
+
+    def cancel(self):
+        """放棄這次嘗試：進行中的等待立即結束，之後的 check() / timeout() 直接拋出"""
+        self._cancelled.set()
+        with self._lock:
+            children, self._children = self._children, []
+        for child in children:
+            child.cancel()
+
+    def _adopt(self, child: "Deadline") -> "Deadline":
+        with self._lock:
+            self._children.append(child)
+        if self.cancelled:
+            child.cancel()
+        return child
+
+    def slice(self, share: float) -> "Deadline":
+        """取剩餘時間的一部分給單次嘗試（例如備援鏈中不是最後一個的模型）"""
+        return self._adopt(Deadline(self.remaining() * share, self.step))
+
+    def child(self) -> "Deadline":
+        """期限相同、可單獨取消的副本（例如對沖的每一份請求）"""
+        child = Deadline(self.seconds, self.step)
+        child.expires_at = self.expires_at
+        return self._adopt(child)
+
+    def sleep(self, seconds: float):
+        """最多等 seconds 秒（不超過剩餘時間）；期間被取消或到期時拋出 DeadlineExceeded"""
+        self._cancelled.wait(min(seconds, self.remaining()))
+        self.check()
+
+    def timeout(self, cap: float = None) -> float:
+        """給單次請求的 timeout：剩餘時間（可再加上限）；已超過預算時直接拋出"""
+        self.check()
+        remaining = self.remaining() if cap is None else min(cap, self.remaining())
+        return max(MIN_TIMEOUT, remaining)
+
+
+def deadline_for(operation: str, seconds: float = None) -> Deadline:
+    """依 operation 所屬步驟建立 Deadline；seconds 有值時覆寫設定的預算"""
+    step = OPERATION_STEPS.get(operation, "default")
+    if seconds is None:
+        budgets = get_budgets()
+        seconds = budgets.get(step, budgets["default"])
+    return Deadline(seconds, step)
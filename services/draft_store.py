@@ -0,0 +1,296 @@
+"""草稿庫 — SQLite 持久化的貼文草稿與各步驟的 checkpoint
+
+UI 每完成一個步驟就把該步驟的結果寫入 checkpoints（草稿 ID × 步驟），重新整理、重新部署或切換品牌後
+可從側欄「📂 草稿」回到任一步驟，不必再呼叫 Gemini。批次 API（batch_jobs.py）的結果也寫在這裡。
+"""
+
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+DRAFTS_DB = DATA_DIR / "drafts.sqlite3"
+
+# 草稿狀態
+QUEUED = "queued"            # 等待送出文章批次
+ARTICLE_RUNNING = "article_running"
+DRAFTED = "drafted"          # 已有文章，等待圖片 Prompt 批次
+PROMPTS_RUNNING = "prompts_running"
+READY = "ready"              # 文章與圖片 Prompt 都已完成，可在 UI 開啟
+FAILED = "failed"
+EDITING = "editing"          # UI 中編輯過
+PUBLISHED = "published"      # 已加入發布佇列
+
+# UI 草稿選單列出的狀態
+OPENABLE = (DRAFTED, READY, EDITING, PUBLISHED)
+
+# 回到某一步需要哪些步驟的 checkpoint（步驟 1 的素材一定有）
+STEP_REQUIRES = {1: (), 2: (2,), 3: (2,), 4: (2, 3, 4), 5: (2,)}
+
+_DRAFT_COLUMNS = (
+    "id", "brand", "raw_material", "article", "image_prompts", "status", "source", "batch_name",
+    "error", "created_at", "updated_at",
+)
+
+_BATCH_COLUMNS = (
+    "name", "kind", "model", "state", "input_file", "output_file", "requests", "polls",
+    "next_poll_at", "error", "created_at", "updated_at",
+)
+
+
+def resumable_steps(checkpoints: dict) -> list[int]:
+    """依已有的 checkpoint 判斷可以回到哪些步驟"""
+    return [step for step, required in STEP_REQUIRES.items() if all(s in checkpoints for s in required)]
+
+
+def _draft(row) -> dict:
+    draft = dict(zip(_DRAFT_COLUMNS, row))
+    draft["image_prompts"] = json.loads(draft["image_prompts"]) if draft["image_prompts"] else []
+    return draft
+
+
+class DraftStore:
+    """
+    以 SQLite 實作的草稿庫。每次操作各自開連線，UI 與批次 CLI 可同時存取。
+    drafts 表一列一篇草稿（ID 沿用批次輸入檔的列 ID）；batches 表記錄送出中的 Gemini 批次工作。
+    """
+
+    def __init__(self, path: Path = DRAFTS_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS drafts (
+                    id TEXT PRIMARY KEY,
+                    brand TEXT NOT NULL,
+                    raw_material TEXT NOT NULL,
+                    article TEXT,
+                    image_prompts TEXT,
+                    status TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    batch_name TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS batches (
+                    name TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    input_file TEXT,
+                    output_file TEXT,
+                    requests INTEGER NOT NULL,
+                    polls INTEGER NOT NULL DEFAULT 0,
+                    next_poll_at REAL NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    draft_id TEXT NOT NULL,
+                    step INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (draft_id, step)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_drafts_status ON drafts(status, brand)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ─── drafts ─── #
+
+    def add(self, draft_id: str, brand: str, raw_material: str, source: str = "batch") -> bool:
+        """新增一篇等待生成的草稿；ID 已存在時不覆寫，回傳 False"""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO drafts (id, brand, raw_material, status, source, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (draft_id, brand, raw_material, QUEUED, source, now, now),
+            )
+            return cur.rowcount > 0
+
+    def create(self, brand: str, raw_material: str, source: str = "ui") -> str:
+        """UI 開始一篇新草稿，回傳草稿 ID"""
+        draft_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO drafts (id, brand, raw_material, status, source, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (draft_id, brand, raw_material, EDITING, source, now, now),
+            )
+        return draft_id
+
+    def get(self, draft_id: str):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_DRAFT_COLUMNS)} FROM drafts WHERE id = ?", (draft_id,)).fetchone()
+        return _draft(row) if row else None
+
+    def list_drafts(self, status=None, brand: str = None, batch_name: str = None, limit: int = None) -> list[dict]:
+        """最近更新的草稿（新到舊）；status 可給單一狀態或多個，limit 為 None 時不限筆數"""
+        where, params = [], []
+        if status:
+            statuses = (status,) if isinstance(status, str) else tuple(status)
+            where.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if brand:
+            where.append("brand = ?")
+            params.append(brand)
+        if batch_name:
+            where.append("batch_name = ?")
+            params.append(batch_name)
+        sql = f"SELECT {', '.join(_DRAFT_COLUMNS)} FROM drafts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._connect() as conn:
+            rows = conn.execute(sql + " ORDER BY updated_at DESC LIMIT ?", (*params, -1 if limit is None else limit)).fetchall()
+        return [_draft(row) for row in rows]
+
+    def mark_running(self, draft_ids: list[str], status: str, batch_name: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE drafts SET status = ?, batch_name = ?, error = NULL, updated_at = ? WHERE id = ?",
+                [(status, batch_name, now, draft_id) for draft_id in draft_ids],
+            )
+
+    def set_article(self, draft_id: str, article: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE drafts SET article = ?, status = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (article, DRAFTED, time.time(), draft_id),
+            )
+
+    def set_image_prompts(self, draft_id: str, prompts: list[dict]):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE drafts SET image_prompts = ?, status = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (json.dumps(prompts, ensure_ascii=False), READY, time.time(), draft_id),
+            )
+
+    def mark_failed(self, draft_id: str, error: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE drafts SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), draft_id),
+            )
+
+    def retry_failed(self) -> int:
+        """失敗的草稿排回對應的階段（已有文章的只重做圖片 Prompt）"""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE drafts SET status = CASE WHEN article IS NULL THEN ? ELSE ? END, error = NULL, updated_at = ?"
+                " WHERE status = ?",
+                (QUEUED, DRAFTED, now, FAILED),
+            )
+            return cur.rowcount
+
+    # ─── checkpoints ─── #
+
+    def checkpoint(self, draft_id: str, step: int, state: dict):
+        """
+        寫入（覆寫）某一步的結果；state 需可 JSON 序列化。
+        同時更新 drafts 上對應的欄位，讓選單與批次流程看到最新內容。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (draft_id, step, state, updated_at) VALUES (?, ?, ?, ?)",
+                (draft_id, step, json.dumps(state, ensure_ascii=False), now),
+            )
+            if step == 1:
+                conn.execute("UPDATE drafts SET raw_material = ? WHERE id = ?", (state["raw_material"], draft_id))
+            elif step == 2:
+                conn.execute("UPDATE drafts SET article = ? WHERE id = ?", (state["edited_article"], draft_id))
+            elif step == 3:
+                conn.execute("UPDATE drafts SET image_prompts = ? WHERE id = ?",
+                             (json.dumps(state["image_prompts"], ensure_ascii=False), draft_id))
+            conn.execute(
+                "UPDATE drafts SET status = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (PUBLISHED if step == 5 else EDITING, now, draft_id),
+            )
+
+    def checkpoints(self, draft_id: str) -> dict:
+        """{步驟: state}；批次生成、尚未在 UI 編輯過的草稿由 drafts 欄位補上步驟 1-3"""
+        draft = self.get(draft_id)
+        if draft is None:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute("SELECT step, state FROM checkpoints WHERE draft_id = ?", (draft_id,)).fetchall()
+        checkpoints = {step: json.loads(state) for step, state in rows}
+        checkpoints.setdefault(1, {"raw_material": draft["raw_material"]})
+        if draft["article"]:
+            checkpoints.setdefault(2, {"generated_article": draft["article"], "edited_article": draft["article"]})
+        if draft["image_prompts"]:
+            checkpoints.setdefault(3, {"image_prompts": draft["image_prompts"]})
+        return checkpoints
+
+    # ─── batches ─── #
+
+    def add_batch(self, name: str, kind: str, model: str, state: str, input_file: str, requests: int,
+                  next_poll_at: float):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO batches (name, kind, model, state, input_file, requests, next_poll_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, kind, model, state, input_file, requests, next_poll_at, now, now),
+            )
+
+    def get_batch(self, name: str):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_BATCH_COLUMNS)} FROM batches WHERE name = ?", (name,)).fetchone()
+        return dict(zip(_BATCH_COLUMNS, row)) if row else None
+
+    def list_batches(self, states: tuple = None) -> list[dict]:
+        sql = f"SELECT {', '.join(_BATCH_COLUMNS)} FROM batches"
+        params = ()
+        if states:
+            sql += f" WHERE state IN ({', '.join('?' * len(states))})"
+            params = tuple(states)
+        with self._connect() as conn:
+            rows = conn.execute(sql + " ORDER BY created_at", params).fetchall()
+        return [dict(zip(_BATCH_COLUMNS, row)) for row in rows]
+
+    def update_batch(self, name: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE batches SET {assignments} WHERE name = ?", (*fields.values(), name))
+
+
+_store = None
+
+
+def get_draft_store() -> DraftStore:
+    """取得 process 共用的草稿庫實例"""
+    global _store
+    if _store is None:
+        _store = DraftStore()
+    return _store
@@ -1,115 +1,263 @@
 """Facebook Graph API 封裝 — 發布貼文"""
 
+import asyncio
 import os
+import httpx
 import requests
 from pathlib import Path
 from dotenv import load_dotenv
+from urllib3.exceptions import NewConnectionError
 
 load_dotenv(override=True)
 
 FB_API_VERSION = "v21.0"
 
-FB_GRAPH_URL = f"https://graph.facebook.com/{FB_API_VERSION}"
+# 可用 FB_GRAPH_URL 指向本機替身伺服器（benchmark / 測試用）
+FB_GRAPH_URL = os.getenv("FB_GRAPH_URL", f"https://graph.facebook.com/{FB_API_VERSION}")
 
 
 
-import streamlit as st
+from services.brands import get_brand
+
 
 def _get_config(brand: str = "default"):
-    """取得 Facebook 設定 (根據品牌)"""
-    if brand == "houjiazai":
-        token = st.secrets.get("FB_PAGE_ACCESS_TOKEN_HOUJIAZAI")
-        page_id = st.secrets.get("FB_PAGE_ID_HOUJIAZAI")
-        brand_name = "厚家載藥師"
-    else:
-        token = st.secrets.get("FB_PAGE_ACCESS_TOKEN")
-        page_id = st.secrets.get("FB_PAGE_ID")
-        brand_name = "永芯長照"
-
-    if not token or not page_id:
-        raise ValueError(
-            f"缺少 {brand_name} 的 Facebook 設定！請在 secrets.toml 設定對應的 Token 和 Page ID"
-        )
-    print(f"Debug: Loaded config for brand='{brand}'. Page ID: {page_id}")
-    return token, page_id
-
-
-
-def _raise_with_details(resp):
-    """解析 FB API 錯誤並拋出有意義的訊息"""
+    """取得 Facebook 設定 (根據品牌註冊表)，回傳 (token, page_id)"""
+    return get_brand(brand).credentials()
+
+
+
+# Graph API 暫時性錯誤碼（服務異常 / 各種頻率限制），稍後重送即可
+TRANSIENT_ERROR_CODES = {1, 2, 4, 17, 32, 341, 613}
+
+# Token 失效 / 過期 / 權限被撤銷（OAuthException），收到時標記該品牌 Token 失效
+TOKEN_ERROR_CODES = {102, 190}
+
+# 其中屬於頻率限制的錯誤碼（App / 使用者 / 粉專 / 自訂），收到時對該粉專的 bucket 降速
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613}
+
+
+class FacebookAPIError(RuntimeError):
+    """
+    Facebook 發文失敗。
+    transient=True 表示稍後重試可能成功（網路錯誤、限流、5xx）；
+    uncertain=True 表示請求已送出卻沒有明確結果（讀取逾時、5xx），貼文可能已經建立，不可直接重送。
+    """
+
+    def __init__(self, message: str, code=None, transient: bool = False, uncertain: bool = False):
+        super().__init__(message)
+        self.code = code
+        self.transient = transient
+        self.uncertain = uncertain
+
+    @property
+    def retryable(self) -> bool:
+        """確定沒有發布出去、可以自動重送"""
+        return self.transient and not self.uncertain
+
+
+def _raise_with_details(resp, brand: str = None):
+    """解析 FB API 錯誤並拋出有意義的訊息；Token 失效時同步更新 Token 健康狀態快取"""
     try:
         err = resp.json().get("error", {})
         msg = err.get("message", resp.text)
         code = err.get("code", resp.status_code)
-        raise RuntimeError(f"Facebook API 錯誤 ({code}): {msg}")
-    except (ValueError, KeyError):
-        resp.raise_for_status()
-
-
-
-# 設定 Retry 機制
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-def _get_session():
-    session = requests.Session()
-    retry = Retry(
-        total=3,
-        read=3,
-        connect=3,
-        backoff_factor=1,
-        status_forcelist=[500, 502, 503, 504],
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
+    except (ValueError, KeyError, AttributeError):
+        # 非 JSON 的錯誤頁（例如 proxy 的 502）
+        err, msg, code = {}, resp.text[:200], resp.status_code
+    # 限流是 Facebook 明確拒絕了這次請求；其他暫時性錯誤（服務異常、5xx）可能已經處理完才出錯
+    rate_limited = resp.status_code == 429 or code in RATE_LIMIT_ERROR_CODES
+    transient = rate_limited or code in TRANSIENT_ERROR_CODES or resp.status_code >= 500 or bool(err.get("is_transient"))
+    if brand is not None and code in TOKEN_ERROR_CODES:
+        from services.token_health import get_token_monitor
+        get_token_monitor().mark_invalid(brand, msg)
+    raise FacebookAPIError(f"Facebook API 錯誤 ({code}): {msg}", code=code, transient=transient,
+                           uncertain=transient and not rate_limited)
+
+
+def _never_sent(exc: Exception) -> bool:
+    """連線建立失敗（DNS、拒絕連線、連線逾時）代表請求沒有送到 Facebook"""
+    if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, requests.exceptions.ConnectTimeout)):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        return isinstance(getattr(exc.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def _network_error(message: str, exc: Exception) -> FacebookAPIError:
+    """網路錯誤：請求確定沒送出時可重送，已送出後才逾時 / 斷線則結果不明"""
+    return FacebookAPIError(f"{message}\n錯誤詳情: {exc}", transient=True, uncertain=not _never_sent(exc))
+
+
+
+def ensure_publishable(brand: str):
+    """發布前確認 Token 健康狀態（見 services/token_health.py）"""
+    from services.token_health import ensure_publishable as _ensure
+    _ensure(brand)
+
+
+# 共用連線池（keep-alive + 重試；429 的重送會先重新取得該粉專的額度）
+from services.http_client import arequest, request
+from services.image_encoding import encode_for_facebook
+from services.metrics import observe_response, track
+from services.rate_limiter import aacquire_page, acquire_page, get_quota_manager, observe_throttle, page_bucket
+
+
+def _observe_page_throttle(resp, page_id: str):
+    """HTTP 429 或 Graph API 限流錯誤碼（多半以 400/403 回傳）都讓該粉專降速"""
+    bucket = page_bucket(page_id)
+    if observe_throttle(resp, bucket) or resp.status_code < 400:
+        return
+    try:
+        code = resp.json().get("error", {}).get("code")
+    except (ValueError, AttributeError):
+        return
+    if code in RATE_LIMIT_ERROR_CODES:
+        get_quota_manager().penalize(bucket)
+
+def _check_image(image):
+    """ImageArtifact 直接使用；路徑則確認檔案存在"""
+    if hasattr(image, "data"):
+        return image
+    image_file = Path(image)
+    if not image_file.exists():
+        raise FileNotFoundError(f"圖片檔案不存在：{image}")
+    return image_file
+
 
 def post_text_only(message: str, brand: str = "default") -> dict:
     """發布純文字貼文。"""
     token, page_id = _get_config(brand)
+    ensure_publishable(brand)
     url = f"{FB_GRAPH_URL}/{page_id}/feed"
     payload = {
         "message": message,
         "access_token": token,
     }
-    
-    session = _get_session()
-    try:
-        resp = session.post(url, data=payload, timeout=60)
-        if not resp.ok:
-            _raise_with_details(resp)
-        return resp.json()
-    except requests.exceptions.RequestException as e:
-         raise RuntimeError(f"網路連線失敗，請檢查您的網路狀態。\n錯誤詳情: {e}")
 
+    with track("facebook", "post_text_only", brand=brand) as rec:
+        acquire_page(page_id, rec)
+        try:
+            resp = request("facebook", "POST", url, data=payload, timeout=60, buckets=(page_bucket(page_id),))
+            observe_response(rec, resp)
+            _observe_page_throttle(resp, page_id)
+            if not resp.ok:
+                _raise_with_details(resp, brand)
+            return resp.json()
+        except requests.exceptions.RequestException as e:
+            raise _network_error("網路連線失敗，請檢查您的網路狀態。", e)
 
-def post_with_image(message: str, image_path: str, brand: str = "default") -> dict:
-    """發布含圖片的貼文。"""
-    token, page_id = _get_config(brand)
-    image_file = Path(image_path)
 
-    if not image_file.exists():
-        raise FileNotFoundError(f"圖片檔案不存在：{image_path}")
+def post_with_image(message: str, image, brand: str = "default") -> dict:
+    """發布含圖片的貼文。image 可以是檔案路徑或記憶體中的 ImageArtifact。"""
+    token, page_id = _get_config(brand)
+    image = _check_image(image)
+    # Token 已失效時在壓縮、上傳圖片之前就失敗
+    ensure_publishable(brand)
 
     upload_url = f"{FB_GRAPH_URL}/{page_id}/photos"
     
-    session = _get_session()
+    # 上傳前縮成 Facebook 動態用的 JPEG，減少上傳量
+    image_bytes, mime, name = encode_for_facebook(image)
+
     # 圖片上傳通常需要較長時間，設定 120 秒 timeout
-    try:
-        with open(image_file, "rb") as f:
-            files = {"source": (image_file.name, f, "image/png")}
+    with track("facebook", "post_with_image", brand=brand) as rec:
+        acquire_page(page_id, rec)
+        try:
+            files = {"source": (name, image_bytes, mime)}
             data = {
                 "message": message,
                 "access_token": token,
             }
-            resp = session.post(upload_url, data=data, files=files, timeout=120)
+            resp = request("facebook", "POST", upload_url, data=data, files=files, timeout=120,
+                           buckets=(page_bucket(page_id),))
+            observe_response(rec, resp)
+            _observe_page_throttle(resp, page_id)
 
-        if not resp.ok:
-            _raise_with_details(resp)
+            if not resp.ok:
+                _raise_with_details(resp, brand)
+            return resp.json()
+        except requests.exceptions.RequestException as e:
+            raise _network_error("網路連線失敗 (Timeline Timeout)，請檢查您的網路狀態或 VPN。", e)
+
+
+async def apost_text_only(message: str, brand: str = "default", timeout: float = 60) -> dict:
+    """post_text_only 的非同步版本。"""
+    token, page_id = _get_config(brand)
+    await asyncio.to_thread(ensure_publishable, brand)
+    url = f"{FB_GRAPH_URL}/{page_id}/feed"
+    payload = {
+        "message": message,
+        "access_token": token,
+    }
+
+    with track("facebook", "post_text_only", brand=brand) as rec:
+        await aacquire_page(page_id, rec)
+        try:
+            resp = await arequest("facebook", "POST", url, data=payload, timeout=timeout,
+                                  buckets=(page_bucket(page_id),))
+        except httpx.HTTPError as e:
+            raise _network_error("網路連線失敗，請檢查您的網路狀態。", e)
+        observe_response(rec, resp)
+        _observe_page_throttle(resp, page_id)
+        if not resp.is_success:
+            _raise_with_details(resp, brand)
+        return resp.json()
+
+
+async def apost_with_image(message: str, image, brand: str = "default", timeout: float = 120) -> dict:
+    """post_with_image 的非同步版本；讀檔與壓縮在 thread 中執行。"""
+    token, page_id = _get_config(brand)
+    image = _check_image(image)
+    await asyncio.to_thread(ensure_publishable, brand)
+
+    upload_url = f"{FB_GRAPH_URL}/{page_id}/photos"
+    image_bytes, mime, name = await asyncio.to_thread(encode_for_facebook, image)
+    files = {"source": (name, image_bytes, mime)}
+    data = {
+        "message": message,
+        "access_token": token,
+    }
+
+    with track("facebook", "post_with_image", brand=brand) as rec:
+        await aacquire_page(page_id, rec)
+        try:
+            resp = await arequest("facebook", "POST", upload_url, data=data, files=files, timeout=timeout,
+                                  buckets=(page_bucket(page_id),))
+        except httpx.HTTPError as e:
+            raise _network_error("網路連線失敗 (Timeline Timeout)，請檢查您的網路狀態或 VPN。", e)
+        observe_response(rec, resp)
+        _observe_page_throttle(resp, page_id)
+        if not resp.is_success:
+            _raise_with_details(resp, brand)
         return resp.json()
-    except requests.exceptions.RequestException as e:
-         raise RuntimeError(f"網路連線失敗 (Timeline Timeout)，請檢查您的網路狀態或 VPN。\n錯誤詳情: {e}")
+
+
+def find_published_post(message: str, brand: str = "default", since: float = None):
+    """
+    在粉專最近的貼文中找內容相同的一篇，用來確認結果不明的發布是否其實已經成功。
+    Returns: post ID，找不到時為 None
+    """
+    token, page_id = _get_config(brand)
+    url = f"{FB_GRAPH_URL}/{page_id}/posts"
+    params = {
+        "fields": "id,message,created_time",
+        "limit": 100,
+        "access_token": token,
+    }
+    if since is not None:
+        params["since"] = int(since)
+    with track("facebook", "find_published_post", brand=brand) as rec:
+        acquire_page(page_id, rec)
+        resp = request("facebook", "GET", url, params=params, timeout=10, buckets=(page_bucket(page_id),))
+        observe_response(rec, resp)
+        _observe_page_throttle(resp, page_id)
+        if not resp.ok:
+            _raise_with_details(resp, brand)
+    target = message.strip()
+    for post in resp.json().get("data", []):
+        if (post.get("message") or "").strip() == target:
+            return post["id"]
+    return None
 
 
 def verify_token(brand: str = "default") -> dict:
@@ -123,7 +271,50 @@ def verify_token(brand: str = "default") -> dict:
         "fields": "name,id",
         "access_token": token,
     }
-    resp = requests.get(url, params=params, timeout=10)
-    resp.raise_for_status()
-    return resp.json()
+    with track("facebook", "verify_token", brand=brand) as rec:
+        acquire_page(page_id, rec)
+        resp = request("facebook", "GET", url, params=params, timeout=10, buckets=(page_bucket(page_id),))
+        observe_response(rec, resp)
+        _observe_page_throttle(resp, page_id)
+        if not resp.ok:
+            _raise_with_details(resp, brand)
+        return resp.json()
+
 
+def debug_token(brand: str = "default") -> dict:
+    """
+    以 /debug_token 檢查 Page Access Token 本身。
+    Returns: data 欄位（is_valid、expires_at（0 表示不會過期）、scopes 等）
+    """
+    token, page_id = _get_config(brand)
+    url = f"{FB_GRAPH_URL}/debug_token"
+    params = {
+        "input_token": token,
+        "access_token": token,
+    }
+    with track("facebook", "debug_token", brand=brand) as rec:
+        acquire_page(page_id, rec)
+        resp = request("facebook", "GET", url, params=params, timeout=10, buckets=(page_bucket(page_id),))
+        observe_response(rec, resp)
+        _observe_page_throttle(resp, page_id)
+        if not resp.ok:
+            _raise_with_details(resp, brand)
+        return resp.json().get("data", {})
+
+
+async def averify_token(brand: str = "default", timeout: float = 10) -> dict:
+    """verify_token 的非同步版本。"""
+    token, page_id = _get_config(brand)
+    url = f"{FB_GRAPH_URL}/{page_id}"
+    params = {
+        "fields": "name,id",
+        "access_token": token,
+    }
+    with track("facebook", "verify_token", brand=brand) as rec:
+        await aacquire_page(page_id, rec)
+        resp = await arequest("facebook", "GET", url, params=params, timeout=timeout, buckets=(page_bucket(page_id),))
+        observe_response(rec, resp)
+        _observe_page_throttle(resp, page_id)
+        if not resp.is_success:
+            _raise_with_details(resp, brand)
+        return resp.json()
@@ -0,0 +1,137 @@
+"""多粉專同步發布 — 同一篇貼文（可選依品牌改寫）同時發到多個粉專
+
+    result = fanout_publish(article, ["default", "houjiazai"], image=artifact, rewrite=True, source_brand="default")
+    result["elapsed"]             # 總耗時（各粉專並行，約等於最慢的一個）
+    result["results"]             # 每個粉專一筆：brand / page_id / ok / post_id / message / error / latency
+
+rewrite=True 時，source_brand 以外的品牌會先以該品牌的 system prompt 呼叫 generate_article 改寫，
+改寫與上傳在同一個 worker 中接續執行，不同粉專之間互不等待。
+呼叫端已經自己改寫好（例如要在自己的併發上限下呼叫 Gemini）時，以 messages={品牌: 內文} 傳入，這些品牌不再改寫。
+on_result(result) 在每個粉專完成時呼叫（於 worker thread），可用來逐一寫入 checkpoint。
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.brands import get_registry
+from services.facebook_service import apost_text_only, apost_with_image, post_text_only, post_with_image
+from services.gemini_service import agenerate_article, generate_article
+from services.image_encoding import encode_for_facebook
+from services.image_store import ImageArtifact
+
+
+def _validate(brands: list[str]) -> list[str]:
+    registry = get_registry()
+    unknown = [b for b in brands if b not in registry]
+    if unknown:
+        raise ValueError(f"未知的品牌：{', '.join(unknown)}")
+    # 保留順序並去除重複
+    return list(dict.fromkeys(brands))
+
+
+def _prepare_image(image):
+    """只壓縮一次；之後每個粉專上傳時 encode_for_facebook 會直接沿用這份 JPEG"""
+    if image is None:
+        return None
+    data, mime, _ = encode_for_facebook(image)
+    return ImageArtifact(data, mime, getattr(image, "prompt", ""))
+
+
+def _new_result(brand: str) -> dict:
+    return {
+        "brand": brand,
+        "page_id": None,
+        "ok": False,
+        "post_id": None,
+        "message": None,
+        "error": None,
+        "latency": None,
+        # 請求已送出卻沒有明確結果（見 FacebookAPIError.uncertain），貼文可能已經發布
+        "uncertain": False,
+    }
+
+
+def _publish_one(message: str, brand: str, image, rewrite: bool) -> dict:
+    result = _new_result(brand)
+    t0 = time.perf_counter()
+    try:
+        result["page_id"] = get_registry().get(brand).page_id
+        if rewrite:
+            message = generate_article(message, brand=brand)
+        result["message"] = message
+        post = post_with_image(message, image, brand=brand) if image is not None else post_text_only(message, brand=brand)
+        result["post_id"] = post.get("post_id", post.get("id"))
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+        result["uncertain"] = getattr(e, "uncertain", False)
+    result["latency"] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+def fanout_publish(message: str, brands: list[str], image=None, rewrite: bool = False,
+                   source_brand: str = None, messages: dict = None, on_result=None) -> dict:
+    """
+    同時發布到多個品牌的粉專。單一粉專失敗不影響其他粉專，結果逐一回報。
+    image 可以是檔案路徑或 ImageArtifact；None 時發純文字貼文。
+    """
+    brands = _validate(brands)
+    messages = messages or {}
+    started = time.perf_counter()
+    image = _prepare_image(image)
+
+    def publish(brand: str) -> dict:
+        result = _publish_one(messages.get(brand, message), brand, image,
+                              rewrite and brand != source_brand and brand not in messages)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, len(brands)), thread_name_prefix="fanout") as pool:
+        futures = [pool.submit(publish, brand) for brand in brands]
+        results = [f.result() for f in futures]
+
+    return {"results": results, "elapsed": round(time.perf_counter() - started, 3)}
+
+
+async def _apublish_one(message: str, brand: str, image, rewrite: bool) -> dict:
+    result = _new_result(brand)
+    t0 = time.perf_counter()
+    try:
+        result["page_id"] = get_registry().get(brand).page_id
+        if rewrite:
+            message = await agenerate_article(message, brand=brand)
+        result["message"] = message
+        if image is not None:
+            post = await apost_with_image(message, image, brand=brand)
+        else:
+            post = await apost_text_only(message, brand=brand)
+        result["post_id"] = post.get("post_id", post.get("id"))
+        result["ok"] = True
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        result["error"] = str(e)
+        result["uncertain"] = getattr(e, "uncertain", False)
+    result["latency"] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+async def afanout_publish(message: str, brands: list[str], image=None, rewrite: bool = False,
+                          source_brand: str = None, messages: dict = None, on_result=None) -> dict:
+    """fanout_publish 的非同步版本；on_result 在 event loop 上呼叫"""
+    brands = _validate(brands)
+    messages = messages or {}
+    started = time.perf_counter()
+    image = await asyncio.to_thread(_prepare_image, image)
+
+    async def publish(brand: str) -> dict:
+        result = await _apublish_one(messages.get(brand, message), brand, image,
+                                     rewrite and brand != source_brand and brand not in messages)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    results = await asyncio.gather(*(publish(brand) for brand in brands))
+    return {"results": list(results), "elapsed": round(time.perf_counter() - started, 3)}
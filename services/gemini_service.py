@@ -1,74 +1,324 @@
 """Gemini API 封裝 — 純 REST API，不依賴任何 Google SDK"""
 
+import asyncio
 import json
 import os
 import io
-import re
 import base64
-import requests as req
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from PIL import Image
+import httpx
+import requests
 from dotenv import load_dotenv
 
 
 import streamlit as st
-from prompts.article_prompt import get_system_prompt, get_article_prompt
-from prompts.image_prompt import IMAGE_PROMPT_SYSTEM_PROMPT, get_image_prompt_request
+from prompts.article_prompt import get_article_prompt
+from prompts.image_prompt import IMAGE_PROMPT_FIELDS, IMAGE_PROMPT_SCHEMA, IMAGE_PROMPT_SYSTEM_PROMPT, get_image_prompt_request
+from services.brands import get_brand
+from services.context_cache import ContextCacheManager
+from services.deadlines import Deadline, DeadlineExceeded, deadline_for
+from services.hedging import Attempt, ahedged_call, hedged_call
+from services.http_client import arequest, request
+from services.asset_store import Asset, get_asset_store
+from services.image_encoding import MIME_EXTENSIONS
+from services.image_store import ImageArtifact
+from services.json_stream import JsonArrayStream
+from services.metrics import add_hook, observe_response, observe_usage, record_cache_hit, track
+from services.model_catalog import ModelCatalog
+from services.model_router import ModelRouter
+from services.rate_limiter import (QuotaExceeded, aacquire_model, acquire_model, estimate_tokens, model_buckets,
+                                   observe_throttle, settle_tokens)
+from services.response_cache import get_cache, make_key
 
 load_dotenv()
 
 # 改用 st.secrets，若沒有則 fallback 到 os.getenv (相容性)
 try:
-    API_KEY = st.secrets.get("GEMINI_API_KEY")
+    API_KEY = st.secrets.get("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY")
 except FileNotFoundError:
     API_KEY = os.getenv("GEMINI_API_KEY")
 
-BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+# 可用 GEMINI_BASE_URL 指向本機替身伺服器（測試用）
+BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+# 圖片的預設模型；實際使用的模型由 ModelRouter 依備援鏈與健康狀態決定
+IMAGE_MODEL = "gemini-3-pro-image-preview"
+
+# 帶 cachedContent 的請求回這些狀態碼，視為 cache 已不存在 / 過期，改用 inline prompt 重送
+CACHE_MISS_STATUS = {400, 403, 404}
+
+# 這些狀態碼代表模型本身有問題（不存在、限流、過載），改用備援鏈的下一個模型
+MODEL_FAILURE_STATUS = {404, 429, 500, 502, 503, 504}
+
+# 備援鏈中不是最後一個的模型，最多只用步驟剩餘時間的這個比例，卡住時還來得及換模型
+FAILOVER_SHARE = 0.5
+
+_context_cache = None
+_model_catalog = None
+_model_router = None
+
+
+def _get_context_cache() -> ContextCacheManager:
+    global _context_cache
+    if _context_cache is None:
+        _context_cache = ContextCacheManager(BASE_URL, API_KEY)
+    return _context_cache
+
+
+def get_model_catalog() -> ModelCatalog:
+    global _model_catalog
+    if _model_catalog is None:
+        _model_catalog = ModelCatalog(BASE_URL, API_KEY)
+    return _model_catalog
+
+
+def get_model_router() -> ModelRouter:
+    """取得 process 共用的模型路由（以 metrics hook 收集各模型的健康狀態）"""
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter(catalog=get_model_catalog())
+        add_hook(_model_router)
+    return _model_router
+
+
+def _is_model_failure(e: Exception) -> bool:
+    """模型本身的問題（含該模型分到的時間用完）才換下一個模型；內容被擋等錯誤直接往上拋"""
+    if isinstance(e, (DeadlineExceeded, QuotaExceeded, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                      requests.exceptions.RetryError, httpx.TransportError, TimeoutError)):
+        return True
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return status in MODEL_FAILURE_STATUS
+
+
+class FallbackChain:
+    """
+    備援策略：依路由順序列出要嘗試的模型與分到的期限。
+    整個步驟共用一個時間預算，不是最後一個的模型只分到剩餘時間的 FAILOVER_SHARE；
+    換下一個模型時取消前一個的期限，還在背景跑的請求（例如對沖的另一份）不會繼續重試。
+
+        chain = FallbackChain("article", "generate_article")
+        for model, deadline in chain:
+            try:
+                return call(model, deadline)
+            except Exception as e:
+                if not chain.should_fall_back(e):
+                    raise
+    """
+
+    def __init__(self, task: str, operation: str, tokens: int = None, timeout: float = None):
+        self.deadline = deadline_for(operation, timeout)
+        self.models = get_model_router().candidates(task, tokens)
+        self._last = False
+
+    def __iter__(self):
+        for i, model in enumerate(self.models):
+            self._last = i == len(self.models) - 1
+            deadline = self.deadline if self._last else self.deadline.slice(FAILOVER_SHARE)
+            try:
+                yield model, deadline
+            finally:
+                if deadline is not self.deadline:
+                    deadline.cancel()
+
+    def should_fall_back(self, e: Exception, started: bool = False) -> bool:
+        """模型本身的問題才換下一個；已輸出過內容（started）、已是最後一個或步驟時間用完時直接拋出"""
+        return not (started or self._last or self.deadline.expired) and _is_model_failure(e)
+
+
+def _with_fallback(task: str, operation: str, call, tokens: int = None, timeout: float = None):
+    """依備援鏈呼叫 call(model, deadline)，模型失敗時換下一個"""
+    chain = FallbackChain(task, operation, tokens, timeout)
+    for model, deadline in chain:
+        try:
+            return call(model, deadline)
+        except Exception as e:
+            if not chain.should_fall_back(e):
+                raise
+
+
+async def _awith_fallback(task: str, operation: str, call, tokens: int = None, timeout: float = None):
+    chain = FallbackChain(task, operation, tokens, timeout)
+    for model, deadline in chain:
+        try:
+            return await call(model, deadline)
+        except Exception as e:
+            if not chain.should_fall_back(e):
+                raise
+
+
+def _stream_with_fallback(task: str, operation: str, stream, tokens: int = None):
+    """
+    串流版：stream(model, deadline, open_deadline)，分到的時間只限制到第一段文字為止；
+    已 yield 過片段就不再換模型，已輸出的內容不會重複。
+    """
+    chain = FallbackChain(task, operation, tokens)
+    for model, open_deadline in chain:
+        started = False
+        try:
+            for chunk in stream(model, chain.deadline, open_deadline):
+                started = True
+                yield chunk
+            return
+        except Exception as e:
+            if not chain.should_fall_back(e, started):
+                raise
+
+
+def _cache_attempts(cached_content: str) -> list:
+    """先試 context cache，失效時再以 inline systemInstruction 重送"""
+    return [cached_content, None] if cached_content else [None]
+
+
+def _call_gemini(model: str, system_instruction: str, user_prompt: str, response_mime_type: str = None, no_cache: bool = False,
+                 operation: str = "generate_text", brand: str = None, response_schema: dict = None,
+                 deadline: Deadline = None) -> str:
+    """
+    呼叫 Gemini REST API 生成文字。
+    相同輸入會先查本機快取；no_cache=True 時略過快取讀取（結果仍會寫回快取）。
+    operation / brand 只用於 metrics 標籤；response_schema 為 Gemini 的結構化輸出 schema。
+    """
+    cache_key = make_key(model, system_instruction, user_prompt, response_mime_type, response_schema)
+    if not no_cache:
+        cached = get_cache().get(cache_key)
+        if cached is not None:
+            record_cache_hit("gemini", operation, model=model, brand=brand)
+            return cached
+
+    with track("gemini", operation, model=model, brand=brand) as rec:
+        text = _request_gemini_text(model, system_instruction, user_prompt, response_mime_type, rec, response_schema,
+                                    deadline)
+    get_cache().set(cache_key, text)
+    return text
+
+
+async def _acall_gemini(model: str, system_instruction: str, user_prompt: str, response_mime_type: str = None,
+                        no_cache: bool = False, timeout: float = None, operation: str = "generate_text", brand: str = None,
+                        response_schema: dict = None, deadline: Deadline = None) -> str:
+    """
+    _call_gemini 的非同步版本；快取讀寫（SQLite）丟到 thread 執行，不阻塞 event loop。
+    timeout 為整個呼叫（含重試、配額等待）的期限，未指定時使用該步驟的時間預算。
+    """
+    cache_key = make_key(model, system_instruction, user_prompt, response_mime_type, response_schema)
+    if not no_cache:
+        cached = await asyncio.to_thread(get_cache().get, cache_key)
+        if cached is not None:
+            record_cache_hit("gemini", operation, model=model, brand=brand)
+            return cached
 
-# 輸出目錄
-OUTPUT_DIR = Path(__file__).parent.parent / "output"
-OUTPUT_DIR.mkdir(exist_ok=True)
-
-
-def _call_gemini(model: str, system_instruction: str, user_prompt: str, response_mime_type: str = None) -> str:
-    """呼叫 Gemini REST API 生成文字"""
     if not API_KEY:
         raise ValueError("缺少 GEMINI_API_KEY！請檢查 secrets.toml 或 .env")
 
+    deadline = deadline or deadline_for(operation, timeout)
     url = f"{BASE_URL}/models/{model}:generateContent?key={API_KEY}"
-
+    cached_content = await asyncio.to_thread(_get_context_cache().get, model, system_instruction, deadline)
+
+    estimated = estimate_tokens(system_instruction, user_prompt)
+    with track("gemini", operation, model=model, brand=brand) as rec:
+        async def attempt(a: Attempt) -> dict:
+            for cache_name in _cache_attempts(cached_content):
+                # 對沖的那份不等配額，沒有額度就放棄
+                await aacquire_model(model, estimated, a.record, max_wait=0 if a.hedge else a.deadline.remaining())
+                payload = _build_text_payload(system_instruction, user_prompt, response_mime_type, cache_name,
+                                              response_schema)
+                resp = await arequest("gemini", "POST", url, json=payload, timeout=a.deadline.timeout(),
+                                      buckets=model_buckets(model))
+                observe_response(a.record, resp)
+                observe_throttle(resp, *model_buckets(model))
+                if cache_name and resp.status_code in CACHE_MISS_STATUS:
+                    _get_context_cache().invalidate(cache_name)
+                    continue
+                break
+            resp.raise_for_status()
+            return resp.json()
+
+        data = await ahedged_call(f"{model}/{operation}", attempt, deadline, record=rec)
+        observe_usage(rec, data)
+        settle_tokens(model, estimated, rec)
+        text = _extract_text(data)
+    await asyncio.to_thread(get_cache().set, cache_key, text)
+    return text
+
+
+def _build_text_payload(system_instruction: str, user_prompt: str, response_mime_type: str = None,
+                        cached_content: str = None, response_schema: dict = None) -> dict:
+    """cached_content 有值時以 context cache 取代 inline systemInstruction"""
     payload = {
-        "systemInstruction": {
-            "parts": [{"text": system_instruction}]
-        },
         "contents": [
             {"role": "user", "parts": [{"text": user_prompt}]}
         ],
     }
+    if cached_content:
+        payload["cachedContent"] = cached_content
+    else:
+        payload["systemInstruction"] = {
+            "parts": [{"text": system_instruction}]
+        }
 
     if response_mime_type:
         payload["generationConfig"] = {
             "responseMimeType": response_mime_type,
         }
+        if response_schema:
+            payload["generationConfig"]["responseSchema"] = response_schema
+    return payload
+
 
-    resp = req.post(url, json=payload, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
+def _check_finish_reason(candidate: dict):
+    """檢查是否因安全理由或其他原因中斷"""
+    finish_reason = candidate.get("finishReason")
+    if finish_reason and finish_reason != "STOP":
+        safety_ratings = candidate.get("safetyRatings", [])
+        raise RuntimeError(f"Gemini 生成中斷，原因: {finish_reason}。安全性評級: {json.dumps(safety_ratings)}")
 
 
-    # 提取文字
+def _request_gemini_text(model: str, system_instruction: str, user_prompt: str, response_mime_type: str,
+                         rec: dict, response_schema: dict = None, deadline: Deadline = None) -> str:
+    """
+    實際送出 generateContent 請求並取出文字；量測結果寫入 rec（metrics 紀錄）。
+    整個呼叫受該步驟的時間預算限制，超過最近 p90 仍未回應時對沖一次。
+    """
+    if not API_KEY:
+        raise ValueError("缺少 GEMINI_API_KEY！請檢查 secrets.toml 或 .env")
+
+    deadline = deadline or deadline_for(rec["operation"])
+    url = f"{BASE_URL}/models/{model}:generateContent?key={API_KEY}"
+    cached_content = _get_context_cache().get(model, system_instruction, deadline)
+
+    estimated = estimate_tokens(system_instruction, user_prompt)
+
+    def attempt(a: Attempt) -> dict:
+        for cache_name in _cache_attempts(cached_content):
+            # 對沖的那份不等配額，沒有額度就放棄；被放棄的那份在下一次等待 / 重試前中止
+            acquire_model(model, estimated, a.record, max_wait=0 if a.hedge else a.deadline.remaining(),
+                          deadline=a.deadline)
+            payload = _build_text_payload(system_instruction, user_prompt, response_mime_type, cache_name, response_schema)
+            resp = request("gemini", "POST", url, json=payload, deadline=a.deadline, buckets=model_buckets(model))
+            observe_response(a.record, resp)
+            observe_throttle(resp, *model_buckets(model))
+            if cache_name and resp.status_code in CACHE_MISS_STATUS:
+                _get_context_cache().invalidate(cache_name)
+                continue
+            break
+        resp.raise_for_status()
+        return resp.json()
+
+    data = hedged_call(f"{model}/{rec['operation']}", attempt, deadline, record=rec)
+    observe_usage(rec, data)
+    settle_tokens(model, estimated, rec)
+    return _extract_text(data)
+
+
+def _extract_text(data: dict) -> str:
+    """從 generateContent 回應提取文字"""
     candidates = data.get("candidates", [])
     if not candidates:
         raise RuntimeError(f"Gemini 沒有回傳候選結果 (Candidates Empty)。Raw Data: {json.dumps(data)}")
 
     candidate = candidates[0]
-    finish_reason = candidate.get("finishReason")
-    
-    # 檢查是否因安全理由被擋
-    if finish_reason and finish_reason != "STOP":
-        safety_ratings = candidate.get("safetyRatings", [])
-        raise RuntimeError(f"Gemini 生成中斷，原因: {finish_reason}。安全性評級: {json.dumps(safety_ratings)}")
+    _check_finish_reason(candidate)
 
     parts = candidate.get("content", {}).get("parts", [])
     if not parts:
@@ -78,45 +328,237 @@ def _call_gemini(model: str, system_instruction: str, user_prompt: str, response
     return "".join(p.get("text", "") for p in parts)
 
 
+def _stream_gemini(model: str, system_instruction: str, user_prompt: str, response_mime_type: str = None, no_cache: bool = False,
+                   operation: str = "generate_text_stream", brand: str = None, response_schema: dict = None,
+                   deadline: Deadline = None, open_deadline: Deadline = None):
+    """
+    以 streamGenerateContent (SSE) 逐段取得文字，yield 每個文字片段。
+    finishReason / 安全性檢查與 _call_gemini 相同；完整結果會寫入快取。
+    open_deadline 只限制到第一段文字為止，之後的讀取受 deadline（整個步驟）限制。
+    """
+    cache_key = make_key(model, system_instruction, user_prompt, response_mime_type, response_schema)
+    if not no_cache:
+        cached = get_cache().get(cache_key)
+        if cached is not None:
+            record_cache_hit("gemini", operation, model=model, brand=brand)
+            yield cached
+            return
+
+    if not API_KEY:
+        raise ValueError("缺少 GEMINI_API_KEY！請檢查 secrets.toml 或 .env")
 
-def generate_article(raw_material: str, brand: str = "default") -> str:
+    deadline = deadline or deadline_for(operation)
+    open_deadline = open_deadline or deadline
+    url = f"{BASE_URL}/models/{model}:streamGenerateContent?alt=sse&key={API_KEY}"
+    cached_content = _get_context_cache().get(model, system_instruction, open_deadline)
+
+    estimated = estimate_tokens(system_instruction, user_prompt)
+    with track("gemini", operation, model=model, brand=brand) as rec:
+        def open_stream(a: Attempt):
+            for cache_name in _cache_attempts(cached_content):
+                # 對沖的那份不等配額，沒有額度就放棄；被放棄的那份在下一次等待 / 重試前中止
+                acquire_model(model, estimated, a.record, max_wait=0 if a.hedge else a.deadline.remaining(),
+                              deadline=a.deadline)
+                payload = _build_text_payload(system_instruction, user_prompt, response_mime_type, cache_name, response_schema)
+                resp = request("gemini", "POST", url, json=payload, stream=True, deadline=a.deadline,
+                               timeout=(a.deadline.timeout(), deadline.timeout()), buckets=model_buckets(model))
+                observe_throttle(resp, *model_buckets(model))
+                if cache_name and resp.status_code in CACHE_MISS_STATUS:
+                    observe_response(a.record, resp)
+                    resp.close()
+                    _get_context_cache().invalidate(cache_name)
+                    continue
+                break
+            return _open_events(resp)
+
+        # 以第一段文字的延遲判斷是否對沖；落敗的串流直接關閉連線
+        resp, lines = hedged_call(f"{model}/{operation}", open_stream, open_deadline,
+                                  on_discard=lambda opened: opened[0].close(), record=rec)
+
+        chunks = []
+        received = 0
+        with resp:
+            for raw_line in lines:
+                deadline.check()
+                received += len(raw_line) + 1
+                line = raw_line.decode("utf-8")
+                if not line.startswith("data:"):
+                    continue
+                data = json.loads(line[len("data:"):])
+                observe_usage(rec, data)
+
+                candidates = data.get("candidates", [])
+                if not candidates:
+                    block_reason = data.get("promptFeedback", {}).get("blockReason")
+                    if block_reason:
+                        raise RuntimeError(f"Gemini 生成中斷，原因: {block_reason}。Raw Data: {json.dumps(data)}")
+                    continue
+
+                candidate = candidates[0]
+                _check_finish_reason(candidate)
+
+                parts = candidate.get("content", {}).get("parts", [])
+                text = "".join(p.get("text", "") for p in parts)
+                if text:
+                    chunks.append(text)
+                    yield text
+        observe_response(rec, resp, received=received)
+        settle_tokens(model, estimated, rec)
+
+        if not chunks:
+            raise RuntimeError("Gemini 回傳了 STOP 但沒有文字內容 (No Content Parts)")
+
+    get_cache().set(cache_key, "".join(chunks))
+
+
+def _open_events(resp):
+    """讀到第一個 SSE data 行為止，回傳 (resp, 所有行的 iterator)"""
+    try:
+        resp.raise_for_status()
+        lines = resp.iter_lines()
+        head = []
+        for raw_line in lines:
+            head.append(raw_line)
+            if raw_line.startswith(b"data:"):
+                break
+        return resp, itertools.chain(head, lines)
+    except BaseException:
+        resp.close()
+        raise
+
+
+
+def generate_article(raw_material: str, brand: str = "default", no_cache: bool = False) -> str:
     """根據原始素材生成衛教貼文。"""
-    system_prompt = get_system_prompt(brand)
-    return _call_gemini(
-        model="gemini-2.5-flash",
+    system_prompt = get_brand(brand).system_prompt
+    user_prompt = get_article_prompt(raw_material)
+    return _with_fallback("article", "generate_article", lambda model, deadline: _call_gemini(
+        model=model,
+        system_instruction=system_prompt,
+        user_prompt=user_prompt,
+        no_cache=no_cache,
+        operation="generate_article",
+        brand=brand,
+        deadline=deadline,
+    ), estimate_tokens(system_prompt, user_prompt))
+
+
+async def agenerate_article(raw_material: str, brand: str = "default", no_cache: bool = False, timeout: float = None) -> str:
+    """generate_article 的非同步版本；timeout 為整個呼叫（含重試）的期限，未指定時使用 article 步驟的時間預算。"""
+    system_prompt = get_brand(brand).system_prompt
+    user_prompt = get_article_prompt(raw_material)
+    return await _awith_fallback("article", "generate_article", lambda model, deadline: _acall_gemini(
+        model=model,
         system_instruction=system_prompt,
-        user_prompt=get_article_prompt(raw_material),
+        user_prompt=user_prompt,
+        no_cache=no_cache,
+        operation="generate_article",
+        brand=brand,
+        deadline=deadline,
+    ), estimate_tokens(system_prompt, user_prompt), timeout)
+
+
+def generate_article_stream(raw_material: str, brand: str = "default", no_cache: bool = False):
+    """generate_article 的串流版本，逐段 yield 文字。"""
+    system_prompt = get_brand(brand).system_prompt
+    user_prompt = get_article_prompt(raw_material)
+    return _stream_with_fallback(
+        "article",
+        "generate_article_stream",
+        lambda model, deadline, open_deadline: _stream_gemini(
+            model=model,
+            system_instruction=system_prompt,
+            user_prompt=user_prompt,
+            no_cache=no_cache,
+            operation="generate_article_stream",
+            brand=brand,
+            deadline=deadline,
+            open_deadline=open_deadline,
+        ),
+        estimate_tokens(system_prompt, user_prompt),
     )
 
 
+def generate_image_prompts(article: str, no_cache: bool = False) -> list[dict]:
+    """根據文章生成 3 組圖片 Prompt（以 responseSchema 強制 JSON 結構）。"""
+    user_prompt = get_image_prompt_request(article)
+    text = _with_fallback("image_prompts", "generate_image_prompts", lambda model, deadline: _call_gemini(
+        model=model,
+        system_instruction=IMAGE_PROMPT_SYSTEM_PROMPT,
+        user_prompt=user_prompt,
+        response_mime_type="application/json",
+        no_cache=no_cache,
+        operation="generate_image_prompts",
+        response_schema=IMAGE_PROMPT_SCHEMA,
+        deadline=deadline,
+    ), estimate_tokens(IMAGE_PROMPT_SYSTEM_PROMPT, user_prompt))
+
+    return _parse_image_prompts(text)
+
 
-def generate_image_prompts(article: str) -> list[dict]:
-    """根據文章生成 3 組圖片 Prompt（JSON 格式）。"""
-    text = _call_gemini(
-        model="gemini-2.5-flash",
+async def agenerate_image_prompts(article: str, no_cache: bool = False, timeout: float = None) -> list[dict]:
+    """generate_image_prompts 的非同步版本。"""
+    user_prompt = get_image_prompt_request(article)
+    text = await _awith_fallback("image_prompts", "generate_image_prompts", lambda model, deadline: _acall_gemini(
+        model=model,
         system_instruction=IMAGE_PROMPT_SYSTEM_PROMPT,
-        user_prompt=get_image_prompt_request(article),
+        user_prompt=user_prompt,
         response_mime_type="application/json",
+        no_cache=no_cache,
+        operation="generate_image_prompts",
+        response_schema=IMAGE_PROMPT_SCHEMA,
+        deadline=deadline,
+    ), estimate_tokens(IMAGE_PROMPT_SYSTEM_PROMPT, user_prompt), timeout)
+
+    return _parse_image_prompts(text)
+
+
+def generate_image_prompts_stream(article: str, no_cache: bool = False):
+    """generate_image_prompts 的串流版本：每組風格的 JSON 物件一結束就 yield 該組 dict。"""
+    user_prompt = get_image_prompt_request(article)
+    parser = JsonArrayStream()
+    stream = _stream_with_fallback(
+        "image_prompts",
+        "generate_image_prompts_stream",
+        lambda model, deadline, open_deadline: _stream_gemini(
+            model=model,
+            system_instruction=IMAGE_PROMPT_SYSTEM_PROMPT,
+            user_prompt=user_prompt,
+            response_mime_type="application/json",
+            no_cache=no_cache,
+            operation="generate_image_prompts_stream",
+            response_schema=IMAGE_PROMPT_SCHEMA,
+            deadline=deadline,
+            open_deadline=open_deadline,
+        ),
+        estimate_tokens(IMAGE_PROMPT_SYSTEM_PROMPT, user_prompt),
     )
+    for chunk in stream:
+        for item in parser.feed(chunk):
+            yield _normalize_image_prompt(item)
+    parser.close()
 
+
+def _parse_image_prompts(text: str) -> list[dict]:
     try:
         prompts = json.loads(text)
     except json.JSONDecodeError:
-        match = re.search(r"```json\s*(.*?)\s*```", text, re.DOTALL)
-        if match:
-            prompts = json.loads(match.group(1))
-        else:
-            raise ValueError(f"無法解析 Gemini 回傳的 JSON:\n{text}")
+        raise ValueError(f"無法解析 Gemini 回傳的 JSON:\n{text}")
+    if not isinstance(prompts, list):
+        raise ValueError(f"Gemini 回傳的 JSON 不是陣列:\n{text}")
 
-    return prompts
+    return [_normalize_image_prompt(p) for p in prompts]
 
 
-def generate_image(prompt: str, filename: str = "generated_image.png") -> Path:
-    """使用 Gemini 3 Pro Image (Nano Banana Pro) 的原生圖片生成功能。"""
-    # Nano Banana Pro ID: gemini-3-pro-image-preview
-    url = f"{BASE_URL}/models/gemini-3-pro-image-preview:generateContent?key={API_KEY}"
+def _normalize_image_prompt(item: dict) -> dict:
+    """補齊缺少的欄位，畫面可以直接取用"""
+    if not isinstance(item, dict):
+        raise ValueError(f"圖片 Prompt 格式錯誤：{item!r}")
+    return {field: item.get(field) or "" for field in IMAGE_PROMPT_FIELDS}
 
-    payload = {
+
+def _build_image_payload(prompt: str) -> dict:
+    return {
         "contents": [
             {"role": "user", "parts": [{"text": f"Generate an image: {prompt}"}]}
         ],
@@ -125,10 +567,9 @@ def generate_image(prompt: str, filename: str = "generated_image.png") -> Path:
         },
     }
 
-    resp = req.post(url, json=payload, timeout=120)
-    resp.raise_for_status()
-    data = resp.json()
 
+def _extract_image(data: dict) -> tuple[bytes, str]:
+    """從 generateContent 回應找出圖片（inlineData），回傳 (bytes, mime type)"""
     candidates = data.get("candidates", [])
     if not candidates:
         raise RuntimeError(f"Gemini 未回傳結果：{data}")
@@ -138,11 +579,126 @@ def generate_image(prompt: str, filename: str = "generated_image.png") -> Path:
     # 從 parts 中找到圖片（inlineData）
     for part in parts:
         inline = part.get("inlineData")
-        if inline and inline.get("mimeType", "").startswith("image/"):
+        mime = inline.get("mimeType", "") if inline else ""
+        if mime.startswith("image/"):
             image_bytes = base64.b64decode(inline["data"])
-            image_path = OUTPUT_DIR / filename
-            img = Image.open(io.BytesIO(image_bytes))
-            img.save(str(image_path))
-            return image_path
+            if mime in MIME_EXTENSIONS:
+                # 已是可用格式：解碼後的 bytes 直接使用，不重新編碼
+                return image_bytes, mime
+            # PIL 只在需要轉檔時才匯入，縮短冷啟動
+            from PIL import Image
+
+            buf = io.BytesIO()
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                img.save(buf, format="PNG")
+            return buf.getvalue(), "image/png"
 
     raise RuntimeError("Gemini 回傳中沒有圖片資料")
+
+
+def _request_image(prompt: str, model: str = IMAGE_MODEL, deadline: Deadline = None) -> dict:
+    """送出圖片生成請求，回傳 generateContent 回應"""
+    # Nano Banana Pro ID: gemini-3-pro-image-preview
+    url = f"{BASE_URL}/models/{model}:generateContent?key={API_KEY}"
+
+    deadline = deadline or deadline_for("generate_image")
+    estimated = estimate_tokens(prompt)
+    with track("gemini", "generate_image", model=model) as rec:
+        acquire_model(model, estimated, rec, max_wait=deadline.remaining(), deadline=deadline)
+        resp = request("gemini", "POST", url, json=_build_image_payload(prompt), deadline=deadline,
+                       buckets=model_buckets(model))
+        observe_response(rec, resp)
+        observe_throttle(resp, *model_buckets(model))
+        resp.raise_for_status()
+        data = resp.json()
+        observe_usage(rec, data)
+        settle_tokens(model, estimated, rec)
+    return data
+
+
+def _cached_image(prompt: str, no_cache: bool):
+    """資產庫中這個 prompt 已生成過的圖片（no_cache=True 時略過）"""
+    if no_cache:
+        return None
+    asset = get_asset_store().lookup(prompt)
+    if asset is not None:
+        record_cache_hit("gemini", "generate_image", model=asset.model)
+    return asset
+
+
+def _store_image(prompt: str, model: str, data: dict) -> Asset:
+    image_bytes, mime = _extract_image(data)
+    return get_asset_store().put(image_bytes, mime, prompt, model)
+
+
+def generate_image_asset(prompt: str, no_cache: bool = False) -> Asset:
+    """
+    使用 Gemini 3 Pro Image (Nano Banana Pro) 的原生圖片生成功能（失敗時沿備援鏈換模型）。
+    結果存入資產庫；同一個 prompt 再次呼叫時直接回傳既有圖片，no_cache=True 時重新生成。
+    """
+    asset = _cached_image(prompt, no_cache)
+    if asset is None:
+        model, data = _with_fallback("image", "generate_image",
+                                     lambda model, deadline: (model, _request_image(prompt, model, deadline)))
+        asset = _store_image(prompt, model, data)
+    return asset
+
+
+def generate_image(prompt: str, no_cache: bool = False) -> Path:
+    """生成圖片，回傳資產庫中的檔案路徑（以內容雜湊命名，不會被覆寫）。"""
+    return generate_image_asset(prompt, no_cache).path
+
+
+def generate_image_artifact(prompt: str, no_cache: bool = False) -> ImageArtifact:
+    """與 generate_image 相同，但回傳含原圖與預覽縮圖的 ImageArtifact，供 session 暫存。"""
+    asset = generate_image_asset(prompt, no_cache)
+    return ImageArtifact(asset.data, asset.mime, prompt, thumbnail=asset.thumbnail, asset_id=asset.sha256)
+
+
+async def _arequest_image(prompt: str, model: str = IMAGE_MODEL, deadline: Deadline = None) -> dict:
+    url = f"{BASE_URL}/models/{model}:generateContent?key={API_KEY}"
+
+    deadline = deadline or deadline_for("generate_image")
+    estimated = estimate_tokens(prompt)
+    with track("gemini", "generate_image", model=model) as rec:
+        await aacquire_model(model, estimated, rec, max_wait=deadline.remaining())
+        resp = await arequest("gemini", "POST", url, json=_build_image_payload(prompt), timeout=deadline.timeout(),
+                             buckets=model_buckets(model))
+        observe_response(rec, resp)
+        observe_throttle(resp, *model_buckets(model))
+        resp.raise_for_status()
+        data = resp.json()
+        observe_usage(rec, data)
+        settle_tokens(model, estimated, rec)
+    return data
+
+
+async def agenerate_image(prompt: str, no_cache: bool = False, timeout: float = None) -> Path:
+    """generate_image 的非同步版本；資產庫查詢、圖片解碼與存檔在 thread 中執行。timeout 未指定時使用 image 步驟的時間預算。"""
+    asset = await asyncio.to_thread(_cached_image, prompt, no_cache)
+    if asset is None:
+        async def call(model, deadline):
+            return model, await _arequest_image(prompt, model, deadline)
+
+        model, data = await _awith_fallback("image", "generate_image", call, timeout=timeout)
+        asset = await asyncio.to_thread(_store_image, prompt, model, data)
+    return asset.path
+
+
+def generate_images_parallel(prompts: dict[int, str], max_workers: int = 3):
+    """
+    以有上限的 thread pool 同時生成多張圖片，完成一張就回傳一張。
+    prompts: {風格索引: prompt}
+    Yields: (idx, artifact, error) — 成功時 error 為 None，失敗時 artifact 為 None
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(generate_image_artifact, prompt): idx
+            for idx, prompt in prompts.items()
+        }
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                yield idx, future.result(), None
+            except Exception as e:
+                yield idx, None, e
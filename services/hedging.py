@@ -0,0 +1,258 @@
+"""請求對沖（hedging）— 呼叫超過該類請求最近的 p90 還沒回應時，再送一份相同的請求，取先回來的
+
+    result = hedged_call("gemini-2.5-flash/generate_image_prompts", attempt, deadline, record=rec)
+    # attempt(a: Attempt)：a.hedge=True 的那份不等配額，額度不足就直接放棄；
+    # 請求與重試要受 a.deadline 限制，量測寫入 a.record
+
+限制：
+    - 每筆呼叫累積 HEDGE_RATE 張對沖額度（最多 HEDGE_BURST 張），送出對沖消耗一張，
+      所以對沖請求長期不超過 HEDGE_RATE 比例，不會讓配額用量加倍
+    - 每種請求累積 MIN_SAMPLES 筆延遲後才開始對沖
+    - 每份請求各有一份 metrics 量測，只有勝出（或拋出例外）的那份在呼叫端的 thread 併入 record，
+      落敗的那份不會重複計算，也不會在 record 送出後才改動它
+    - 同步版的落敗請求以 a.deadline.cancel() 通知：進行中的 HTTP 請求無法中斷，但之後不再重試、
+      等待 Retry-After 或配額，結果交給 on_discard 處理（例如關閉串流）；非同步版直接取消
+
+HEDGE_RATE 可用環境變數 GEMINI_HEDGE_RATE 設定，0 表示停用。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from services.deadlines import DeadlineExceeded
+from services.metrics import merge_attempt, new_attempt
+
+
+HEDGE_RATE = float(os.getenv("GEMINI_HEDGE_RATE", "0.1"))
+HEDGE_BURST = 3.0
+
+# 觸發對沖的延遲百分位數與下限
+HEDGE_PERCENTILE = 90
+MIN_HEDGE_DELAY = 0.5
+
+# 每種請求保留的延遲樣本數 / 開始對沖前需要的樣本數
+WINDOW_SIZE = 200
+MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """各種請求最近的延遲（秒）"""
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def percentile(self, key: str, pct: float, min_samples: int = MIN_SAMPLES):
+        """樣本不足時回傳 None"""
+        with self._lock:
+            values = sorted(self._samples.get(key, ()))
+        if len(values) < min_samples:
+            return None
+        idx = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+        return values[idx]
+
+
+class HedgeBudget:
+    """每筆呼叫存入 rate 張額度，對沖一次花一張"""
+
+    def __init__(self, rate: float = HEDGE_RATE, burst: float = HEDGE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+
+    def deposit(self):
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.burst, self._tokens + self.rate)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+
+_tracker = LatencyTracker()
+_budget = HedgeBudget()
+
+
+def hedge_delay(key: str):
+    """該類請求應在多少秒後對沖；不對沖時回傳 None"""
+    if _budget.rate <= 0:
+        return None
+    p = _tracker.percentile(key, HEDGE_PERCENTILE)
+    return None if p is None else max(MIN_HEDGE_DELAY, p)
+
+
+def stats() -> dict:
+    return {"calls": _budget.calls, "hedges": _budget.hedges}
+
+
+class Attempt:
+    """對沖中的一份請求：hedge 為對沖的那份；deadline 可單獨取消；record 為這份自己的量測"""
+
+    def __init__(self, hedge: bool, deadline=None):
+        self.hedge = hedge
+        self.deadline = None if deadline is None else deadline.child()
+        self.record = new_attempt()
+
+    def cancel(self):
+        if self.deadline is not None:
+            self.deadline.cancel()
+
+    def report(self, record: dict):
+        if record is not None:
+            merge_attempt(record, dict(self.record))
+
+
+def _start(fn, *args) -> Future:
+    """在 daemon thread 執行（不用共用 pool，避免排隊反而增加延遲）"""
+    future = Future()
+
+    def _run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=_run, daemon=True, name="hedge").start()
+    return future
+
+
+def _discard(future: Future, on_discard):
+    def _callback(f: Future):
+        if on_discard is not None and not f.cancelled() and f.exception() is None:
+            try:
+                on_discard(f.result())
+            except Exception:
+                pass
+
+    future.add_done_callback(_callback)
+
+
+def _expired(deadline):
+    return DeadlineExceeded(f"{deadline.step} 超過時間預算 {deadline.seconds:g} 秒")
+
+
+def hedged_call(key: str, attempt, deadline=None, on_discard=None, record: dict = None):
+    """
+    attempt(Attempt) 超過 p90 還沒完成時再送一份；回傳先成功的結果。
+    兩份都失敗時拋出原始請求的例外；deadline 到期時拋出 DeadlineExceeded。
+    record（metrics 紀錄）只併入勝出那份的量測；兩份都失敗時併入拋出例外的那份。
+    """
+    _budget.deposit()
+    delay = hedge_delay(key)
+    started = time.perf_counter()
+    primary = Attempt(False, deadline)
+    if delay is None and deadline is None:
+        try:
+            result = attempt(primary)
+        finally:
+            primary.report(record)
+        _tracker.observe(key, time.perf_counter() - started)
+        return result
+
+    # 有 deadline 時一律在 thread 中執行：呼叫端到期就先返回，並取消還在跑的請求
+    attempts = {_start(attempt, primary): primary}
+    if delay is not None:
+        timeout = None if deadline is None else deadline.remaining()
+        done, _ = wait(list(attempts), timeout=delay if timeout is None else min(delay, timeout))
+        if not done and _budget.try_spend():
+            hedge = Attempt(True, deadline)
+            attempts[_start(attempt, hedge)] = hedge
+
+    pending = set(attempts)
+    reported = primary
+    winner = None
+    first_error = None
+    try:
+        while pending:
+            timeout = None if deadline is None else deadline.remaining()
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    _tracker.observe(key, time.perf_counter() - started)
+                    winner = future
+                    reported = attempts[future]
+                    return future.result()
+                if attempts[future] is primary or first_error is None:
+                    first_error = future.exception()
+                    reported = attempts[future]
+    finally:
+        # 還在跑的，以及和勝出者同一輪完成的成功結果（例如已開啟的串流）都要交給 on_discard
+        for future, loser in attempts.items():
+            if future is not winner:
+                loser.cancel()
+                _discard(future, on_discard)
+        reported.report(record)
+
+    if first_error is not None:
+        raise first_error
+    raise _expired(deadline)
+
+
+async def ahedged_call(key: str, attempt, deadline=None, record: dict = None):
+    """hedged_call 的非同步版本：attempt(Attempt) 為 coroutine function，落敗的請求直接取消"""
+    _budget.deposit()
+    delay = hedge_delay(key)
+    started = time.perf_counter()
+    primary = Attempt(False, deadline)
+    if delay is None and deadline is None:
+        try:
+            result = await attempt(primary)
+        finally:
+            primary.report(record)
+        _tracker.observe(key, time.perf_counter() - started)
+        return result
+
+    attempts = {asyncio.ensure_future(attempt(primary)): primary}
+    if delay is not None:
+        timeout = None if deadline is None else deadline.remaining()
+        done, _ = await asyncio.wait(set(attempts), timeout=delay if timeout is None else min(delay, timeout))
+        if not done and _budget.try_spend():
+            hedge = Attempt(True, deadline)
+            attempts[asyncio.ensure_future(attempt(hedge))] = hedge
+
+    pending = set(attempts)
+    reported = primary
+    first_error = None
+    try:
+        while pending:
+            timeout = None if deadline is None else deadline.remaining()
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is None:
+                    _tracker.observe(key, time.perf_counter() - started)
+                    reported = attempts[task]
+                    return task.result()
+                if attempts[task] is primary or first_error is None:
+                    first_error = task.exception()
+                    reported = attempts[task]
+    finally:
+        for task in pending:
+            attempts[task].cancel()
+            task.cancel()
+        reported.report(record)
+
+    if first_error is not None:
+        raise first_error
+    raise _expired(deadline)
@@ -0,0 +1,253 @@
+"""共用 HTTP 連線池 — 所有 Gemini / Facebook 呼叫共用 keep-alive Session"""
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from services.rate_limiter import MAX_WAIT_SECONDS, arequeue, requeue
+
+
+# 連線池大小：同一 host 最多保留的 keep-alive 連線數
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+# 會觸發重試的 HTTP 狀態碼（429 會依 Retry-After 等待）
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+# 非同步連線池：同時在途的連線上限（批次 / 多品牌一次跑上百個請求）
+ASYNC_MAX_CONNECTIONS = 200
+ASYNC_MAX_KEEPALIVE = 50
+
+_sessions: dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+# AsyncClient 綁定建立它的 event loop，因此每個 loop 各有一組
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+
+
+class _Retry(Retry):
+    """429 表示請求未被處理，任何 method（包含發文 POST）都可以安全重送"""
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_retry(allowed_methods) -> Retry:
+    """指數退避 + 隨機抖動，並遵守伺服器回傳的 Retry-After"""
+    return _Retry(
+        total=3,
+        connect=3,
+        read=2,
+        status=3,
+        backoff_factor=1,
+        backoff_jitter=0.5,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=allowed_methods,
+        respect_retry_after_header=True,
+        # 重試用完時回傳最後一個 response，交給呼叫端 raise_for_status
+        raise_on_status=False,
+    )
+
+
+def _build_connect_retry() -> Retry:
+    """只重試連線建立失敗（請求還沒送出）；狀態碼與讀取錯誤交給 request() 處理"""
+    return Retry(total=3, connect=3, read=0, status=0, other=0, backoff_factor=0.5, raise_on_status=False)
+
+
+def _build_session(allowed_methods=None, retry: Retry = None) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=retry or _build_retry(allowed_methods),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(name: str) -> requests.Session:
+    """
+    取得指定服務的共用 Session（整個 process 只建立一次）。
+
+    - "gemini"：generateContent 可安全重送，POST 也會重試。
+    - "facebook"：發文的 POST 不具冪等性，只重試 GET、連線建立失敗與 429。
+    - "gemini_batch"：建立批次工作的 POST 重送會重複計費，規則同 "facebook"。
+    - "gemini_cache"：建立 / 延長 context cache，失敗時改走 inline prompt 即可，不重試 POST / PATCH。
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+
+    with _lock:
+        if name not in _sessions:
+            _sessions[name] = _build_session(_retryable_methods(name))
+        return _sessions[name]
+
+
+def _get_request_session(name: str) -> requests.Session:
+    """request() 用的 Session：連線池獨立於 get_session，urllib3 只重試連線建立"""
+    key = f"{name}/request"
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _lock:
+        if key not in _sessions:
+            _sessions[key] = _build_session(retry=_build_connect_retry())
+        return _sessions[key]
+
+
+def warm(name: str, url: str, timeout: float = 10):
+    """對 url 的 origin 送一個 HEAD，讓 request(name, ...) 實際使用的連線池先留下 keep-alive 連線"""
+    parts = urlsplit(url)
+    _get_request_session(name).head(f"{parts.scheme}://{parts.netloc}/", timeout=timeout)
+
+
+def request(name: str, method: str, url: str, *, deadline=None, buckets: tuple = (), **kwargs) -> requests.Response:
+    """
+    同步送出請求，狀態碼重試在這裡執行（規則與 arequest 相同），而不是在 urllib3 裡：
+    每次重送前檢查 deadline，退避 / Retry-After 的等待在 deadline 被取消或到期時立即中止，
+    被對沖或備援放棄的請求不會在背景繼續重試、佔用配額與連線。
+
+    deadline 為 services.deadlines.Deadline；未指定 timeout 時每次送出都用 deadline.timeout()。
+    buckets 為這次請求的配額 bucket（第一個是 RPM）；429 的重送改由 rate_limiter.requeue
+    等到 Retry-After 結束並重新取得額度，而不是直接重送。
+    """
+    session = _get_request_session(name)
+    retry = method.upper() in _retryable_methods(name)
+    attempts = 3 if retry else 0
+    throttled = requeued = False
+    fixed_timeout = kwargs.pop("timeout", None)
+    for attempt in range(4):
+        if deadline is not None:
+            deadline.check()
+        timeout = fixed_timeout if fixed_timeout is not None or deadline is None else deadline.timeout()
+        resp = session.request(method, url, timeout=timeout, **kwargs)
+        throttled = throttled or resp.status_code == 429
+        # 給 metrics.observe_response / rate_limiter.observe_throttle 讀取
+        resp.extensions = {"retries": attempt, "throttled": throttled, "requeued": requeued}
+        if resp.status_code not in RETRY_STATUS or attempt >= (3 if resp.status_code == 429 else attempts):
+            return resp
+        if resp.status_code == 429 and buckets:
+            sleep = time.sleep if deadline is None else deadline.sleep
+            max_wait = MAX_WAIT_SECONDS if deadline is None else deadline.remaining()
+            if not requeue(resp, buckets, max_wait=max_wait, sleep=sleep):
+                return resp
+            requeued = True
+            resp.close()
+            continue
+        delay = _retry_after(resp)
+        if delay is None:
+            delay = 2 ** attempt + random.uniform(0, 0.5)
+        if deadline is not None and delay >= deadline.remaining():
+            # 等不到下一次重送，直接把這個 response 交給呼叫端
+            return resp
+        resp.close()
+        if deadline is not None:
+            deadline.sleep(delay)
+        else:
+            time.sleep(delay)
+    return resp
+
+
+def _retryable_methods(name: str) -> frozenset:
+    if name == "gemini":
+        return frozenset({"GET", "POST", "PATCH", "DELETE"})
+    return Retry.DEFAULT_ALLOWED_METHODS
+
+
+def get_async_client(name: str) -> httpx.AsyncClient:
+    """
+    取得目前 event loop 上指定服務的共用 AsyncClient。
+    所有服務共用同一個連線池設定；必須在 coroutine 內呼叫。
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_KEEPALIVE,
+            ),
+            # 連線建立失敗由 transport 重試；狀態碼重試見 arequest
+            transport=httpx.AsyncHTTPTransport(retries=3),
+        )
+        clients[name] = client
+    return client
+
+
+async def aclose_async_clients():
+    """關閉目前 event loop 上的所有 AsyncClient（在 loop 結束前呼叫）"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+def _retry_after(resp):
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def arequest(name: str, method: str, url: str, *, timeout: float = None, buckets: tuple = (),
+                   **kwargs) -> httpx.Response:
+    """
+    以共用 AsyncClient 送出請求，重試策略與 get_session 相同
+    （指數退避 + 抖動、遵守 Retry-After、Facebook 的 POST 只在 429 時重試）。
+    帶 buckets 時 429 的重送先經過 rate_limiter.arequeue 重新取得額度（見 request）。
+
+    timeout 為整個呼叫（含重試與等待）的期限，超過時拋出 TimeoutError；
+    外部取消 (CancelledError) 會直接往上傳遞並中止進行中的請求。
+    """
+    async def _send():
+        client = get_async_client(name)
+        retry = method.upper() in _retryable_methods(name)
+        attempts = 3 if retry else 0
+        throttled = requeued = False
+        for attempt in range(4):
+            resp = await client.request(method, url, timeout=timeout, **kwargs)
+            throttled = throttled or resp.status_code == 429
+            # 給 metrics.observe_response / rate_limiter.observe_throttle 讀取
+            resp.extensions["retries"] = attempt
+            resp.extensions["throttled"] = throttled
+            resp.extensions["requeued"] = requeued
+            if resp.status_code not in RETRY_STATUS or attempt >= (3 if resp.status_code == 429 else attempts):
+                return resp
+            if resp.status_code == 429 and buckets:
+                # 整體期限由外層的 wait_for 控制
+                if not await arequeue(resp, buckets):
+                    return resp
+                requeued = True
+                await resp.aclose()
+                continue
+            delay = _retry_after(resp)
+            if delay is None:
+                delay = 2 ** attempt + random.uniform(0, 0.5)
+            await resp.aclose()
+            await asyncio.sleep(delay)
+        return resp
+
+    if timeout is None:
+        return await _send()
+    return await asyncio.wait_for(_send(), timeout)
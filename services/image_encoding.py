@@ -0,0 +1,62 @@
+"""圖片編碼 — 副檔名 / MIME 對照，以及 Facebook 動態用的縮圖壓縮版本"""
+
+import io
+from pathlib import Path
+
+
+# Gemini 回傳這些格式時直接寫檔，不重新編碼
+MIME_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+}
+EXTENSION_MIMES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+}
+
+# Facebook 動態顯示用：長邊上限與 JPEG 品質
+FB_MAX_EDGE = 2048
+FB_JPEG_QUALITY = 85
+
+
+def guess_mime(path) -> str:
+    return EXTENSION_MIMES.get(Path(path).suffix.lower(), "application/octet-stream")
+
+
+def encode_for_facebook(source, max_edge: int = FB_MAX_EDGE, quality: int = FB_JPEG_QUALITY) -> tuple[bytes, str, str]:
+    """
+    產生上傳 Facebook 用的版本：長邊縮到 max_edge 以內、轉成 JPEG。
+    source 可以是檔案路徑、bytes，或有 data / id 屬性的 ImageArtifact。
+    已經是夠小的 JPEG 時原樣回傳，不重新壓縮。
+    Returns: (bytes, mime type, 檔名)
+    """
+    if hasattr(source, "data"):
+        raw, stem = source.data, source.id
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        raw, stem = bytes(source), "image"
+    else:
+        raw, stem = Path(source).read_bytes(), Path(source).stem
+
+    # PIL 只在真的要解碼圖片時才匯入，縮短冷啟動
+    from PIL import Image
+
+    with Image.open(io.BytesIO(raw)) as img:
+        if img.format == "JPEG" and max(img.size) <= max_edge:
+            return raw, "image/jpeg", f"{stem}.jpg"
+
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if img.mode in ("RGBA", "LA", "P"):
+            # JPEG 不支援透明度，貼到白底
+            rgba = img.convert("RGBA")
+            flat = Image.new("RGB", rgba.size, (255, 255, 255))
+            flat.paste(rgba, mask=rgba.getchannel("A"))
+            img = flat
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue(), "image/jpeg", f"{stem}.jpg"
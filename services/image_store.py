@@ -0,0 +1,75 @@
+"""圖片暫存 — 每個 Streamlit session 各自一份、放在記憶體中的生成圖片"""
+
+import uuid
+from collections import OrderedDict
+
+from services.image_encoding import MIME_EXTENSIONS
+
+
+# 每個 session 最多保留的圖片張數與總大小（超過時淘汰最舊的）
+MAX_IMAGES = 8
+MAX_BYTES = 64 * 1024 * 1024
+
+
+class ImageArtifact:
+    """一張生成的圖片：唯一 ID + 原始 bytes；來自資產庫時另有預覽縮圖與內容雜湊"""
+
+    def __init__(self, data: bytes, mime: str, prompt: str = "", thumbnail: bytes = None, asset_id: str = None):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.mime = mime
+        self.prompt = prompt
+        self.thumbnail = thumbnail
+        self.asset_id = asset_id
+
+    @property
+    def preview(self) -> bytes:
+        """畫面顯示用：有縮圖就用縮圖，不把原圖送到瀏覽器"""
+        return self.thumbnail or self.data
+
+    @property
+    def filename(self) -> str:
+        return f"{self.id}{MIME_EXTENSIONS.get(self.mime, '.png')}"
+
+    @property
+    def size(self) -> int:
+        return len(self.data) + len(self.thumbnail or b"")
+
+
+class ImageStore:
+    """
+    以 ID 存取的有界圖片暫存（LRU）。
+    放在 st.session_state 中，session 結束時跟著被回收。
+    """
+
+    def __init__(self, max_images: int = MAX_IMAGES, max_bytes: int = MAX_BYTES):
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, ImageArtifact]" = OrderedDict()
+
+    def put(self, artifact: ImageArtifact) -> str:
+        self._items[artifact.id] = artifact
+        self._items.move_to_end(artifact.id)
+        self._evict()
+        return artifact.id
+
+    def get(self, artifact_id: str):
+        """取得圖片；不存在（或已被淘汰）回傳 None"""
+        artifact = self._items.get(artifact_id) if artifact_id else None
+        if artifact is not None:
+            self._items.move_to_end(artifact_id)
+        return artifact
+
+    def discard(self, artifact_id: str):
+        self._items.pop(artifact_id, None)
+
+    def clear(self):
+        self._items.clear()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(a.size for a in self._items.values())
+
+    def _evict(self):
+        while len(self._items) > 1 and (len(self._items) > self.max_images or self.total_bytes > self.max_bytes):
+            self._items.popitem(last=False)
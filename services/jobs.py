@@ -0,0 +1,107 @@
+"""背景工作 — 把耗時的 Gemini / Facebook 呼叫移出 Streamlit script thread，UI 以輪詢狀態重繪"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# process 共用的工作 thread pool（所有 session 共用）
+MAX_WORKERS = 16
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+
+# 工作狀態
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """工作函式在檢查到取消要求時拋出"""
+
+
+class Job:
+    """
+    一筆背景工作的 handle，可放進 st.session_state。
+    工作函式透過 report() 回報進度與部分結果，並定期檢查 cancelled。
+    """
+
+    def __init__(self, tag: str = ""):
+        self.id = uuid.uuid4().hex
+        self.tag = tag
+        self.future: Future = None
+        self.progress = 0.0
+        self.message = ""
+        self.partial = None
+        self.started_at = time.time()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def report(self, progress: float = None, message: str = None, partial=None):
+        """由工作 thread 呼叫：更新進度 (0~1)、狀態文字或部分結果"""
+        with self._lock:
+            if progress is not None:
+                self.progress = min(1.0, max(0.0, progress))
+            if message is not None:
+                self.message = message
+            if partial is not None:
+                self.partial = partial
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """要求取消；尚未開始的工作直接取消，執行中的由工作函式自行結束"""
+        self._cancel.set()
+        self.future.cancel()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def status(self) -> str:
+        if self.future.cancelled():
+            return CANCELLED
+        if not self.future.done():
+            return RUNNING if self.future.running() else PENDING
+        exc = self.future.exception()
+        if isinstance(exc, JobCancelled):
+            return CANCELLED
+        return FAILED if exc is not None else DONE
+
+    def result(self, timeout: float = None):
+        return self.future.result(timeout=timeout)
+
+    def error(self):
+        """已結束工作的例外（成功或取消時為 None）"""
+        if not self.future.done() or self.future.cancelled():
+            return None
+        exc = self.future.exception()
+        return None if isinstance(exc, JobCancelled) else exc
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+
+def submit(fn, *args, tag: str = "", **kwargs) -> Job:
+    """送出工作；fn 的第一個參數會收到 Job，用來回報進度與檢查取消"""
+    job = Job(tag)
+
+    def _run():
+        if job.cancelled:
+            raise JobCancelled()
+        return fn(job, *args, **kwargs)
+
+    job.future = _executor.submit(_run)
+    return job
+
+
+def submit_call(fn, *args, tag: str = "", **kwargs) -> Job:
+    """送出一般函式（不回報進度）"""
+    return submit(lambda _job, *a, **kw: fn(*a, **kw), *args, tag=tag, **kwargs)
+
@@ -0,0 +1,91 @@
+"""串流 JSON 解析 — 從逐段到達的文字中，取出最外層陣列裡已經完整的物件
+
+    parser = JsonArrayStream()
+    for chunk in stream:
+        for item in parser.feed(chunk):
+            ...                     # 每個元素的 } 一到就回傳，不必等整個陣列結束
+    parser.close()                  # 陣列沒有正常結束時拋出 ValueError
+
+只追蹤字串 / 跳脫字元 / 巢狀深度，每個字元只掃一次；元素本身仍交給 json.loads 解析。
+"""
+
+import json
+
+
+class JsonArrayStream:
+    """最外層必須是 JSON 陣列；元素可以是任意 JSON 值（物件、字串、數字…）"""
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0           # 下一個要掃描的字元
+        self._depth = 0         # 0 = 陣列外，1 = 陣列內（元素之間）
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+        self.items = []
+        self.done = False
+
+    def feed(self, text: str) -> list:
+        """加入一段文字，回傳這段文字讓其完整的元素（可能為空）"""
+        self._buf += text
+        completed = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf) and not self.done:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # 元素本身是字串
+                        completed.append(self._finish(i + 1))
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._item_start = i
+            elif ch in "[{":
+                if self._depth == 1:
+                    self._item_start = i
+                elif self._depth == 0 and ch == "{":
+                    raise ValueError("JSON 最外層不是陣列")
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 1:
+                    completed.append(self._finish(i + 1))
+                elif self._depth == 0:
+                    # 陣列結束；若最後一個元素是數字 / true / null，在這裡收尾
+                    if self._item_start is not None:
+                        completed.append(self._finish(i))
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ",":
+                    if self._item_start is not None:
+                        completed.append(self._finish(i))
+                elif not ch.isspace() and self._item_start is None:
+                    self._item_start = i
+            i += 1
+
+        # 已完成的元素不再需要保留原文
+        cut = self._item_start if self._item_start is not None else i
+        self._buf = buf[cut:]
+        self._pos = i - cut
+        if self._item_start is not None:
+            self._item_start = 0
+        return completed
+
+    def _finish(self, end: int):
+        item = json.loads(self._buf[self._item_start:end])
+        self._item_start = None
+        self.items.append(item)
+        return item
+
+    def close(self) -> list:
+        """串流結束時呼叫；回傳所有元素，陣列不完整時拋出 ValueError"""
+        if not self.done:
+            raise ValueError(f"JSON 陣列不完整（已解析 {len(self.items)} 個元素）")
+        return self.items
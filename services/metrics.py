@@ -0,0 +1,307 @@
+"""服務呼叫量測 — 每次 Gemini / Facebook 呼叫的耗時、流量、token 與結果
+
+使用方式：
+    with track("gemini", "generate_article", model=model, brand=brand) as rec:
+        resp = session.post(...)
+        observe_response(rec, resp)
+        observe_usage(rec, resp.json())
+
+每筆紀錄結束時會送給所有 hook（add_hook 註冊）。內建三種輸出：
+    - rolling 視窗：summary() 回傳各呼叫的 p50 / p95（側邊欄顯示）
+    - Prometheus 文字格式：prometheus_text()，設定 METRICS_PORT 時另開 HTTP endpoint
+    - JSONL：設定 METRICS_JSONL=<路徑> 時每筆寫一行
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# rolling 視窗保留的最近紀錄數
+WINDOW_SIZE = 1000
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(fn):
+    """註冊自訂 exporter：fn(record: dict)，在呼叫結束的 thread 上同步執行"""
+    with _hooks_lock:
+        if fn not in _hooks:
+            _hooks.append(fn)
+
+
+def remove_hook(fn):
+    with _hooks_lock:
+        if fn in _hooks:
+            _hooks.remove(fn)
+
+
+def _new_record(service: str, operation: str, **labels) -> dict:
+    record = {
+        "ts": time.time(),
+        "service": service,
+        "operation": operation,
+        "model": None,
+        "brand": None,
+        "wall_time": None,
+        "bytes_sent": 0,
+        "bytes_received": 0,
+        "prompt_tokens": None,
+        "candidate_tokens": None,
+        "total_tokens": None,
+        "cached_tokens": None,
+        "retries": 0,
+        "quota_wait": 0.0,
+        "status": None,
+        "outcome": "ok",
+        "error": None,
+    }
+    record.update(labels)
+    return record
+
+
+def emit(record: dict):
+    with _hooks_lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(record)
+        except Exception:
+            # exporter 出錯不能影響主流程
+            pass
+
+
+@contextmanager
+def track(service: str, operation: str, **labels):
+    """量測一次呼叫；例外會記為 error（取消記為 cancelled）後原樣往上拋"""
+    record = _new_record(service, operation, **labels)
+    t0 = time.perf_counter()
+    try:
+        yield record
+    except (asyncio.CancelledError, GeneratorExit, KeyboardInterrupt):
+        record["outcome"] = "cancelled"
+        raise
+    except BaseException as e:
+        record["outcome"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        record["wall_time"] = round(time.perf_counter() - t0, 4)
+        emit(record)
+
+
+# 每一份請求（例如對沖的兩份）各自累計、只合併勝出那份的欄位
+ATTEMPT_FIELDS = ("bytes_sent", "bytes_received", "retries", "quota_wait")
+
+
+def new_attempt() -> dict:
+    """單一份請求的量測；可直接傳給 observe_response / acquire_model，結束後以 merge_attempt 併入紀錄"""
+    return {"bytes_sent": 0, "bytes_received": 0, "retries": 0, "quota_wait": 0.0, "status": None}
+
+
+def merge_attempt(record: dict, attempt: dict):
+    for field in ATTEMPT_FIELDS:
+        record[field] += attempt[field]
+    if attempt["status"] is not None:
+        record["status"] = attempt["status"]
+
+
+def record_cache_hit(service: str, operation: str, **labels):
+    """本機回應快取命中：不送請求，仍記一筆方便算命中率"""
+    record = _new_record(service, operation, **labels)
+    record["outcome"] = "cache_hit"
+    record["wall_time"] = 0.0
+    emit(record)
+
+
+def _body_size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+
+def observe_response(record: dict, resp, received: int = None):
+    """由 requests / httpx 的 response 填入傳送 / 接收位元組與重試次數"""
+    request = getattr(resp, "request", None)
+    if request is not None:
+        body = getattr(request, "body", None)
+        if body is None:
+            try:
+                body = getattr(request, "content", None)
+            except Exception:
+                # httpx 的 multipart 上傳是串流 body，改用 Content-Length
+                record["bytes_sent"] += int(request.headers.get("Content-Length") or 0)
+        record["bytes_sent"] += _body_size(body)
+
+    if received is None:
+        # stream=True 的 response 由呼叫端自行計算 received 傳入
+        received = len(resp.content)
+    record["bytes_received"] += received
+
+    # requests：urllib3 Retry 的歷程；httpx：arequest 寫入 extensions
+    raw_retries = getattr(getattr(resp, "raw", None), "retries", None)
+    if raw_retries is not None:
+        record["retries"] += len(raw_retries.history)
+    extensions = getattr(resp, "extensions", None)
+    if isinstance(extensions, dict):
+        record["retries"] += extensions.get("retries", 0)
+    record["status"] = resp.status_code
+
+
+def observe_usage(record: dict, data: dict):
+    """從 Gemini 回應的 usageMetadata 取 token 數（串流時以最後一段為準）"""
+    usage = data.get("usageMetadata") if isinstance(data, dict) else None
+    if not usage:
+        return
+    record["prompt_tokens"] = usage.get("promptTokenCount", record["prompt_tokens"])
+    record["candidate_tokens"] = usage.get("candidatesTokenCount", record["candidate_tokens"])
+    record["total_tokens"] = usage.get("totalTokenCount", record["total_tokens"])
+    record["cached_tokens"] = usage.get("cachedContentTokenCount", record["cached_tokens"])
+
+
+# ─── rolling 視窗 + Prometheus 累計值（內建 hook） ─── #
+
+class Aggregator:
+    """保留最近的紀錄算百分位數，並累計 Prometheus counter"""
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self._recent = deque(maxlen=window)
+        self._counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def __call__(self, record: dict):
+        labels = (record["service"], record["operation"], record.get("model") or "", record["outcome"])
+        with self._lock:
+            self._recent.append(record)
+            self._counters[("calls",) + labels] += 1
+            self._counters[("seconds",) + labels] += record["wall_time"] or 0
+            self._counters[("retries",) + labels] += record["retries"]
+            self._counters[("bytes_sent",) + labels] += record["bytes_sent"]
+            self._counters[("bytes_received",) + labels] += record["bytes_received"]
+            for kind in ("prompt", "candidate", "total", "cached"):
+                self._counters[(f"{kind}_tokens",) + labels] += record.get(f"{kind}_tokens") or 0
+
+    def summary(self) -> list[dict]:
+        """各 (service, operation) 最近呼叫的次數、錯誤數、p50 / p95 耗時與 token 合計"""
+        with self._lock:
+            records = list(self._recent)
+        groups = defaultdict(list)
+        for r in records:
+            groups[(r["service"], r["operation"])].append(r)
+
+        rows = []
+        for (service, operation), rs in sorted(groups.items()):
+            times = sorted(r["wall_time"] for r in rs if r["outcome"] not in ("cache_hit",))
+            rows.append({
+                "service": service,
+                "operation": operation,
+                "calls": len(rs),
+                "errors": sum(1 for r in rs if r["outcome"] == "error"),
+                "cache_hits": sum(1 for r in rs if r["outcome"] == "cache_hit"),
+                "p50_s": _percentile(times, 50),
+                "p95_s": _percentile(times, 95),
+                "tokens": sum(r.get("total_tokens") or 0 for r in rs),
+                "retries": sum(r["retries"] for r in rs),
+            })
+        return rows
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+        metrics = defaultdict(list)
+        for (name, service, operation, model, outcome), value in sorted(counters.items()):
+            labels = f'service="{service}",operation="{operation}",model="{model}",outcome="{outcome}"'
+            metrics[name].append(f"social_post_{name}_total{{{labels}}} {value:g}")
+
+        lines = []
+        for name, samples in metrics.items():
+            lines.append(f"# TYPE social_post_{name}_total counter")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def _percentile(values: list, pct: float):
+    if not values:
+        return None
+    idx = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return round(values[idx], 3)
+
+
+_aggregator = Aggregator()
+add_hook(_aggregator)
+
+
+def summary() -> list[dict]:
+    return _aggregator.summary()
+
+
+def prometheus_text() -> str:
+    return _aggregator.prometheus_text()
+
+
+# ─── JSONL sink ─── #
+
+class JsonlSink:
+    """每筆紀錄寫成一行 JSON（append），可給離線分析或 log 收集器使用"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+# ─── Prometheus endpoint ─── #
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def serve_prometheus(port: int, host: str = "0.0.0.0"):
+    """在背景 thread 開 /metrics endpoint（每個 process 只會開一次）"""
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+    return _server
+
+
+def _configure_from_env():
+    if os.getenv("METRICS_JSONL"):
+        add_hook(JsonlSink(os.getenv("METRICS_JSONL")))
+    if os.getenv("METRICS_PORT"):
+        try:
+            serve_prometheus(int(os.getenv("METRICS_PORT")))
+        except OSError:
+            # Streamlit 多個 session 重複匯入或埠被占用時略過
+            pass
+
+
+_configure_from_env()
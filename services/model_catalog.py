@@ -0,0 +1,139 @@
+"""Gemini 模型目錄 — GET /models 的結果存成 data/models.json，依 TTL 重新整理
+
+每個模型記錄支援的方法（supportedGenerationMethods）與輸入 / 輸出 token 上限。
+目錄過期時在背景重新整理，期間沿用舊資料；從未取得過目錄時 available() 一律視為可用，
+不會因為目錄 API 失敗而擋住生成。
+"""
+
+import json
+import threading
+import time
+from pathlib import Path
+
+from services.http_client import get_session
+from services.metrics import observe_response, track
+
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+CATALOG_PATH = DATA_DIR / "models.json"
+
+CATALOG_TTL_SECONDS = 24 * 3600
+
+# 重新整理失敗後，多久內不再嘗試
+FAILURE_COOLDOWN_SECONDS = 300
+
+
+class ModelInfo:
+    """一個模型的能力與限制"""
+
+    def __init__(self, name: str, display_name: str = None, methods: list = None,
+                 input_token_limit: int = None, output_token_limit: int = None):
+        self.name = name
+        self.display_name = display_name or name
+        self.methods = list(methods or [])
+        self.input_token_limit = input_token_limit
+        self.output_token_limit = output_token_limit
+
+    @classmethod
+    def from_api(cls, data: dict) -> "ModelInfo":
+        return cls(
+            name=data["name"].removeprefix("models/"),
+            display_name=data.get("displayName"),
+            methods=data.get("supportedGenerationMethods"),
+            input_token_limit=data.get("inputTokenLimit"),
+            output_token_limit=data.get("outputTokenLimit"),
+        )
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def supports(self, method: str) -> bool:
+        return method in self.methods
+
+
+class ModelCatalog:
+    def __init__(self, base_url: str, api_key: str, path: Path = CATALOG_PATH, ttl: float = CATALOG_TTL_SECONDS):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.path = Path(path)
+        self.ttl = ttl
+        self._models: dict[str, ModelInfo] = {}
+        self._fetched_at = 0.0
+        self._failed_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        self._models = {m["name"]: ModelInfo(**m) for m in data.get("models", [])}
+        self._fetched_at = data.get("fetched_at", 0.0)
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self._fetched_at > self.ttl
+
+    def refresh(self) -> dict:
+        """向 API 取得完整目錄（阻塞），寫入磁碟後回傳 {name: ModelInfo}"""
+        if not self.api_key:
+            raise ValueError("缺少 GEMINI_API_KEY！請檢查 secrets.toml 或 .env")
+        models = {}
+        params = {"key": self.api_key, "pageSize": 1000}
+        with track("gemini", "list_models") as rec:
+            while True:
+                resp = get_session("gemini").get(f"{self.base_url}/models", params=params, timeout=30)
+                observe_response(rec, resp)
+                resp.raise_for_status()
+                data = resp.json()
+                for item in data.get("models", []):
+                    info = ModelInfo.from_api(item)
+                    models[info.name] = info
+                if not data.get("nextPageToken"):
+                    break
+                params["pageToken"] = data["nextPageToken"]
+
+        fetched_at = time.time()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"fetched_at": fetched_at, "models": [m.to_dict() for m in models.values()]},
+                                  ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(self.path)
+        with self._lock:
+            self._models, self._fetched_at, self._failed_at = models, fetched_at, None
+        return models
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            # 失敗已記在 metrics（list_models / error），沿用舊目錄
+            self._failed_at = time.time()
+        finally:
+            self._refreshing = False
+
+    def models(self) -> dict:
+        """不阻塞：回傳目前的目錄，過期時在背景重新整理"""
+        with self._lock:
+            cooling = self._failed_at is not None and time.time() - self._failed_at < FAILURE_COOLDOWN_SECONDS
+            if self.stale and self.api_key and not self._refreshing and not cooling:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, daemon=True, name="model-catalog").start()
+            return dict(self._models)
+
+    def get(self, name: str):
+        return self.models().get(name)
+
+    def available(self, name: str, method: str = "generateContent", tokens: int = None) -> bool:
+        """目錄中有此模型、支援該方法且 token 數在上限內；尚無目錄時回傳 True"""
+        models = self.models()
+        if not models:
+            return True
+        info = models.get(name)
+        if info is None or not info.supports(method):
+            return False
+        return tokens is None or not info.input_token_limit or tokens <= info.input_token_limit
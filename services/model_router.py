@@ -0,0 +1,157 @@
+"""模型路由 — 依最近的延遲、錯誤率與 429 比例，為每種任務挑選模型，並沿設定的備援鏈 fallback
+
+備援鏈預設見 DEFAULT_ROUTES，可用 routes.json（或 MODEL_ROUTES_CONFIG 指定的 JSON 檔）覆寫：
+    {"article": ["gemini-2.5-pro", "gemini-2.5-flash"], "image": ["gemini-2.5-flash-image"]}
+
+健康狀態來自 metrics 紀錄（每個模型最近 WINDOW_SECONDS 秒內的呼叫），判定為降級的模型排到鏈尾：
+    - 連續失敗 CONSECUTIVE_FAILURES 次，或
+    - 至少 MIN_SAMPLES 筆時錯誤率 ≥ MAX_ERROR_RATE、429 比例 ≥ MAX_THROTTLE_RATE，或
+    - 延遲中位數超過該任務的 SLOW_SECONDS
+舊紀錄過了視窗就不再計入，降級的模型之後會自然回到原本的順序。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+
+ROUTES_CONFIG = Path(os.getenv("MODEL_ROUTES_CONFIG", Path(__file__).parent.parent / "routes.json"))
+
+DEFAULT_ROUTES = {
+    "article": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+    "image_prompts": ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+    "image": ["gemini-3-pro-image-preview", "gemini-2.5-flash-image"],
+}
+
+# 延遲中位數超過這個秒數視為變慢（不含配額等待）
+SLOW_SECONDS = {
+    "article": 45,
+    "image_prompts": 30,
+    "image": 90,
+}
+
+WINDOW_SECONDS = 300
+WINDOW_SIZE = 50
+MIN_SAMPLES = 4
+CONSECUTIVE_FAILURES = 2
+MAX_ERROR_RATE = 0.5
+MAX_THROTTLE_RATE = 0.3
+
+# metrics operation → 任務
+OPERATION_TASKS = {
+    "generate_article": "article",
+    "generate_article_stream": "article",
+    "generate_image_prompts": "image_prompts",
+    "generate_image_prompts_stream": "image_prompts",
+    "generate_image": "image",
+}
+
+
+def load_routes(path: Path = ROUTES_CONFIG) -> dict:
+    routes = {k: list(v) for k, v in DEFAULT_ROUTES.items()}
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            routes.update(json.load(f))
+    return routes
+
+
+class ModelHealth:
+    """一個模型在某種任務上最近的呼叫結果"""
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        # (ts, latency, error, throttled)
+        self._samples = deque(maxlen=window)
+        self.consecutive_failures = 0
+
+    def observe(self, latency: float, error: bool, throttled: bool):
+        self._samples.append((time.time(), latency, error, throttled))
+        self.consecutive_failures = self.consecutive_failures + 1 if error else 0
+
+    def recent(self) -> list:
+        cutoff = time.time() - WINDOW_SECONDS
+        return [s for s in self._samples if s[0] >= cutoff]
+
+    def stats(self) -> dict:
+        samples = self.recent()
+        if not samples:
+            return {"calls": 0, "error_rate": 0.0, "throttle_rate": 0.0, "p50_s": None,
+                    "consecutive_failures": 0}
+        latencies = sorted(s[1] for s in samples if not s[2])
+        return {
+            "calls": len(samples),
+            "error_rate": sum(s[2] for s in samples) / len(samples),
+            "throttle_rate": sum(s[3] for s in samples) / len(samples),
+            "p50_s": latencies[len(latencies) // 2] if latencies else None,
+            # 視窗外的連續失敗不再計入
+            "consecutive_failures": min(self.consecutive_failures, len(samples)),
+        }
+
+
+class ModelRouter:
+    """
+    candidates(task) 回傳依序嘗試的模型：健康的模型維持設定順序在前，
+    降級的模型依嚴重程度排在後面（全部降級時仍會嘗試，不直接失敗）。
+    """
+
+    def __init__(self, routes: dict = None, catalog=None):
+        self.routes = routes if routes is not None else load_routes()
+        self.catalog = catalog
+        self._health = defaultdict(ModelHealth)
+        self._lock = threading.Lock()
+
+    def __call__(self, record: dict):
+        """metrics hook：記錄每次 Gemini 呼叫的結果"""
+        task = OPERATION_TASKS.get(record["operation"])
+        if record["service"] != "gemini" or task is None or not record.get("model"):
+            return
+        if record["outcome"] not in ("ok", "error"):
+            return
+        latency = max(0.0, (record["wall_time"] or 0) - (record.get("quota_wait") or 0))
+        with self._lock:
+            self._health[(task, record["model"])].observe(
+                latency, record["outcome"] == "error", record.get("status") == 429
+            )
+
+    def health(self, task: str, model: str) -> dict:
+        with self._lock:
+            return self._health[(task, model)].stats()
+
+    def degradation(self, task: str, model: str) -> float:
+        """0 = 健康；越大越不適合（用於排序降級的模型）"""
+        stats = self.health(task, model)
+        penalty = 0.0
+        if stats["consecutive_failures"] >= CONSECUTIVE_FAILURES:
+            penalty += stats["consecutive_failures"]
+        if stats["calls"] >= MIN_SAMPLES:
+            if stats["error_rate"] >= MAX_ERROR_RATE:
+                penalty += stats["error_rate"] * 2
+            if stats["throttle_rate"] >= MAX_THROTTLE_RATE:
+                penalty += stats["throttle_rate"] * 2
+        slow = SLOW_SECONDS.get(task)
+        if slow and stats["p50_s"] is not None and stats["p50_s"] > slow:
+            penalty += stats["p50_s"] / slow
+        return penalty
+
+    def candidates(self, task: str, tokens: int = None) -> list[str]:
+        chain = list(self.routes.get(task) or [])
+        if self.catalog is not None:
+            usable = [m for m in chain if self.catalog.available(m, tokens=tokens)]
+            # 目錄中都找不到時保留原設定，由 API 回報錯誤
+            chain = usable or chain
+        ranked = [(self.degradation(task, m), i, m) for i, m in enumerate(chain)]
+        # 健康的模型維持設定順序；降級的依嚴重程度排後
+        return [m for _, _, m in sorted(ranked, key=lambda r: (r[0] > 0, r[0], r[1]))]
+
+    def choose(self, task: str, tokens: int = None) -> str:
+        return self.candidates(task, tokens)[0]
+
+    def summary(self) -> list[dict]:
+        rows = []
+        for task, chain in self.routes.items():
+            for model in chain:
+                rows.append({"task": task, "model": model, **self.health(task, model),
+                             "degraded": self.degradation(task, model) > 0})
+        return rows
@@ -0,0 +1,56 @@
+"""背景預先生成 — 使用者還在編輯時，先在背景跑下一步的 Gemini 呼叫"""
+
+import hashlib
+
+from services.jobs import Job, JobCancelled, submit
+
+
+def content_key(text: str) -> str:
+    """以內容雜湊當作預先生成結果的 key，內容一改就對不上"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Prefetch:
+    """一筆背景預先生成的工作，綁定產生它的輸入內容"""
+
+    def __init__(self, key: str, job: Job):
+        self.key = key
+        self.job = job
+
+    def matches(self, text: str) -> bool:
+        return self.key == content_key(text)
+
+    def result(self, timeout: float = None):
+        return self.job.result(timeout=timeout)
+
+    def discard(self):
+        """輸入已改變，丟棄結果（尚未開始的話直接取消）"""
+        self.job.cancel()
+
+
+# 圖片 Prompt 固定為 3 組風格（IMAGE_PROMPT_SCHEMA 的 minItems / maxItems）
+IMAGE_PROMPT_COUNT = 3
+
+
+def image_prompts_task(job, article: str, no_cache: bool = False) -> list[dict]:
+    """串流生成圖片 Prompt，每完成一組風格就更新 job.partial（list），頁面可先顯示已完成的卡片"""
+    from services.gemini_service import generate_image_prompts_stream
+
+    prompts = []
+    for prompt in generate_image_prompts_stream(article, no_cache=no_cache):
+        if job.cancelled:
+            raise JobCancelled()
+        prompts.append(prompt)
+        job.report(progress=min(1.0, len(prompts) / IMAGE_PROMPT_COUNT), partial=list(prompts),
+                   message=f"{len(prompts)}/{IMAGE_PROMPT_COUNT} 完成")
+    return prompts
+
+
+def prefetch_image_prompts(article: str) -> Prefetch:
+    """在背景開始生成圖片 Prompt，結果同時會寫入回應快取"""
+    return Prefetch(content_key(article), submit(image_prompts_task, article, tag="prefetch"))
+
+
+def prefetched_image_prompts(article: str, prompts: list[dict]) -> Prefetch:
+    """已有現成的圖片 Prompt（例如批次草稿）時包成 Prefetch，文章未修改時步驟 3 直接接手"""
+    return Prefetch(content_key(article), submit(lambda _job: list(prompts), tag="prefetch"))
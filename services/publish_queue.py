@@ -0,0 +1,243 @@
+"""
+發布佇列 — SQLite 持久化的排程發文佇列，由 publish_worker.py 在背景上傳
+
+worker 每輪寫入 heartbeat：外部 worker（python publish_worker.py）在跑時，
+Streamlit 內建的 worker thread 只回報 heartbeat、不取工作。
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+QUEUE_DB = DATA_DIR / "publish_queue.sqlite3"
+
+# 工作狀態
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+UNKNOWN = "unknown"    # 已送出但沒有明確結果（逾時、5xx、worker 中斷），貼文可能已發布，確認前不會重送
+
+# 暫時性失敗的重試：最多 5 次，間隔 30 秒起指數成長
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+
+# worker 種類：獨立執行的 publish_worker.py / Streamlit process 內的 thread
+EXTERNAL = "external"
+IN_APP = "in_app"
+
+# 超過這麼久沒有 heartbeat 的 worker 視為已停止
+HEARTBEAT_TIMEOUT = 30
+
+# 結果不明的工作過多久才到粉專動態確認（讓 Facebook 有時間把貼文放進動態）
+VERIFY_DELAY_SECONDS = 60
+
+_COLUMNS = (
+    "id", "brand", "message", "image_mime", "publish_at", "status", "attempts",
+    "next_attempt_at", "post_id", "error", "latency", "created_at", "updated_at",
+)
+
+
+class PublishQueue:
+    """
+    以 SQLite 實作的發布佇列。每次操作各自開連線，UI 與 worker process 可同時存取。
+    """
+
+    def __init__(self, path: Path = QUEUE_DB, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    brand TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    image BLOB,
+                    image_mime TEXT,
+                    publish_at REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    post_id TEXT,
+                    error TEXT,
+                    latency REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(status, next_attempt_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, kind TEXT NOT NULL, beat_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, brand: str, message: str, image: bytes = None, image_mime: str = None,
+                publish_at: float = None) -> int:
+        """加入一篇待發布貼文；publish_at 為 Unix 時間，None 表示立即發布。回傳工作 ID"""
+        now = time.time()
+        publish_at = publish_at or now
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (brand, message, image, image_mime, publish_at, status, next_attempt_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (brand, message, image, image_mime, publish_at, PENDING, publish_at, now, now),
+            )
+            return cur.lastrowid
+
+    def get(self, job_id: int):
+        """取得工作狀態（不含圖片內容）；不存在回傳 None"""
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def list_jobs(self, limit: int = 50) -> list[dict]:
+        """最近的工作（新到舊），供 UI 顯示"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs ORDER BY publish_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def claim_due(self, limit: int, exclude_brands=()) -> list[dict]:
+        """
+        取出已到期的工作並標記為 running（含圖片內容）；同一筆只會被一個 worker 取得。
+        exclude_brands 為目前沒有空位的粉專，這些粉專的工作留在佇列中。
+        """
+        now = time.time()
+        exclude_brands = tuple(exclude_brands)
+        skip = f" AND brand NOT IN ({', '.join('?' * len(exclude_brands))})" if exclude_brands else ""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)}, image FROM jobs"
+                f" WHERE status = ? AND next_attempt_at <= ?{skip} ORDER BY next_attempt_at LIMIT ?",
+                (PENDING, now, *exclude_brands, limit),
+            ).fetchall()
+            jobs = [dict(zip(_COLUMNS + ("image",), row)) for row in rows]
+            for job in jobs:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (RUNNING, now, job["id"]),
+                )
+                job["attempts"] += 1
+        return jobs
+
+    def mark_done(self, job_id: int, post_id: str, latency: float):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, post_id = ?, latency = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (DONE, post_id, latency, time.time(), job_id),
+            )
+
+    def mark_failed(self, job_id: int, error: str, attempts: int, retryable: bool, latency: float = None):
+        """記錄失敗；確定沒有發布出去的暫時性錯誤且還有次數時排回佇列（指數退避），否則標記為 failed"""
+        now = time.time()
+        with self._connect() as conn:
+            if retryable and attempts < self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, next_attempt_at = ?, error = ?, latency = ?, updated_at = ? WHERE id = ?",
+                    (PENDING, now + RETRY_BASE_SECONDS * 2 ** (attempts - 1), error, latency, now, job_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, latency = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, error, latency, now, job_id),
+                )
+
+    def mark_unknown(self, job_id: int, error: str, latency: float = None):
+        """請求已送出但結果不明：不自動重送，等 worker 到粉專動態確認或由使用者判斷"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, next_attempt_at = ?, error = ?, latency = ?, updated_at = ? WHERE id = ?",
+                (UNKNOWN, now + VERIFY_DELAY_SECONDS, error, latency, now, job_id),
+            )
+
+    def due_for_verification(self, limit: int = 10) -> list[dict]:
+        """到了該去粉專動態確認的結果不明工作（不含圖片內容）"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE status = ? AND next_attempt_at <= ?"
+                " ORDER BY next_attempt_at LIMIT ?",
+                (UNKNOWN, time.time(), limit),
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def defer_verification(self, job_id: int, error: str = None, delay: float = None):
+        """
+        這次沒能確認：delay 秒後再查一次；delay 為 None 表示不再自動確認，留給使用者判斷。
+        """
+        now = time.time()
+        next_at = now + delay if delay is not None else float("inf")
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET next_attempt_at = ?, error = COALESCE(?, error), updated_at = ? WHERE id = ? AND status = ?",
+                (next_at, error, now, job_id, UNKNOWN),
+            )
+
+    def retry(self, job_id: int):
+        """把失敗（或已確認沒有發布出去）的工作重新排入佇列（立即發布）"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ?"
+                " WHERE id = ? AND status IN (?, ?)",
+                (PENDING, now, now, job_id, FAILED, UNKNOWN),
+            )
+
+    def cancel(self, job_id: int) -> bool:
+        """刪除尚未開始的工作；已在上傳中或已完成則回傳 False"""
+        with self._connect() as conn:
+            cur = conn.execute("DELETE FROM jobs WHERE id = ? AND status = ?", (job_id, PENDING))
+            return cur.rowcount > 0
+
+    def heartbeat(self, worker_id: str, kind: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (id, kind, beat_at) VALUES (?, ?, ?)", (worker_id, kind, time.time())
+            )
+
+    def live_workers(self, kind: str = None, exclude: str = None) -> list[str]:
+        """HEARTBEAT_TIMEOUT 秒內有回報的 worker ID；kind 只看該種類，exclude 排除自己"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM workers WHERE beat_at >= ? AND (? IS NULL OR kind = ?) AND id != COALESCE(?, '')",
+                (time.time() - HEARTBEAT_TIMEOUT, kind, kind, exclude),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_interrupted(self) -> int:
+        """worker 啟動時呼叫：上次中斷時卡在 running 的工作可能已經上傳，標記為結果不明"""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, next_attempt_at = ?, error = ?, updated_at = ? WHERE status = ?",
+                (UNKNOWN, now + VERIFY_DELAY_SECONDS, "worker 中斷時正在上傳", now, RUNNING),
+            )
+            return cur.rowcount
+
+
+_queue = None
+
+
+def get_publish_queue() -> PublishQueue:
+    """取得 process 共用的佇列實例"""
+    global _queue
+    if _queue is None:
+        _queue = PublishQueue()
+    return _queue
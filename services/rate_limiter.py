@@ -0,0 +1,337 @@
+"""配額管理 — 跨 process 共用的 token bucket（SQLite），每個模型 / 粉專各自一組 RPM / TPM 限制
+
+bucket 名稱：
+    model:<model>:rpm   每分鐘請求數
+    model:<model>:tpm   每分鐘 token 數（送出前以估計值扣，回應後依 usageMetadata 補差額）
+    page:<page_id>:rpm  每個粉專的 Graph API 請求數
+
+限制值預設見 DEFAULT_LIMITS，可用 quotas.json（或 QUOTA_CONFIG 指定的 JSON 檔）覆寫：
+    {"model:gemini-3-pro-image-preview": {"rpm": 10}, "page:*": {"rpm": 30}}
+
+收到 429 / Retry-After 或 Facebook 限流錯誤時，該 bucket 暫停到 Retry-After 結束，
+並把速率降到原本的 70%（最低 10%），之後每秒回升 1%。
+http_client.request / arequest 帶 buckets 時，429 的重送也先在這裡重新取得額度（見 requeue）。
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+QUOTA_DB = DATA_DIR / "quota.sqlite3"
+QUOTA_CONFIG = Path(os.getenv("QUOTA_CONFIG", Path(__file__).parent.parent / "quotas.json"))
+
+DEFAULT_LIMITS = {
+    "model:gemini-2.5-flash": {"rpm": 1000, "tpm": 1_000_000},
+    "model:gemini-3-pro-image-preview": {"rpm": 20, "tpm": 100_000},
+    "model:*": {"rpm": 60, "tpm": 250_000},
+    "page:*": {"rpm": 60},
+}
+
+# bucket 容量 = 幾秒的額度；越小越平均，不會先爆量再被 429
+BURST_SECONDS = 5
+
+# 429 後的速率調整
+PENALTY_FACTOR = 0.7
+MIN_SCALE = 0.1
+RECOVERY_PER_SECOND = 0.01
+DEFAULT_RETRY_AFTER = 5.0
+
+# 單次 acquire 最多等待的時間
+MAX_WAIT_SECONDS = 120
+
+# 送出前估計的輸出 token 數
+ESTIMATED_OUTPUT_TOKENS = 1024
+
+
+def load_limits(path: Path = QUOTA_CONFIG) -> dict:
+    limits = {k: dict(v) for k, v in DEFAULT_LIMITS.items()}
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for key, value in json.load(f).items():
+                limits.setdefault(key, {}).update(value)
+    return limits
+
+
+class QuotaExceeded(RuntimeError):
+    """等待額度超過上限時拋出"""
+
+
+class QuotaManager:
+    """
+    以 SQLite 實作的 token bucket。每次操作各自開連線並以 BEGIN IMMEDIATE 鎖定，
+    Streamlit、batch CLI、publish worker 等多個 process 共用同一份額度。
+    """
+
+    def __init__(self, path: Path = QUOTA_DB, limits: dict = None):
+        self.path = Path(path)
+        self.limits = limits if limits is not None else load_limits()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    scale REAL NOT NULL,
+                    blocked_until REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _limit_per_minute(self, name: str):
+        """name = "<kind>:<id>:<rpm|tpm>"；找不到設定時用 "<kind>:*" 的值，沒有設定則不限"""
+        kind, _, rest = name.partition(":")
+        ident, _, unit = rest.rpartition(":")
+        for key in (f"{kind}:{ident}", f"{kind}:*"):
+            if unit in self.limits.get(key, {}):
+                return self.limits[key][unit]
+        return None
+
+    def _try_acquire(self, name: str, amount: float) -> float:
+        """嘗試扣除額度；成功回傳 0，否則回傳建議等待秒數"""
+        per_minute = self._limit_per_minute(name)
+        if not per_minute:
+            return 0.0
+        base_rate = per_minute / 60.0
+        capacity = max(1.0, base_rate * BURST_SECONDS, amount)
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, scale, blocked_until, updated_at FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                if row is None:
+                    tokens, scale, blocked_until, updated_at = capacity, 1.0, 0.0, now
+                else:
+                    tokens, scale, blocked_until, updated_at = row
+
+                elapsed = max(0.0, now - updated_at)
+                scale = min(1.0, scale + elapsed * RECOVERY_PER_SECOND)
+                rate = base_rate * scale
+                tokens = min(max(capacity * scale, amount), tokens + elapsed * rate)
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif tokens >= amount:
+                    tokens -= amount
+                    wait = 0.0
+                else:
+                    wait = (amount - tokens) / rate
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, scale, blocked_until, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (name, tokens, scale, blocked_until, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire(self, name: str, amount: float = 1, max_wait: float = MAX_WAIT_SECONDS, sleep=time.sleep) -> float:
+        """阻塞直到取得額度，回傳實際等待秒數；sleep 可換成可中斷的等待（例如 Deadline.sleep）"""
+        started = time.time()
+        deadline = started + max_wait
+        while True:
+            wait = self._try_acquire(name, amount)
+            if wait <= 0:
+                return time.time() - started
+            if time.time() + wait > deadline:
+                raise QuotaExceeded(f"{name} 額度不足，需等待 {wait:.1f} 秒")
+            sleep(wait)
+
+    async def aacquire(self, name: str, amount: float = 1, max_wait: float = MAX_WAIT_SECONDS) -> float:
+        """acquire 的非同步版本（SQLite 操作在 thread 中執行）"""
+        started = time.time()
+        deadline = started + max_wait
+        while True:
+            wait = await asyncio.to_thread(self._try_acquire, name, amount)
+            if wait <= 0:
+                return time.time() - started
+            if time.time() + wait > deadline:
+                raise QuotaExceeded(f"{name} 額度不足，需等待 {wait:.1f} 秒")
+            await asyncio.sleep(wait)
+
+    def consume(self, name: str, amount: float):
+        """不等待地扣除（或以負值歸還）額度，用於回應後補 token 差額"""
+        if not amount or not self._limit_per_minute(name):
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE buckets SET tokens = tokens - ? WHERE name = ?", (amount, name)
+            )
+
+    def penalize(self, name: str, retry_after: float = None):
+        """收到 429：暫停到 Retry-After 結束，並降低之後的速率"""
+        if not self._limit_per_minute(name):
+            return
+        now = time.time()
+        retry_after = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT scale FROM buckets WHERE name = ?", (name,)).fetchone()
+            scale = max(MIN_SCALE, (row[0] if row else 1.0) * PENALTY_FACTOR)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, scale, blocked_until, updated_at) VALUES (?, 0, ?, ?, ?)",
+                (name, scale, now + retry_after, now),
+            )
+            conn.execute("COMMIT")
+
+    def reset(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM buckets")
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_quota_manager() -> QuotaManager:
+    """取得 process 共用的配額管理器"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = QuotaManager()
+    return _manager
+
+
+# ─── 服務呼叫用的輔助函式 ─── #
+
+def model_buckets(model: str) -> tuple[str, str]:
+    return f"model:{model}:rpm", f"model:{model}:tpm"
+
+
+def page_bucket(page_id: str) -> str:
+    return f"page:{page_id}:rpm"
+
+
+def estimate_tokens(*texts: str) -> int:
+    """粗估：中英混合約 2 字元 1 token，加上預估輸出"""
+    return sum(len(t or "") for t in texts) // 2 + ESTIMATED_OUTPUT_TOKENS
+
+
+def acquire_model(model: str, estimated_tokens: int, record: dict = None, max_wait: float = MAX_WAIT_SECONDS,
+                  deadline=None):
+    """
+    取得模型的 RPM + TPM 額度；等待時間累加到 metrics 紀錄的 quota_wait。
+    deadline 被取消時等待立即中止（拋出 DeadlineExceeded）。
+    """
+    rpm, tpm = model_buckets(model)
+    manager = get_quota_manager()
+    sleep = time.sleep if deadline is None else deadline.sleep
+    waited = manager.acquire(rpm, max_wait=max_wait, sleep=sleep)
+    try:
+        waited += manager.acquire(tpm, estimated_tokens, max_wait=max(0.0, max_wait - waited), sleep=sleep)
+    except BaseException:
+        # TPM 等不到（QuotaExceeded / 被取消）時歸還已扣的 RPM，沒送出的請求不佔額度
+        manager.consume(rpm, -1)
+        raise
+    if record is not None:
+        record["quota_wait"] += round(waited, 4)
+
+
+async def aacquire_model(model: str, estimated_tokens: int, record: dict = None, max_wait: float = MAX_WAIT_SECONDS):
+    rpm, tpm = model_buckets(model)
+    manager = get_quota_manager()
+    waited = await manager.aacquire(rpm, max_wait=max_wait)
+    try:
+        waited += await manager.aacquire(tpm, estimated_tokens, max_wait=max(0.0, max_wait - waited))
+    except BaseException:
+        await asyncio.to_thread(manager.consume, rpm, -1)
+        raise
+    if record is not None:
+        record["quota_wait"] += round(waited, 4)
+
+
+def acquire_page(page_id: str, record: dict = None):
+    waited = get_quota_manager().acquire(page_bucket(page_id))
+    if record is not None:
+        record["quota_wait"] += round(waited, 4)
+
+
+async def aacquire_page(page_id: str, record: dict = None):
+    waited = await get_quota_manager().aacquire(page_bucket(page_id))
+    if record is not None:
+        record["quota_wait"] += round(waited, 4)
+
+
+def settle_tokens(model: str, estimated_tokens: int, record: dict):
+    """以 metrics 紀錄中的實際 total_tokens 補扣 / 歸還差額"""
+    actual = record.get("total_tokens")
+    if actual is not None:
+        get_quota_manager().consume(model_buckets(model)[1], actual - estimated_tokens)
+
+
+def _retry_after_seconds(resp):
+    value = resp.headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def requeue(resp, buckets: tuple, max_wait: float = MAX_WAIT_SECONDS, sleep=time.sleep) -> bool:
+    """
+    http_client.request 在 429 重送前呼叫：依 Retry-After 暫停 buckets，再重新取得一個 RPM（buckets[0]）額度，
+    重送和其他請求一樣排隊，不會繞過配額管理器。等不到額度時回傳 False，不再重送。
+    """
+    manager = get_quota_manager()
+    for name in buckets:
+        manager.penalize(name, _retry_after_seconds(resp))
+    try:
+        manager.acquire(buckets[0], max_wait=max_wait, sleep=sleep)
+    except QuotaExceeded:
+        return False
+    return True
+
+
+async def arequeue(resp, buckets: tuple, max_wait: float = MAX_WAIT_SECONDS) -> bool:
+    """requeue 的非同步版本（見 http_client.arequest）"""
+    manager = get_quota_manager()
+    for name in buckets:
+        await asyncio.to_thread(manager.penalize, name, _retry_after_seconds(resp))
+    try:
+        await manager.aacquire(buckets[0], max_wait=max_wait)
+    except QuotaExceeded:
+        return False
+    return True
+
+
+def observe_throttle(resp, *buckets: str) -> bool:
+    """回應（或 urllib3 重試歷程中）出現 429 時，對相關 bucket 降速；回傳是否被限流"""
+    throttled = resp.status_code == 429
+    raw_retries = getattr(getattr(resp, "raw", None), "retries", None)
+    if raw_retries is not None:
+        throttled = throttled or any(h.status == 429 for h in raw_retries.history)
+    requeued = False
+    extensions = getattr(resp, "extensions", None)
+    if isinstance(extensions, dict):
+        throttled = throttled or extensions.get("throttled", False)
+        requeued = extensions.get("requeued", False)
+    # 重送前 requeue 已經降速過，最後仍是 429 才需要再處理
+    if throttled and (resp.status_code == 429 or not requeued):
+        # 重試後已成功：只降速不暫停；仍是 429 才依 Retry-After 暫停
+        retry_after = _retry_after_seconds(resp) if resp.status_code == 429 else 0.0
+        for name in buckets:
+            get_quota_manager().penalize(name, retry_after)
+    return throttled
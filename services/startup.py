@@ -0,0 +1,154 @@
+"""冷啟動 — 背景預先建立連線 / context cache，並記錄 import 與第一次請求的耗時
+
+app.py 在最前面以 st.cache_resource 呼叫 prewarm()，整個 process 只執行一次：
+    1. 在背景匯入 gemini_service / facebook_service
+    2. 對 Gemini 與 Graph API 各送一個 HEAD，讓共用 Session 的連線池先完成 TLS 握手
+    3. 取得模型目錄（過期時），並預先建立（或確認無法建立）各品牌 system prompt 的 context cache
+    4. 啟動 Token 健康檢查、初始化本機 SQLite（回應快取、配額）
+
+report() 回傳各階段耗時，以及每種服務呼叫第一次完成時距離 process 啟動的秒數。
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+# 本模組越早匯入，量到的冷啟動時間越準
+PROCESS_START = time.perf_counter()
+
+_timings: dict[str, float] = {}
+_first_requests: dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def since_start() -> float:
+    return round(time.perf_counter() - PROCESS_START, 4)
+
+
+@contextmanager
+def timed(name: str):
+    """記錄一段啟動工作的耗時（同名只保留第一次）"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _timings.setdefault(name, round(time.perf_counter() - t0, 4))
+
+
+def mark(name: str):
+    """記錄某個時間點距離 process 啟動的秒數（同名只保留第一次）"""
+    with _lock:
+        _timings.setdefault(name, since_start())
+
+
+def _first_request_hook(record: dict):
+    key = f"{record['service']}/{record['operation']}"
+    if key in _first_requests or record["outcome"] == "cache_hit":
+        return
+    with _lock:
+        _first_requests.setdefault(key, {
+            "since_start": since_start(),
+            "wall_time": record["wall_time"],
+            "outcome": record["outcome"],
+        })
+
+
+def _warm_connection(name: str, url: str):
+    """送一個 HEAD 讓連線留在 request() 的 keep-alive 池中；回應內容與狀態碼不重要"""
+    from services.http_client import warm
+
+    with timed(f"connect_{name}"):
+        try:
+            warm(name, url)
+        except Exception:
+            pass
+
+
+def _warm_model_catalog():
+    """目錄過期（或第一次啟動）時先取得，之後的路由才能排除不支援的模型"""
+    from services.gemini_service import get_model_catalog
+
+    with timed("model_catalog"):
+        catalog = get_model_catalog()
+        if catalog.stale:
+            try:
+                catalog.refresh()
+            except Exception:
+                pass
+
+
+def _warm_context_caches():
+    from prompts.image_prompt import IMAGE_PROMPT_SYSTEM_PROMPT
+    from services.brands import list_brands
+    from services.gemini_service import _get_context_cache, get_model_router
+
+    with timed("context_caches"):
+        router = get_model_router()
+        article_model, prompts_model = router.choose("article"), router.choose("image_prompts")
+        for system_prompt in dict.fromkeys(b.system_prompt for b in list_brands()):
+            _get_context_cache().get(article_model, system_prompt)
+        _get_context_cache().get(prompts_model, IMAGE_PROMPT_SYSTEM_PROMPT)
+
+
+def _run_prewarm():
+    from services import metrics
+
+    metrics.add_hook(_first_request_hook)
+
+    with timed("import_services"):
+        from services import facebook_service, gemini_service
+
+    with timed("local_stores"):
+        from services.rate_limiter import get_quota_manager
+        from services.response_cache import get_cache
+        get_cache()
+        get_quota_manager()
+
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="prewarm") as pool:
+        pool.submit(_warm_connection, "gemini", gemini_service.BASE_URL)
+        pool.submit(_warm_connection, "facebook", facebook_service.FB_GRAPH_URL)
+        pool.submit(_warm_model_catalog)
+        pool.submit(_warm_context_caches)
+
+    from services.token_health import get_token_monitor
+    get_token_monitor()
+    mark("prewarm_done")
+
+
+class Prewarm:
+    """背景預熱的 handle；放在 st.cache_resource 中，整個 process 共用一份"""
+
+    def __init__(self):
+        self.started_at = since_start()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="prewarm")
+        self.error = None
+        self._thread.start()
+
+    def _run(self):
+        try:
+            _run_prewarm()
+        except Exception as e:
+            # 預熱失敗只會讓第一次請求慢一點，不影響功能
+            self.error = f"{type(e).__name__}: {e}"
+
+    def done(self) -> bool:
+        return not self._thread.is_alive()
+
+    def wait(self, timeout: float = None) -> bool:
+        self._thread.join(timeout)
+        return self.done()
+
+
+def prewarm() -> Prewarm:
+    return Prewarm()
+
+
+def report() -> dict:
+    with _lock:
+        return {
+            "timings": dict(_timings),
+            "first_requests": {k: dict(v) for k, v in _first_requests.items()},
+        }
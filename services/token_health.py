@@ -0,0 +1,219 @@
+"""Facebook Token 健康狀態 — 背景定期檢查各品牌的 Page Token，快取有效性、到期時間與權限
+
+    monitor = get_token_monitor()      # 第一次呼叫時啟動背景檢查 thread
+    status = monitor.get("default")    # 只讀快取（過期時在背景重新檢查），不阻塞
+    ensure_publishable("default")      # 發布前呼叫：Token 已失效時立刻拋出 FacebookAPIError（最多等 PUBLISH_CHECK_SECONDS）
+
+檢查內容：
+    - /debug_token：is_valid、expires_at、scopes
+    - /<page_id>：確認 Token 能讀取粉專（取得粉專名稱）
+
+網路錯誤 / 限流等暫時性失敗記為 UNKNOWN，不會擋住發布；只有 Graph API 明確回報失效才記為 INVALID。
+"""
+
+import threading
+import time
+
+import requests
+
+from services.brands import get_brand, list_brands
+from services.facebook_service import TOKEN_ERROR_CODES, FacebookAPIError, debug_token, verify_token
+
+
+# 狀態
+OK = "ok"
+INVALID = "invalid"
+UNKNOWN = "unknown"
+
+# 快取有效時間；背景 thread 每隔 REFRESH_INTERVAL 秒把所有品牌檢查一次
+TTL_SECONDS = 600
+REFRESH_INTERVAL = 300
+
+# 發布前最多等檢查結果幾秒；逾時（例如 Graph API 慢或額度要排隊）就不擋發布，檢查在背景繼續
+PUBLISH_CHECK_SECONDS = 3
+
+# 剩不到幾天到期時在側邊欄提醒
+EXPIRY_WARNING_DAYS = 7
+
+# 發布所需的權限
+REQUIRED_SCOPES = {"pages_manage_posts"}
+
+
+class TokenStatus:
+    """一個品牌的 Token 檢查結果"""
+
+    def __init__(self, brand: str, state: str, error: str = None, page_name: str = None,
+                 expires_at: float = None, scopes: list = None):
+        self.brand = brand
+        self.state = state
+        self.error = error
+        self.page_name = page_name
+        # None = 不會過期（Graph API 回傳 0）
+        self.expires_at = expires_at
+        self.scopes = list(scopes or [])
+        self.checked_at = time.time()
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self.checked_at > TTL_SECONDS
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+    @property
+    def invalid(self) -> bool:
+        return self.state == INVALID or self.expired
+
+    @property
+    def expiring_soon(self) -> bool:
+        return self.expires_at is not None and self.expires_at - time.time() < EXPIRY_WARNING_DAYS * 86400
+
+    @property
+    def missing_scopes(self) -> set:
+        return REQUIRED_SCOPES - set(self.scopes) if self.scopes else set()
+
+
+def check_token(brand: str) -> TokenStatus:
+    """實際向 Graph API 檢查一次（阻塞）"""
+    try:
+        try:
+            data = debug_token(brand)
+        except FacebookAPIError as e:
+            # debug_token 本身不允許（非 Token 失效）時，只靠粉專查詢判斷
+            if e.transient or e.code in TOKEN_ERROR_CODES:
+                raise
+            data = {"is_valid": True}
+        if not data.get("is_valid"):
+            message = data.get("error", {}).get("message", "Token 已失效")
+            return TokenStatus(brand, INVALID, error=message, scopes=data.get("scopes"))
+        page = verify_token(brand)
+    except ValueError as e:
+        # 品牌未設定 Token / Page ID
+        return TokenStatus(brand, INVALID, error=str(e))
+    except FacebookAPIError as e:
+        return TokenStatus(brand, UNKNOWN if e.transient else INVALID, error=str(e))
+    except requests.exceptions.RequestException as e:
+        return TokenStatus(brand, UNKNOWN, error=f"網路連線失敗：{e}")
+
+    return TokenStatus(
+        brand,
+        OK,
+        page_name=page.get("name"),
+        expires_at=data.get("expires_at") or None,
+        scopes=data.get("scopes"),
+    )
+
+
+class TokenMonitor:
+    """各品牌 Token 狀態的快取；同一品牌同時只會有一個檢查在進行"""
+
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._statuses: dict[str, TokenStatus] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        # 背景檢查中的品牌 → 完成時 set 的 Event
+        self._pending: dict[str, threading.Event] = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _brand_lock(self, brand: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(brand, threading.Lock())
+
+    def peek(self, brand: str):
+        """回傳快取的狀態（可能為 None 或已過期）"""
+        return self._statuses.get(brand)
+
+    def check(self, brand: str, force: bool = False) -> TokenStatus:
+        """重新檢查（阻塞）；其他 thread 剛檢查完時直接沿用其結果。force=True 時也重讀 secrets 中的 Token"""
+        if force:
+            get_brand(brand).refresh()
+        with self._brand_lock(brand):
+            status = self._statuses.get(brand)
+            if not force and status is not None and not status.stale:
+                return status
+            status = check_token(brand)
+            self._statuses[brand] = status
+            return status
+
+    def get(self, brand: str):
+        """不阻塞：回傳快取狀態，沒有或已過期時在背景重新檢查"""
+        status = self._statuses.get(brand)
+        if status is None or status.stale:
+            with self._lock:
+                if brand in self._pending:
+                    return status
+                self._pending[brand] = threading.Event()
+            threading.Thread(target=self._check_in_background, args=(brand,), daemon=True, name="token-check").start()
+        return status
+
+    def wait(self, brand: str, timeout: float):
+        """最多等 timeout 秒取得未過期的狀態（需要時在背景檢查）；等不到時回傳 None"""
+        status = self.get(brand)
+        if status is None or status.stale:
+            with self._lock:
+                event = self._pending.get(brand)
+            if event is not None:
+                event.wait(timeout)
+            status = self._statuses.get(brand)
+        return None if status is None or status.stale else status
+
+    def _check_in_background(self, brand: str):
+        try:
+            self.check(brand)
+        finally:
+            with self._lock:
+                self._pending.pop(brand).set()
+
+    def mark_invalid(self, brand: str, error: str):
+        """發布時 Graph API 回報 Token 失效，不必等下次檢查；下次使用時重讀 secrets（可能已換新 Token）"""
+        self._statuses[brand] = TokenStatus(brand, INVALID, error=error)
+        get_brand(brand).refresh()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="token-monitor")
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for brand in list_brands():
+                if self._stop.is_set():
+                    break
+                try:
+                    self.check(brand.key)
+                except Exception:
+                    # 背景檢查失敗不能讓 thread 結束
+                    pass
+            self._stop.wait(self.refresh_interval)
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_token_monitor() -> TokenMonitor:
+    """取得 process 共用的 TokenMonitor，並啟動背景檢查"""
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                _monitor = TokenMonitor()
+                _monitor.start()
+    return _monitor
+
+
+def ensure_publishable(brand: str):
+    """
+    發布前的快速檢查：快取過期或沒有時在背景檢查，最多等 PUBLISH_CHECK_SECONDS 秒；
+    確定 Token 已失效 / 過期就在上傳前拋出 FacebookAPIError，等不到結果則照常發布（由上傳本身回報錯誤）。
+    """
+    status = get_token_monitor().wait(brand, PUBLISH_CHECK_SECONDS)
+    if status is not None and status.invalid:
+        reason = "Token 已過期" if status.expired else status.error
+        raise FacebookAPIError(f"Facebook Token 無法使用，已取消發布：{reason}", code=190, transient=False)
@@ -0,0 +1,258 @@
+"""主題相似度索引 — 找出與過去素材 / 已發布文章幾乎相同的新素材，避免重複花錢生成
+
+向量：正規化後的文字取字元 2-gram 與 3-gram（中文不需斷詞），以 feature hashing（含正負號）
+投影到 DIMENSIONS 維，詞頻取 1 + log(tf) 後做 L2 正規化；相似度為 cosine（矩陣乘一個向量）。
+
+儲存（只會往後附加，其他 process 新增的項目在下次查詢時讀入）：
+    data/topic_index.f32     每列 DIMENSIONS 個 float32
+    data/topic_index.jsonl   每列一筆 {"draft_id", "kind", "brand", "preview", "created_at"}
+    data/topic_index.lock    跨 process 的 flock：寫入取排他鎖、讀取取共用鎖（Windows 上只有 process 內的鎖）；
+                             內容為重建次數（generation），其他 process 看到它改變就整個重新載入
+同一篇草稿同一種內容（kind）再次加入時，舊的那列不再參與比對。
+"""
+
+import json
+import math
+import os
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+INDEX_PATH = DATA_DIR / "topic_index"
+
+# 向量維度（2 的次方）；每篇 DIMENSIONS * 4 bytes，4 萬篇約 80 MB
+DIMENSIONS = 512
+NGRAM_SIZES = (2, 3)
+
+# cosine 相似度達到這個值視為「幾乎相同」
+NEAR_DUPLICATE_THRESHOLD = 0.5
+
+# 索引項目種類
+MATERIAL = "material"
+ARTICLE = "article"
+
+PREVIEW_CHARS = 60
+
+
+def normalize(text: str) -> str:
+    """全形 / 半形統一、英文小寫，只保留文字與數字（去掉空白與標點）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] in "LN")
+
+
+def ngrams(text: str) -> Counter:
+    text = normalize(text)
+    counts = Counter()
+    for n in NGRAM_SIZES:
+        counts.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return counts
+
+
+def vectorize(text: str, dims: int = DIMENSIONS) -> np.ndarray:
+    """文字 → L2 正規化的 float32 向量；沒有任何 n-gram 時為零向量"""
+    vector = np.zeros(dims, dtype=np.float32)
+    counts = ngrams(text)
+    if not counts:
+        return vector
+    hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in counts), dtype=np.uint32, count=len(counts))
+    weights = np.fromiter((1.0 + math.log(c) for c in counts.values()), dtype=np.float32, count=len(counts))
+    # 最高位元決定正負號，抵消 hash 碰撞造成的偏差
+    signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes & (dims - 1), signs * weights)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class TopicIndex:
+    """
+    記憶體中是一個 (N, DIMENSIONS) 的 float32 矩陣，容量不足時加倍；查詢是一次矩陣乘法。
+    可跨 thread 使用；多個 process 在檔案鎖內各自附加寫入同一組檔案。
+    """
+
+    def __init__(self, path: Path = INDEX_PATH, dims: int = DIMENSIONS):
+        self.dims = dims
+        self.vectors_path = Path(path).with_suffix(".f32")
+        self.meta_path = Path(path).with_suffix(".jsonl")
+        self.lock_path = Path(path).with_suffix(".lock")
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._generation = None
+        with self._lock, self._file_lock(exclusive=False):
+            self._reset()
+            self._sync()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """跨 process 的鎖；檔案大小一律在鎖內重新讀取，不沿用鎖外看到的值"""
+        with open(self.lock_path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            # 關檔時釋放
+            yield
+
+    def _read_generation(self) -> int:
+        """持有檔案鎖時呼叫；clear() 每次加一"""
+        try:
+            return int(self.lock_path.read_bytes() or 0)
+        except ValueError:
+            return 0
+
+    def _reset(self):
+        self._matrix = np.zeros((1024, self.dims), dtype=np.float32)
+        self._active = np.zeros(1024, dtype=bool)
+        self._meta: list[dict] = []
+        self._latest: dict[tuple, int] = {}
+        self._vectors_offset = 0
+        self._meta_offset = 0
+
+    def __len__(self) -> int:
+        return int(self._active[:len(self._meta)].sum())
+
+    def _grow(self, rows: int):
+        capacity = len(self._matrix)
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dims), dtype=np.float32)
+        matrix[:len(self._meta)] = self._matrix[:len(self._meta)]
+        active = np.zeros(capacity, dtype=bool)
+        active[:len(self._meta)] = self._active[:len(self._meta)]
+        self._matrix, self._active = matrix, active
+
+    def _append(self, vector: np.ndarray, meta: dict):
+        row = len(self._meta)
+        self._grow(row + 1)
+        self._matrix[row] = vector
+        self._active[row] = True
+        key = (meta["draft_id"], meta["kind"])
+        previous = self._latest.get(key)
+        if previous is not None:
+            self._active[previous] = False
+        self._latest[key] = row
+        self._meta.append(meta)
+
+    def _sync(self):
+        """讀入檔案中還沒載入的列（本 process 之前的紀錄，或其他 process 新加的）"""
+        generation = self._read_generation()
+        if generation != self._generation:
+            # 索引被重建過：新檔案可能已經比這裡的 offset 還長，只看大小判斷不出來，整個重新載入
+            self._reset()
+            self._generation = generation
+        if not self.meta_path.exists() or not self.vectors_path.exists():
+            return
+        size = self.meta_path.stat().st_size
+        if size == self._meta_offset:
+            return
+        if size < self._meta_offset:
+            # 檔案被手動刪除或截短
+            self._reset()
+        row_bytes = self.dims * 4
+        with open(self.meta_path, "rb") as f:
+            f.seek(self._meta_offset)
+            chunk = f.read()
+        # 最後一行還沒寫完時留到下次
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        lines = complete.splitlines()
+        with open(self.vectors_path, "rb") as f:
+            f.seek(self._vectors_offset)
+            raw = f.read(len(lines) * row_bytes)
+        lines = lines[:len(raw) // row_bytes]
+        vectors = np.frombuffer(raw[:len(lines) * row_bytes], dtype=np.float32).reshape(-1, self.dims)
+        for vector, line in zip(vectors, lines):
+            self._append(vector, json.loads(line))
+        self._meta_offset += sum(len(line) + 1 for line in lines)
+        self._vectors_offset += len(lines) * row_bytes
+
+    def _truncate_partial(self):
+        """
+        持有排他鎖時呼叫：_sync 之後還多出來的內容只可能是寫到一半就中斷的 process 留下的
+        （例如只寫了向量沒寫 meta），不截掉的話之後附加的列會和 meta 錯位。
+        """
+        for path, offset in ((self.vectors_path, self._vectors_offset), (self.meta_path, self._meta_offset)):
+            if path.exists() and path.stat().st_size > offset:
+                os.truncate(path, offset)
+
+    def add(self, draft_id: str, kind: str, text: str, brand: str = None):
+        """加入（或更新）一篇草稿的素材 / 文章"""
+        vector = vectorize(text, self.dims)
+        if not vector.any():
+            return
+        meta = {"draft_id": draft_id, "kind": kind, "brand": brand,
+                "preview": " ".join(text.split())[:PREVIEW_CHARS], "created_at": time.time()}
+        line = (json.dumps(meta, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            self._truncate_partial()
+            # 先寫向量再寫 meta；讀取時以兩者中較少的列數為準
+            with open(self.vectors_path, "ab") as f:
+                f.write(vector.tobytes())
+            with open(self.meta_path, "ab") as f:
+                f.write(line)
+            self._append(vector, meta)
+            self._vectors_offset += len(vector.tobytes())
+            self._meta_offset += len(line)
+
+    def clear(self):
+        """刪除索引檔（重建前使用）；generation 加一，其他 process 下次讀取時捨棄記憶體中的舊索引"""
+        with self._lock, self._file_lock(exclusive=True):
+            self.vectors_path.unlink(missing_ok=True)
+            self.meta_path.unlink(missing_ok=True)
+            self._generation = self._read_generation() + 1
+            self.lock_path.write_text(str(self._generation))
+            self._reset()
+
+    def search(self, text: str, k: int = 5, threshold: float = NEAR_DUPLICATE_THRESHOLD,
+               exclude: str = None) -> list[dict]:
+        """相似度 ≥ threshold 的草稿（每篇取最相似的一列），由高到低最多 k 篇；exclude 為要略過的草稿 ID"""
+        query = vectorize(text, self.dims)
+        if not query.any():
+            return []
+        with self._lock:
+            with self._file_lock(exclusive=False):
+                self._sync()
+            rows = len(self._meta)
+            if not rows:
+                return []
+            scores = self._matrix[:rows] @ query
+            scores[~self._active[:rows]] = -1.0
+            candidates = np.flatnonzero(scores >= threshold)
+            # 只排序超過門檻的列
+            ranked = candidates[np.argsort(-scores[candidates])]
+            results, seen = [], set()
+            for row in ranked:
+                meta = self._meta[row]
+                if meta["draft_id"] in seen or meta["draft_id"] == exclude:
+                    continue
+                seen.add(meta["draft_id"])
+                results.append({**meta, "score": round(float(scores[row]), 3)})
+                if len(results) >= k:
+                    break
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_topic_index() -> TopicIndex:
+    """取得 process 共用的索引（第一次呼叫時從磁碟載入）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = TopicIndex()
+    return _index
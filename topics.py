@@ -0,0 +1,65 @@
+"""
+主題相似度索引：查詢與重建
+
+用法：
+    python topics.py "冬天長輩容易跌倒..."     # 列出相似的過去素材 / 已發布文章
+    python topics.py --file material.txt --threshold 0.3
+    python topics.py --rebuild                 # 從草稿庫重建 data/topic_index.*
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# 確保 project root 在 sys.path
+PROJECT_ROOT = Path(__file__).parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from services.draft_store import PUBLISHED, get_draft_store
+from services.topic_index import ARTICLE, MATERIAL, NEAR_DUPLICATE_THRESHOLD, get_topic_index
+
+
+def rebuild() -> int:
+    """清空索引後重新加入草稿庫中每篇草稿的素材與已發布文章"""
+    index = get_topic_index()
+    index.clear()
+    # 舊到新加入，讓查詢結果的日期與草稿建立順序一致
+    drafts = sorted(get_draft_store().list_drafts(), key=lambda d: d["created_at"])
+    for draft in drafts:
+        index.add(draft["id"], MATERIAL, draft["raw_material"], brand=draft["brand"])
+        if draft["status"] == PUBLISHED and draft["article"]:
+            index.add(draft["id"], ARTICLE, draft["article"], brand=draft["brand"])
+    print(f"已重建：{len(drafts)} 篇草稿，{len(index)} 筆向量")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="查詢 / 重建主題相似度索引")
+    parser.add_argument("text", nargs="?", help="要比對的素材")
+    parser.add_argument("--file", type=Path, help="從檔案讀取素材")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD, help="相似度門檻 (0-1)")
+    parser.add_argument("-k", type=int, default=10, help="最多列出幾篇")
+    parser.add_argument("--rebuild", action="store_true", help="從草稿庫重建索引")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        return rebuild()
+    text = args.file.read_text(encoding="utf-8") if args.file else args.text
+    if not text:
+        parser.error("請提供素材文字或 --file")
+
+    index = get_topic_index()
+    start = time.perf_counter()
+    matches = index.search(text, k=args.k, threshold=args.threshold)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"索引 {len(index)} 筆，查詢 {elapsed:.1f} ms，相似 {len(matches)} 篇")
+    for match in matches:
+        when = time.strftime("%Y-%m-%d", time.localtime(match["created_at"]))
+        print(f"  {match['score']:.2f}  {match['draft_id']}  {match['kind']:<8} {match['brand']}  {when}  {match['preview']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())